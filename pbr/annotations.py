@@ -0,0 +1,199 @@
+import numpy as np
+
+from config import scene_config
+
+import projection
+import visibility
+
+# COCO-like annotations of a frame computed from the scene instead of from the rendered masks
+# Bounding boxes come from the projected bounding box corners of each object, keypoints (the ball's centre, goal post
+# bases, field line intersections and robot joints) are projected directly. All points of a frame are projected with
+# one call to projection.project_points for each camera
+#
+# Each annotation is {"category_id", "category", "name", "bbox": [x, y, width, height], "area", "iscrowd": 0,
+# "keypoints": [x, y, v, ...], "keypoint_names", "num_keypoints"} in pixels of the mask resolution, where v is 2 for
+# keypoints in the image and 0 (with x = y = 0) for keypoints out of view. Occlusion is not tested
+
+
+# Categories of the annotations, with the ids of their mask classes
+def categories():
+    resources = scene_config.resources
+    return [
+        {"id": resources["ball"]["mask"]["index"], "name": "ball"},
+        {"id": resources["goal"]["mask"]["index"], "name": "goal"},
+        {"id": resources["robot"]["mask"]["index"], "name": "robot"},
+        {"id": resources["field"]["mask"]["index"], "name": "field"},
+    ]
+
+
+# Named intersections of the field lines and marks on the ground, from the field configuration
+def field_points(field_cfg):
+    half_l = field_cfg["length"] / 2.0
+    half_w = field_cfg["width"] / 2.0
+    area_l = field_cfg["goal_area"]["length"]
+    area_w = field_cfg["goal_area"]["width"] / 2.0
+    radius = field_cfg["centre_circle_radius"]
+    penalty = field_cfg["penalty_mark_dist"]
+
+    points = [("centre_mark", (0.0, 0.0))]
+    for sy, side in [(1, "left"), (-1, "right")]:
+        points += [
+            ("halfway_{}_T".format(side), (0.0, sy * half_w)),
+            ("centre_circle_{}_X".format(side), (0.0, sy * radius)),
+        ]
+    for sx, end in [(1, "pos"), (-1, "neg")]:
+        points.append(("penalty_mark_{}".format(end), (sx * (half_l - penalty), 0.0)))
+        for sy, side in [(1, "left"), (-1, "right")]:
+            points += [
+                ("corner_{}_{}_L".format(end, side), (sx * half_l, sy * half_w)),
+                ("goal_area_{}_{}_T".format(end, side), (sx * half_l, sy * area_w)),
+                (
+                    "goal_area_{}_{}_L".format(end, side),
+                    (sx * (half_l - area_l), sy * area_w),
+                ),
+            ]
+
+    return [(name, (x, y, 0.0)) for name, (x, y) in points]
+
+
+# The objects and keypoints to annotate in a frame
+# Returns a list of ({annotation fields}, bounding box corners, keypoint names, keypoint world coordinates)
+def frame_objects(scene, frame):
+    config = frame["config"]
+    to_draw = frame["env_info"]["to_draw"]
+    ids = {c["name"]: c["id"] for c in categories()}
+
+    objects = []
+
+    if to_draw["ball"]:
+        ball = scene["ball"].obj
+        objects.append(
+            (
+                {"category": "ball", "name": ball.name},
+                visibility.box_corners([ball]),
+                ["centre"],
+                [tuple(ball.matrix_world.translation)],
+            )
+        )
+
+    if to_draw["goal"]:
+        half_width = config["goal"]["width"] / 2.0
+        for g in scene["goals"]:
+            x = g.obj.matrix_world.translation[0]
+            objects.append(
+                (
+                    {"category": "goal", "name": g.obj.name},
+                    visibility.box_corners([g.obj, g.rear]),
+                    ["left_post_base", "right_post_base"],
+                    [
+                        (x, np.sign(x) * half_width, 0.0),
+                        (x, -np.sign(x) * half_width, 0.0),
+                    ],
+                )
+            )
+
+    # Every robot but the camera robot
+    for r in scene["robots"][1:] + scene["misc_robots"]:
+        parts = sorted(r.objs.items())
+        objects.append(
+            (
+                {"category": "robot", "name": r.name, "model": r.model},
+                visibility.box_corners([r.obj]),
+                [name[len(r.name) + 1 :] for name, _ in parts],
+                [tuple(obj.matrix_world.translation) for _, obj in parts],
+            )
+        )
+
+    if to_draw["field"]:
+        points = field_points(config["field"])
+        objects.append(
+            (
+                {"category": "field", "name": "field"},
+                np.zeros((0, 3)),
+                [name for name, _ in points],
+                [p for _, p in points],
+            )
+        )
+
+    for fields, _, _, _ in objects:
+        fields["category_id"] = ids[fields["category"]]
+    return objects
+
+
+# Annotations of the objects of a frame seen by a camera
+def camera_annotations(objects, cam, cam_config, resolution):
+    width, height = resolution
+
+    # Project every point of the frame at once
+    points = [np.zeros((0, 3))]
+    for _, corners, _, keypoints in objects:
+        points += [
+            np.asarray(corners).reshape(-1, 3),
+            np.array(keypoints).reshape(-1, 3),
+        ]
+    pixels, valid = projection.project_points(
+        np.concatenate(points),
+        cam_config,
+        cam.cam.sensor_width,
+        cam.obj.matrix_world,
+        width,
+        height,
+    )
+    inside = (
+        valid
+        & (pixels[:, 0] >= 0)
+        & (pixels[:, 0] < width)
+        & (pixels[:, 1] >= 0)
+        & (pixels[:, 1] < height)
+    )
+
+    annotations = []
+    start = 0
+    for fields, corners, names, keypoints in objects:
+        n_corners = len(corners)
+        n_keypoints = len(keypoints)
+        c_pix = pixels[start : start + n_corners][valid[start : start + n_corners]]
+        k_pix = pixels[start + n_corners : start + n_corners + n_keypoints]
+        k_in = inside[start + n_corners : start + n_corners + n_keypoints]
+        start += n_corners + n_keypoints
+
+        # Box of the visible corners, or of the keypoints for objects without geometry
+        box_pix = c_pix if n_corners > 0 else k_pix[k_in]
+        bbox = None
+        if len(box_pix) > 0:
+            x0, y0 = np.clip(box_pix.min(axis=0), 0, [width, height])
+            x1, y1 = np.clip(box_pix.max(axis=0), 0, [width, height])
+            if x1 > x0 and y1 > y0:
+                bbox = [float(x0), float(y0), float(x1 - x0), float(y1 - y0)]
+
+        if bbox is None and not k_in.any():
+            continue
+
+        k_pix = np.where(k_in[:, None], k_pix, 0.0)
+        annotations.append(
+            {
+                **fields,
+                "bbox": bbox,
+                "area": 0.0 if bbox is None else bbox[2] * bbox[3],
+                "iscrowd": 0,
+                "keypoints": [
+                    v
+                    for (x, y), v_in in zip(np.round(k_pix, 2).tolist(), k_in)
+                    for v in (x, y, 2 if v_in else 0)
+                ],
+                "keypoint_names": names,
+                "num_keypoints": int(k_in.sum()),
+            }
+        )
+
+    return annotations
+
+
+# Annotations of a frame for each camera in the meta (the left camera, and the right camera for stereo)
+def frame_annotations(scene, frame, cameras):
+    objects = frame_objects(scene, frame)
+    resolution = visibility.mask_resolution()
+    return {
+        view: camera_annotations(objects, cam, frame["config"]["camera"], resolution)
+        for view, cam in cameras.items()
+    }
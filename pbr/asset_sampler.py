@@ -0,0 +1,165 @@
+import os
+import re
+import random
+
+import numpy as np
+
+from config import output_config as out_cfg
+from config import scene_config
+
+# Chooses the environment, ball, grass and camera type of each frame (see scene_config.asset_sampling)
+# Outside random mode the choices of a whole plan of frames are made up front as index arrays, so a run of the
+# plan's length covers the assets (or their combinations) in proportion to their weights instead of by chance.
+# Frame n uses entry (n - 1) % frames of the plan, so workers rendering different frames follow the same plan
+
+# Kinds of asset in the order of the plan's columns
+kinds = ["hdr", "ball", "grass", "camera"]
+
+# File of each kind of asset that names it, camera types are their own name
+name_files = {"hdr": "raw_path", "ball": "colour_path", "grass": "diffuse"}
+
+# Largest number of combinations the stratified mode spreads a plan over
+max_cells = 10_000_000
+
+
+# Weight of each asset from {regex: weight}, the first matching pattern gives the weight, unmatched assets weigh 1
+def asset_weights(names, patterns):
+    weights = np.ones(len(names), dtype=np.float64)
+    for ii, name in enumerate(names):
+        for pattern, weight in patterns.items():
+            if re.search(pattern, name) is not None:
+                weights[ii] = weight
+                break
+    if weights.sum() <= 0:
+        raise ValueError("Asset weights {} leave nothing to choose".format(patterns))
+    return weights / weights.sum()
+
+
+# Number of times each of a set of weighted items is chosen in n draws
+# Every item gets the whole part of its share, the remaining draws go to items by systematic sampling of what is
+# left of their shares, so no item is chosen more than once more than its whole share
+def apportion(weights, n, rng):
+    share = weights * n
+    counts = np.floor(share).astype(np.int64)
+    remainder = share - counts
+
+    left = n - counts.sum()
+    if left > 0:
+        points = rng.random() + np.arange(left)
+        counts += np.bincount(
+            np.minimum(
+                np.searchsorted(np.cumsum(remainder), points, side="right"),
+                len(weights) - 1,
+            ),
+            minlength=len(weights),
+        )
+    return counts
+
+
+# Plan over every combination of assets, each chosen in proportion to the product of its assets' weights
+def stratified_plan(weights, n, rng):
+    shape = [len(w) for w in weights]
+
+    joint = weights[0]
+    for w in weights[1:]:
+        joint = np.multiply.outer(joint, w)
+    joint = joint.ravel()
+
+    cells = np.repeat(np.arange(len(joint)), apportion(joint, n, rng))
+    rng.shuffle(cells)
+    return np.stack(np.unravel_index(cells, shape), axis=-1)
+
+
+# Latin hypercube plan, each kind of asset is spread over the plan in proportion to its weights on its own
+def latin_hypercube_plan(weights, n, rng):
+    columns = []
+    for w in weights:
+        # One sample from each of n equal strata, in a random order
+        u = (rng.permutation(n) + rng.random(n)) / n
+        columns.append(
+            np.minimum(np.searchsorted(np.cumsum(w), u, side="right"), len(w) - 1)
+        )
+    return np.stack(columns, axis=-1)
+
+
+# Name of an asset, the path of its naming file relative to the resource directory or the camera type
+# The names are matched against the weight patterns and recorded in the meta
+def asset_name(kind, asset):
+    if kind not in name_files:
+        return asset
+    return os.path.relpath(asset[name_files[kind]], scene_config.res_path)
+
+
+# Names of chosen assets
+def asset_names(assets):
+    return {k: asset_name(k, assets[k]) for k in kinds}
+
+
+class AssetSampler:
+    def __init__(self, hdrs, balls, grasses):
+        cfg = scene_config.asset_sampling
+        self.mode = cfg["mode"]
+        self.assets = {
+            "hdr": hdrs,
+            "ball": balls,
+            "grass": grasses,
+            "camera": [c["type"] for c in scene_config.cameras],
+        }
+
+        names = {k: [asset_name(k, a) for a in self.assets[k]] for k in kinds}
+        self.weights = [asset_weights(names[k], cfg["weights"][k]) for k in kinds]
+
+        self.plan = None
+        if self.mode == "random":
+            return
+
+        n = cfg["frames"] if cfg["frames"] is not None else out_cfg.num_images
+        rng = np.random.default_rng(cfg["seed"])
+
+        cells = int(np.prod([len(w) for w in self.weights], dtype=np.float64))
+        if self.mode == "stratified" and cells > max_cells:
+            print(
+                "[WARN] {} asset combinations are too many to stratify, using a latin hypercube".format(
+                    cells
+                )
+            )
+            self.mode = "latin_hypercube"
+
+        if self.mode == "stratified":
+            self.plan = stratified_plan(self.weights, n, rng)
+        elif self.mode == "latin_hypercube":
+            self.plan = latin_hypercube_plan(self.weights, n, rng)
+        else:
+            raise ValueError("Unknown asset sampling mode {}".format(self.mode))
+
+        print(
+            "[INFO] Planned the assets of {} frames over {} combinations ({})".format(
+                n, cells, self.mode
+            )
+        )
+
+    # Indices of the assets of a frame in the order of kinds
+    def indices(self, frame_num):
+        if self.plan is not None:
+            return self.plan[(frame_num - 1) % len(self.plan)]
+        return self.random_indices()
+
+    # Indices of assets drawn independently from the weights
+    def random_indices(self):
+        return [
+            np.searchsorted(np.cumsum(w), random.random(), side="right").clip(
+                0, len(w) - 1
+            )
+            for w in self.weights
+        ]
+
+    def assets_of(self, indices):
+        return {k: self.assets[k][int(ii)] for k, ii in zip(kinds, indices)}
+
+    # The environment, ball, grass and camera type of a frame
+    def choose(self, frame_num):
+        return self.assets_of(self.indices(frame_num))
+
+    # An environment, ball, grass and camera type drawn from the weights, whatever the mode
+    def sample(self):
+        return self.assets_of(self.random_indices())
@@ -0,0 +1,131 @@
+#!/usr/local/bin/blender -P
+
+import os
+import sys
+import json
+import time
+import bpy
+import argparse
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import numpy as np
+
+from config import blend_config as blend_cfg
+from config import output_config as out_cfg
+
+from scene import environment as env
+
+import pbr
+import util
+import image_metrics
+
+# Compares the quality profiles in blend_config.quality_profiles
+# Each randomised frame is rendered once per profile and compared against a high sample reference render,
+# reporting seconds per frame against PSNR and SSIM so the cheapest acceptable profile can be chosen
+#   blender -b -P pbr/benchmark_quality.py -- --frames 10 --profiles default adaptive fast
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="benchmark_quality.py")
+    parser.add_argument("--frames", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reference", default="reference")
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        default=[p for p in blend_cfg.quality_profiles if p != "reference"],
+        choices=blend_cfg.quality_profiles.keys(),
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    output_dir = os.path.join(out_cfg.output_dir, "benchmark")
+    os.makedirs(output_dir, exist_ok=True)
+
+    util.seed_frame(args.seed, 0)
+    scene = pbr.build_scene()
+
+    # Only the raw image is rendered, so keep the depth output from writing stray files
+    if scene["render_layer_toggle"][2] is not None:
+        scene["render_layer_toggle"][2].mute = True
+
+    profiles = [args.reference] + [p for p in args.profiles if p != args.reference]
+    results = {p: {"seconds": [], "psnr": [], "ssim": []} for p in profiles}
+
+    for frame_num in range(1, args.frames + 1):
+        util.seed_frame(args.seed, frame_num)
+        frame = pbr.update_scene(scene, frame_num)
+        bpy.context.scene.camera = scene["cam_l"].obj
+
+        paths = {}
+        for profile in profiles:
+            env.apply_quality(profile)
+            paths[profile] = os.path.join(
+                output_dir,
+                "{}_{}.png".format(profile, str(frame_num).zfill(out_cfg.filename_len)),
+            )
+
+            start = time.time()
+            util.render_image(
+                isMaskImage=False,
+                toggle=scene["render_layer_toggle"],
+                shadowcatcher=scene["shadowcatcher"],
+                world=scene["world"],
+                env=env,
+                hdr_path=frame["hdr_data"]["raw_path"],
+                strength=frame["config"]["environment"]["strength"],
+                env_info=frame["env_info"],
+                output_path=paths[profile],
+            )
+            results[profile]["seconds"].append(time.time() - start)
+
+        reference = image_metrics.load_image(paths[args.reference])
+        for profile in profiles:
+            img = image_metrics.load_image(paths[profile])
+            results[profile]["psnr"].append(image_metrics.psnr(img, reference))
+            results[profile]["ssim"].append(image_metrics.ssim(img, reference))
+
+        print("[INFO] Benchmarked frame {}/{}".format(frame_num, args.frames))
+
+    summary = {
+        p: {
+            "settings": {
+                **blend_cfg.render["sampling"],
+                **blend_cfg.layers["denoising"],
+                **blend_cfg.quality_profiles[p],
+            },
+            "seconds_per_frame": float(np.mean(results[p]["seconds"])),
+            # Identical renders have infinite PSNR, so cap it before averaging
+            "psnr": float(np.mean(np.minimum(results[p]["psnr"], 100.0))),
+            "ssim": float(np.mean(results[p]["ssim"])),
+            "frames": results[p],
+        }
+        for p in profiles
+    }
+
+    with open(os.path.join(output_dir, "benchmark_quality.json"), "w") as f:
+        json.dump(summary, f, indent=4, sort_keys=True)
+
+    print(
+        "{:>20} {:>12} {:>10} {:>8}".format("profile", "s/frame", "PSNR (dB)", "SSIM")
+    )
+    for p in sorted(profiles, key=lambda p: summary[p]["seconds_per_frame"]):
+        print(
+            "{:>20} {:>12.2f} {:>10.2f} {:>8.4f}".format(
+                p,
+                summary[p]["seconds_per_frame"],
+                summary[p]["psnr"],
+                summary[p]["ssim"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/local/bin/blender -P
+
+import os
+import sys
+import time
+import bpy
+import argparse
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from config import output_config as out_cfg
+
+from scene import environment as env
+
+import pbr
+import util
+import render_profile
+
+# Finds the fastest thread count and tile size for rendering on this host and stores it as the
+# host's render profile, which setup_render uses from then on
+# The profile is specific to the number of CPUs the process may use, so run it with the same
+# CPU affinity as the render workers (render_farm.py --calibrate does this)
+#   blender -b -P pbr/calibrate_render.py -- --samples 16
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="calibrate_render.py")
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=16,
+        help="samples per pixel of the calibration renders",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    output_dir = os.path.join(out_cfg.output_dir, "calibration")
+    os.makedirs(output_dir, exist_ok=True)
+
+    util.seed_frame(args.seed, 0)
+    scene = pbr.build_scene()
+
+    if scene["render_layer_toggle"][2] is not None:
+        scene["render_layer_toggle"][2].mute = True
+
+    util.seed_frame(args.seed, 1)
+    frame = pbr.update_scene(scene, 1)
+
+    bpy_scene = bpy.context.scene
+    bpy_scene.camera = scene["cam_l"].obj
+    device = bpy_scene.cycles.device
+    if device != "CPU":
+        print("[WARN] Tile sizes are only calibrated for CPU rendering")
+
+    # A short, fixed amount of work per render so the timings are comparable
+    bpy_scene.cycles.samples = args.samples
+    bpy_scene.cycles.use_adaptive_sampling = False
+    bpy_scene.render.threads_mode = "FIXED"
+
+    def render(threads, tile):
+        bpy_scene.render.threads = threads
+        bpy_scene.render.tile_x = tile
+        bpy_scene.render.tile_y = tile
+        start = time.time()
+        util.render_image(
+            isMaskImage=False,
+            toggle=scene["render_layer_toggle"],
+            shadowcatcher=scene["shadowcatcher"],
+            world=scene["world"],
+            env=env,
+            hdr_path=frame["hdr_data"]["raw_path"],
+            strength=frame["config"]["environment"]["strength"],
+            env_info=frame["env_info"],
+            output_path=os.path.join(output_dir, "{}_{}.png".format(threads, tile)),
+        )
+        return time.time() - start
+
+    candidates = render_profile.candidates()
+
+    # The first render also loads images and builds the BVH, so leave it out of the timings
+    render(*candidates[0])
+
+    timings = []
+    for threads, tile in candidates:
+        seconds = render(threads, tile)
+        timings.append((seconds, threads, tile))
+        print(
+            "[INFO] {:>4} threads, {:>3}x{:<3} tiles: {:.2f}s".format(
+                threads, tile, tile, seconds
+            )
+        )
+
+    seconds, threads, tile = min(timings)
+    resolution = [bpy_scene.render.resolution_x, bpy_scene.render.resolution_y]
+    resolution = [
+        int(r * bpy_scene.render.resolution_percentage / 100) for r in resolution
+    ]
+    render_profile.save_profile(
+        device,
+        resolution,
+        {"threads": threads, "tile": [tile, tile], "seconds": seconds},
+    )
+    print(
+        "[INFO] Saved {} threads with {}x{} tiles to '{}'".format(
+            threads, tile, tile, render_profile.profile_path()
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,25 @@ from math import pi
 
 render = {
     "render_engine": "CYCLES",
-    "render": {"cycles_device": "GPU"},
+    # GPU, CPU or AUTO (GPU when a device of compute_device_type is present, otherwise CPU)
+    "render": {"cycles_device": "AUTO", "compute_device_type": "CUDA"},
     "dimensions": {"resolution": [1280, 1024], "percentage": 100.0},
-    "sampling": {"cycles_samples": 256, "cycles_preview_samples": 16},
+    "sampling": {
+        "cycles_samples": 256,
+        "cycles_preview_samples": 16,
+        # Stop sampling pixels once their noise falls below the threshold
+        "adaptive_sampling": False,
+        "adaptive_threshold": 0.01,
+        "adaptive_min_samples": 0,
+    },
+    # Name of the quality profile to render raw images with (see quality_profiles)
+    "quality": "default",
+    # Render raw images with the cheap draft settings below
+    "draft": False,
+    # How the environment behind the objects of a mask is made
+    #   "render": render the environment's mask image as the world background
+    #   "reproject": render the objects on a transparent background and reproject the mask image behind them in NumPy
+    "mask_background": "render",
     "light_paths": {
         "transparency": {"max_bounces": 1, "min_bounces": 1},
         "bounces": {"max_bounces": 1, "min_bounces": 1},
@@ -18,6 +34,9 @@ render = {
         "refractive_caustics": False,
     },
     "performance": {
+        # Take the thread count (and the tile size when rendering on the CPU) from this host's
+        # render profile instead of the fixed settings below (see render_profile.py)
+        "use_render_profile": True,
         "render_tile": [512, 512],
         "threads": {"mode": "FIXED", "num_threads": 8},
     },
@@ -30,12 +49,57 @@ render = {
         "max_noise_fac": 0.60,
         "min_exposure": -2,
         "max_exposure": 2,
+        # Only used for the extra variants made by postprocess.py --variants
+        # Largest change of the red and blue gains relative to green
+        "white_balance": 0.15,
+        # Sensor noise in linear intensity, shot noise grows with the signal, read noise is constant
+        "max_shot_noise": 0.01,
+        "max_read_noise": 0.005,
     },
 }
 
 scene = {"units": {"length_units": "METRIC", "rotation_units": "DEGREES"}}
 
-layers = {"denoising": {"use_denoising": False}}
+layers = {"denoising": {"use_denoising": False, "denoiser": "OPENIMAGEDENOISE"}}
+
+# Named sampling and denoising presets for the raw image
+# Each profile overrides the settings in render["sampling"] and layers["denoising"]
+# Use benchmark_quality.py to compare the render time and image quality of the profiles
+quality_profiles = {
+    "default": {},
+    "reference": {"cycles_samples": 2048},
+    "adaptive": {
+        "adaptive_sampling": True,
+        "adaptive_threshold": 0.01,
+        "adaptive_min_samples": 32,
+    },
+    "adaptive_denoised": {
+        "cycles_samples": 128,
+        "adaptive_sampling": True,
+        "adaptive_threshold": 0.05,
+        "adaptive_min_samples": 16,
+        "use_denoising": True,
+    },
+    "fast": {
+        "cycles_samples": 32,
+        "adaptive_sampling": True,
+        "adaptive_threshold": 0.1,
+        "adaptive_min_samples": 8,
+        "use_denoising": True,
+    },
+    "draft": {"cycles_samples": 8, "use_denoising": True},
+}
+
+# Draft mode for quickly checking scene randomisation
+# Only the raw image is rendered cheaply, masks and meta keep their full resolution and quality
+draft = {
+    # BLENDER_EEVEE is faster again, but needs an OpenGL context and ignores the shadow catcher
+    "render_engine": "CYCLES",
+    "quality": "draft",
+    "percentage": 25.0,
+    # Scale raw images back up to the full resolution so they line up with the masks
+    "upscale": True,
+}
 
 field = {
     "material": {
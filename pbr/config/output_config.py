@@ -13,6 +13,38 @@ output_depth = False
 
 output_imperfections = True
 
+# COCO-like boxes and keypoints of the objects in view, projected from the scene into each frame's meta
+output_annotations = False
+
+# 16-bit single channel masks of each object's pass index, written in the mask render
+# The class of an instance id is id % len(scene_config.resources), each frame's meta maps the ids to their objects
+output_instances = False
+
+# Encoding of the segmentation masks (see mask_codec.py)
+#   * "colour" keeps the rendered 16-bit RGB masks
+#   * "index" rewrites them as single channel 8-bit PNGs of each pixel's class index
+mask_format = "colour"
+# Also write the COCO RLE of each class of the masks to <output_dir>/<mask_rle_dirname>
+output_mask_rle = False
+
+# How the meta of each frame is written
+#   * "json" writes a JSON file per frame to <output_dir>/<meta_dirname>
+#   * "table" appends flattened rows to a table per process in <output_dir>/<meta_dirname> (see meta_writer.py)
+#   * "both" writes both
+meta_format = "json"
+# Table format ("parquet", "arrow" or "jsonl", parquet and arrow need pyarrow) and rows buffered between appends to
+# the table's journal. Farm workers append every frame before reporting it, so a crash never loses a reported frame
+meta_table = {"format": "parquet", "batch": 100}
+
+# Where the image imperfections are applied
+#   * "compositor" applies them in Blender's compositor while rendering
+#   * "postprocess" renders clean images to <output_dir>/<clean_dirname>, postprocess.py then writes the raw images
+imperfections_mode = "compositor"
+
+# Keyframe the transforms of every object at every frame, so the saved scene replays the dataset
+# The animation data grows with every frame and slows down frame changes, so by default transforms are set directly
+output_keyframes = False
+
 # Absolute output directory to hold the directories for output images and segmentation masks
 output_base = os.path.join(
     os.path.abspath(
@@ -22,16 +54,22 @@ output_base = os.path.join(
     "run_{}",
 )
 
-# Find an output directory that isn't already taken
-output_dir_no = 0
-while True:
-    try:
-        output_dir_no += 1
-        output_dir = output_base.format(output_dir_no)
-        os.makedirs(output_dir, exist_ok=False)
-        break
-    except:
-        pass  # Directory already exists
+# A job manager running several workers on the same dataset points them all at one run directory
+output_dir = os.environ.get("NUPBR_OUTPUT_DIR")
+
+if output_dir is not None:
+    os.makedirs(output_dir, exist_ok=True)
+else:
+    # Find an output directory that isn't already taken
+    output_dir_no = 0
+    while True:
+        try:
+            output_dir_no += 1
+            output_dir = output_base.format(output_dir_no)
+            os.makedirs(output_dir, exist_ok=False)
+            break
+        except:
+            pass  # Directory already exists
 
 # Filename length (characters)
 filename_len = 10
@@ -40,8 +78,12 @@ filename_len = 10
 # and the meta files
 # (Outputs will be stored in <output_dir>/<image_dirname> and <output_dir>/<mask_dirname>)
 image_dirname = "raw"
+clean_dirname = "raw_clean"
+variant_dirname = "variants"
 mask_dirname = "seg"
 depth_dirname = "depth"
+instance_dirname = "instance"
+mask_rle_dirname = "seg_rle"
 meta_dirname = "meta"
 
 # Maximum depth for normalized depth map (metres)
@@ -60,6 +102,21 @@ os.makedirs(image_dir, exist_ok=True)
 os.makedirs(mask_dir, exist_ok=True)
 os.makedirs(meta_dir, exist_ok=True)
 
+# Directory Blender renders raw images to
+render_image_dir = image_dir
+if output_imperfections and imperfections_mode == "postprocess":
+    clean_dir = os.path.join(output_dir, clean_dirname)
+    os.makedirs(clean_dir, exist_ok=True)
+    render_image_dir = clean_dir
+
 if output_depth:
     depth_dir = os.path.join(output_dir, depth_dirname)
     os.makedirs(depth_dir, exist_ok=True)
+
+if output_mask_rle:
+    mask_rle_dir = os.path.join(output_dir, mask_rle_dirname)
+    os.makedirs(mask_rle_dir, exist_ok=True)
+
+if output_instances:
+    instance_dir = os.path.join(output_dir, instance_dirname)
+    os.makedirs(instance_dir, exist_ok=True)
@@ -25,6 +25,40 @@ num_misc_robots = 3
 # The radius that defines the personal space of a robot
 robot_radius = 0.7
 
+# Libraries of robot poses, "<path>/<model>.npz" or "<path>/<model>.json" (built by pose_library.py)
+# With the given probability a robot takes a pose from its model's library instead of random joint angles
+# Library poses also place the robot's feet on the ground, random poses use the configured height
+pose_library = {
+    "path": path.abspath(path.join(res_path, "robot", "poses")),
+    "probability": 1.0,
+}
+
+# Cache of smaller versions of the environment maps (built by preprocess_hdr.py), mirroring the environment directory
+# Each frame uses the smallest version with enough detail for the camera's field of view and the output resolution
+#   * min_width: width (pixels) of the smallest version made
+#   * oversample: environment map pixels per image pixel to keep at the image's most detailed point
+hdr_cache = {
+    "path": path.abspath(path.join(res_path, "hdr_cache")),
+    "min_width": 1024,
+    "oversample": 1.0,
+}
+
+# Detection of the field pixels of environment mask images, which are used to place objects on the field
+#   * tolerance: largest difference (0-255) of any channel from the field or line colour of a field pixel, so
+#     compression artefacts of the mask images are still field
+#   * open, close: sizes (pixels) of the morphological opening removing specks and closing filling holes, 0 skips them
+# The field pixels are cached per environment by preprocess_hdr.py (see hdr_cache.py)
+field_detection = {"tolerance": 32, "open": 3, "close": 5}
+
+# Motion of the scene through a clip in sequence mode (sequence.py)
+#   * Speeds are ranges in m/s, the ball also rolls and robots walk in a random direction
+sequence = {
+    "fps": 30,
+    "ball_speed": (0.0, 3.0),
+    "robot_speed": (0.0, 0.3),
+    "camera_robot_speed": (0.0, 0.2),
+}
+
 # Field dimensions
 field_dims = {
     "length": 9,
@@ -135,6 +169,8 @@ resources = {
         "hdri_types": [".hdr"],
         "mask_types": [".png"],
         "info_type": ".json",
+        # Threads loading the environment catalog (info and field pixels of the masks) at startup
+        "preload_workers": 8,
         "mask": {"index": 0, "colour": (0, 0, 0, 1)},
     },
     ## Always make sure that the field has the last index so field lines can be index + 1
@@ -155,12 +191,66 @@ resources = {
 }
 
 
+# Camera models to choose from for each frame
+cameras = [
+    {"type": "EQUISOLID", "focal_length": 10.5, "fov": pi},
+    {"type": "RECTILINEAR", "fov": 0.857},
+]
+
+# How the environment, ball, grass and camera of each frame are chosen (see asset_sampler.py)
+#   * mode: "random" chooses each independently every frame
+#           "stratified" spreads a plan of frames over every combination in proportion to their weights
+#           "latin_hypercube" spreads the plan over each kind of asset in proportion to their weights
+#   * frames: frames in a plan before it repeats, by default the number of images of the run
+#   * seed: seed of the plan, shared by every worker of a run so they follow the same plan
+#   * weights: per kind of asset, {regex: weight} matched against each asset's path (relative to the resource
+#     directory) or camera type, the first match gives the weight and unmatched assets weigh 1
+asset_sampling = {
+    "mode": "random",
+    "frames": None,
+    "seed": 0,
+    "weights": {"hdr": {}, "ball": {}, "grass": {}, "camera": {}},
+}
+
+
+# Scoring of candidate scenes to spend renders where they help a detector most (see scene_scorer.py)
+#   * scorer: None, "module:function" or the path of a pickled model, higher scores are rendered more often
+#   * candidates: number of candidate scenes scored for each frame
+#   * temperature: softmax temperature of the scores, 0 always renders the best candidate
+scene_scoring = {"scorer": None, "candidates": 256, "temperature": 1.0}
+
+
+# Frames are checked before they are rendered and resampled when they would show too little (see visibility.py)
+#   * max_attempts: scenes sampled for a frame before rendering the last one anyway
+#   * target_in_view: the camera's tracking target must be in the image
+#   * min_ball_pixels: smallest area (pixels) of the ball's box in the image when the ball is drawn
+#   * min_ball_visible: smallest fraction of rays from the camera reaching the ball, 0 skips the occlusion test
+#   * min_objects: number of robots and goals which must cover at least min_object_pixels of the image
+frame_filter = {
+    "enabled": False,
+    "max_attempts": 10,
+    "target_in_view": True,
+    "min_ball_pixels": 50,
+    "min_ball_visible": 0.4,
+    "min_objects": 0,
+    "min_object_pixels": 400,
+}
+
+
 def choose_misc_robot():
     choice = random.choice(list(resources["misc_robot"]["robot_list"].keys()))
     return resources["misc_robot"]["robot_list"][choice]
 
 
-def configure_scene():
+# Pass index of the <instance>th object of a class, unique to the object
+# The class is the pass index modulo the number of classes, so instance 0 keeps the class index
+def instance_index(class_index, instance):
+    return class_index + len(resources) * instance
+
+
+# Configure a random scene
+#   camera_type: type of camera to use instead of a random one from cameras
+def configure_scene(camera_type=None):
 
     ball_radius = resources["ball"]["radius"]
 
@@ -228,11 +318,10 @@ def configure_scene():
     cfg.update(
         {
             "camera": {
-                **random.choice(
-                    [
-                        {"type": "EQUISOLID", "focal_length": 10.5, "fov": pi},
-                        {"type": "RECTILINEAR", "fov": 0.857},
-                    ]
+                **(
+                    random.choice(cameras)
+                    if camera_type is None
+                    else [c for c in cameras if c["type"] == camera_type][0]
                 ),
                 "stereo_camera_distance": 0.1,
             }
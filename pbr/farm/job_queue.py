@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import time
+
+# Batch states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+# File based queue of frame batches shared between the scheduler and the Blender workers
+# Each batch covers the frames [start, end), and next is the first frame that has not been rendered yet
+class JobQueue:
+    def __init__(self, path):
+        self.path = path
+        # Blender workers and the scheduler write concurrently, so wait for locks rather than failing
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                next INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                heartbeat REAL,
+                started REAL,
+                finished REAL
+            )""")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def close(self):
+        self.db.close()
+
+    def get_setting(self, key, default=None):
+        row = self.db.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+        return default if row is None else row["value"]
+
+    def set_setting(self, key, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            (key, str(value)),
+        )
+
+    # Split the requested dataset size into batches, unless the queue already holds a job
+    def create(self, num_images, batch_size, start_frame=1):
+        if self.db.execute("SELECT COUNT(*) FROM batches").fetchone()[0] > 0:
+            return False
+
+        self.db.execute("BEGIN IMMEDIATE")
+        for start in range(start_frame, start_frame + num_images, batch_size):
+            end = min(start + batch_size, start_frame + num_images)
+            self.db.execute(
+                "INSERT INTO batches (start, end, next, status) VALUES (?, ?, ?, ?)",
+                (start, end, start, PENDING),
+            )
+        self.db.execute("COMMIT")
+        return True
+
+    def batch(self, batch_id):
+        return self.db.execute(
+            "SELECT * FROM batches WHERE id = ?", (batch_id,)
+        ).fetchone()
+
+    def batches(self):
+        return self.db.execute("SELECT * FROM batches ORDER BY start").fetchall()
+
+    # Atomically hand the next pending batch to a worker
+    def claim(self, worker):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT * FROM batches WHERE status = ? ORDER BY start LIMIT 1",
+                (PENDING,),
+            ).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            self._start(row["id"], worker)
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+        return self.batch(row["id"])
+
+    # Take the second half of the remaining frames of the busiest running batch
+    # The victim worker notices its shortened end the next time it checks in
+    def steal(self, worker, min_frames=2):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Leave the frame that is currently rendering with its owner
+            row = self.db.execute(
+                """SELECT *, end - next - 1 AS remaining FROM batches
+                WHERE status = ? ORDER BY remaining DESC LIMIT 1""",
+                (RUNNING,),
+            ).fetchone()
+            if row is None or row["remaining"] < min_frames:
+                self.db.execute("COMMIT")
+                return None
+
+            split = row["end"] - row["remaining"] // 2
+            self.db.execute(
+                "UPDATE batches SET end = ? WHERE id = ?", (split, row["id"])
+            )
+            cursor = self.db.execute(
+                "INSERT INTO batches (start, end, next, status) VALUES (?, ?, ?, ?)",
+                (split, row["end"], split, PENDING),
+            )
+            self._start(cursor.lastrowid, worker)
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+        return self.batch(cursor.lastrowid)
+
+    def _start(self, batch_id, worker):
+        now = time.time()
+        self.db.execute(
+            """UPDATE batches SET status = ?, worker = ?, heartbeat = ?, started = ?,
+            attempts = attempts + 1 WHERE id = ?""",
+            (RUNNING, worker, now, now, batch_id),
+        )
+
+    # Called by the worker after each finished frame, returns the (possibly stolen) end of the batch
+    def heartbeat(self, batch_id, frame_num=None):
+        if frame_num is None:
+            self.db.execute(
+                "UPDATE batches SET heartbeat = ? WHERE id = ?", (time.time(), batch_id)
+            )
+        else:
+            self.db.execute(
+                "UPDATE batches SET heartbeat = ?, next = MAX(next, ?) WHERE id = ?",
+                (time.time(), frame_num + 1, batch_id),
+            )
+        return self.batch(batch_id)["end"]
+
+    def complete(self, batch_id):
+        self.db.execute(
+            "UPDATE batches SET status = ?, finished = ? WHERE id = ?",
+            (DONE, time.time(), batch_id),
+        )
+
+    # Put a crashed batch back in the queue, resuming from its first unrendered frame
+    def fail(self, batch_id, max_attempts):
+        row = self.batch(batch_id)
+        status = FAILED if row["attempts"] >= max_attempts else PENDING
+        self.db.execute(
+            "UPDATE batches SET status = ?, worker = NULL WHERE id = ?",
+            (status, batch_id),
+        )
+        return status
+
+    # Batches left running by a scheduler that died are returned to the queue on resume
+    def reset_running(self):
+        self.db.execute(
+            "UPDATE batches SET status = ?, worker = NULL WHERE status = ?",
+            (PENDING, RUNNING),
+        )
+
+    def progress(self):
+        row = self.db.execute("""SELECT COALESCE(SUM(next - start), 0) AS rendered,
+            COALESCE(SUM(end - start), 0) AS total,
+            COALESCE(SUM(status = 'pending'), 0) AS pending,
+            COALESCE(SUM(status = 'running'), 0) AS running,
+            COALESCE(SUM(status = 'done'), 0) AS done,
+            COALESCE(SUM(status = 'failed'), 0) AS failed
+            FROM batches""").fetchone()
+        return dict(row)
+
+    def finished(self):
+        return (
+            self.db.execute(
+                "SELECT COUNT(*) FROM batches WHERE status IN (?, ?)",
+                (PENDING, RUNNING),
+            ).fetchone()[0]
+            == 0
+        )
+
+
+def queue_path(output_dir):
+    return os.path.join(output_dir, "queue.sqlite")
@@ -0,0 +1,349 @@
+import os
+import sys
+import time
+import select
+import tempfile
+import subprocess
+
+import render_profile
+
+from farm import job_queue
+from farm.worker_client import WorkerClient
+
+
+# A Blender process working through batches of the queue
+class Worker:
+    def __init__(self, slot):
+        self.slot = slot
+        self.name = "worker_{}".format(slot)
+        self.proc = None
+        self.batch_id = None
+        self.log = None
+        self.launches = 0
+        # Time the current process was launched
+        self.started = None
+        # Connection to the process when it is a warm worker
+        self.client = None
+        self.socket_path = os.path.join(
+            tempfile.gettempdir(), "nupbr_{}_{}.sock".format(os.getpid(), slot)
+        )
+
+    def busy(self):
+        return self.batch_id is not None
+
+
+# Runs a pool of local Blender workers over a job queue
+#   * Idle workers claim pending batches, and steal half of a running batch once the queue is empty
+#   * Crashed or silent workers are killed and their batch is resumed by another worker, warm workers that never
+#     start listening are killed and launched again
+#   * Each worker is pinned to its own share of the CPUs, keeping NUMA nodes together
+#   * Warm workers construct the scene once and render batch after batch (see worker.py),
+#     otherwise a fresh pbr.py process is launched for every batch
+class Scheduler:
+    def __init__(
+        self,
+        queue,
+        output_dir,
+        num_workers,
+        blender="blender",
+        seed=None,
+        heartbeat_timeout=600,
+        startup_timeout=600,
+        max_attempts=3,
+        min_steal=2,
+        worker_args=None,
+        warm=False,
+        pin=True,
+    ):
+        self.queue = queue
+        self.output_dir = output_dir
+        self.workers = [Worker(ii) for ii in range(num_workers)]
+        self.blender = blender
+        self.seed = seed
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.max_attempts = max_attempts
+        self.min_steal = min_steal
+        self.worker_args = [] if worker_args is None else worker_args
+        self.warm = warm
+        # Blender sizes its thread pool and render profile from the CPUs it is pinned to
+        self.cpu_sets = (
+            render_profile.partition_cpus(num_workers)
+            if pin and hasattr(os, "sched_setaffinity")
+            else None
+        )
+        pbr_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        self.script = os.path.join(pbr_dir, "worker.py" if warm else "pbr.py")
+        self.log_dir = os.path.join(output_dir, "logs")
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        # Rolling (time, rendered frames) samples for throughput
+        self.history = []
+        self.events = []
+        self.last_draw = 0
+
+    def run(self, refresh=1.0):
+        self.queue.reset_running()
+        try:
+            while not self.queue.finished() or any(w.busy() for w in self.workers):
+                for w in self.workers:
+                    self.poll(w)
+                    if not w.busy():
+                        self.assign(w)
+                self.draw_dashboard()
+                time.sleep(refresh)
+        finally:
+            for w in self.workers:
+                self.shutdown(w)
+        self.draw_dashboard(log_interval=0)
+
+    def launch(self, worker, args):
+        cmd = [self.blender, "-b", "-P", self.script, "--"] + args
+        if self.seed is not None:
+            cmd += ["--seed", str(self.seed)]
+        cmd += self.worker_args
+
+        worker.launches += 1
+        worker.started = time.time()
+        worker.log = open(
+            os.path.join(
+                self.log_dir, "{}_{}.log".format(worker.name, worker.launches)
+            ),
+            "w",
+        )
+        env = dict(os.environ, NUPBR_OUTPUT_DIR=self.output_dir)
+        worker.proc = subprocess.Popen(
+            cmd,
+            stdout=worker.log,
+            stderr=subprocess.STDOUT,
+            env=env,
+            preexec_fn=self.pin(worker.slot),
+        )
+
+    # Function run in the child process before Blender starts, restricting it to its CPUs
+    def pin(self, slot):
+        if self.cpu_sets is None:
+            return None
+        cpus = self.cpu_sets[slot]
+        return lambda: os.sched_setaffinity(0, cpus)
+
+    def assign(self, worker):
+        if self.warm:
+            # Start the worker, then wait until it has constructed its scene and is listening
+            if worker.proc is None:
+                self.launch(worker, ["--socket", worker.socket_path])
+                return
+            if worker.client is None:
+                try:
+                    worker.client = WorkerClient(worker.socket_path)
+                except OSError:
+                    return
+
+        batch = self.queue.claim(worker.name)
+        if batch is None:
+            batch = self.queue.steal(worker.name, self.min_steal)
+            if batch is not None:
+                self.event(
+                    "{} stole frames {}-{}".format(
+                        worker.name, batch["start"], batch["end"] - 1
+                    )
+                )
+        if batch is None:
+            return
+
+        worker.batch_id = batch["id"]
+        if self.warm:
+            worker.client.send(
+                {
+                    "command": "render",
+                    "plan": {
+                        "queue": self.queue.path,
+                        "batch": batch["id"],
+                        "seed": self.seed,
+                    },
+                }
+            )
+        else:
+            self.launch(
+                worker, ["--queue", self.queue.path, "--batch", str(batch["id"])]
+            )
+
+    def poll(self, worker):
+        if worker.proc is None:
+            return
+
+        code = worker.proc.poll()
+        if code is not None:
+            if worker.busy():
+                batch = self.queue.batch(worker.batch_id)
+                # A clean exit that did not reach the end of the batch is still a crash
+                crashed = code != 0 or batch["next"] < batch["end"]
+                if crashed:
+                    self.event(
+                        "{} exited with code {} at frame {} of batch {}".format(
+                            worker.name, code, batch["next"], batch["id"]
+                        )
+                    )
+                self.release(worker, crashed)
+            self.stop(worker)
+            return
+
+        # Kill warm workers that never start listening, the slot is launched again by the next assign
+        if self.warm and worker.client is None:
+            if time.time() - worker.started > self.startup_timeout:
+                worker.proc.kill()
+                worker.proc.wait()
+                self.event(
+                    "{} did not start within {:.0f}s".format(
+                        worker.name, self.startup_timeout
+                    )
+                )
+                if worker.busy():
+                    self.release(worker, crashed=True)
+                self.stop(worker)
+            return
+
+        if not worker.busy():
+            return
+
+        # Kill workers that have stopped reporting progress
+        batch = self.queue.batch(worker.batch_id)
+        if time.time() - batch["heartbeat"] > self.heartbeat_timeout:
+            worker.proc.kill()
+            worker.proc.wait()
+            self.event("{} timed out on batch {}".format(worker.name, batch["id"]))
+            self.release(worker, crashed=True)
+            self.stop(worker)
+            return
+
+        # Warm workers answer once the whole batch is rendered
+        if self.warm and select.select([worker.client], [], [], 0)[0]:
+            try:
+                response = worker.client.receive()
+            except (OSError, ValueError):
+                response = {"status": "error"}
+            batch = self.queue.batch(worker.batch_id)
+            crashed = response["status"] != "done" or batch["next"] < batch["end"]
+            if crashed:
+                self.event(
+                    "{} failed at frame {} of batch {}".format(
+                        worker.name, batch["next"], batch["id"]
+                    )
+                )
+            self.release(worker, crashed)
+
+    def release(self, worker, crashed):
+        if crashed:
+            if self.queue.fail(worker.batch_id, self.max_attempts) == job_queue.FAILED:
+                self.event("batch {} failed permanently".format(worker.batch_id))
+        else:
+            self.queue.complete(worker.batch_id)
+        worker.batch_id = None
+
+    # Forget about a worker process that has exited
+    def stop(self, worker):
+        if worker.client is not None:
+            worker.client.close()
+            worker.client = None
+        worker.log.close()
+        worker.log = None
+        worker.proc = None
+
+    def shutdown(self, worker, timeout=30):
+        if worker.proc is None:
+            return
+
+        if worker.busy():
+            worker.proc.kill()
+            self.release(worker, crashed=True)
+        elif worker.client is not None:
+            try:
+                worker.client.shutdown()
+                worker.proc.wait(timeout)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                worker.proc.kill()
+        else:
+            worker.proc.kill()
+        worker.proc.wait()
+        self.stop(worker)
+
+    def event(self, msg):
+        self.events.append("[{}] {}".format(time.strftime("%H:%M:%S"), msg))
+        self.events = self.events[-5:]
+
+    # Frames per minute over the last few minutes of samples
+    def throughput(self, rendered, window=300):
+        now = time.time()
+        self.history.append((now, rendered))
+        self.history = [h for h in self.history if now - h[0] <= window]
+        dt = self.history[-1][0] - self.history[0][0]
+        if dt <= 0:
+            return 0.0
+        return 60.0 * (self.history[-1][1] - self.history[0][1]) / dt
+
+    def draw_dashboard(self, log_interval=30):
+        # Only redraw every so often when logging to a file
+        if not sys.stdout.isatty() and time.time() - self.last_draw < log_interval:
+            return
+        self.last_draw = time.time()
+
+        progress = self.queue.progress()
+        rate = self.throughput(progress["rendered"])
+        total = max(progress["total"], 1)
+        width = 40
+        filled = int(width * progress["rendered"] / total)
+
+        lines = [
+            "NUpbr render farm: {}".format(self.output_dir),
+            "[{}{}] {}/{} frames ({:.1f}%)".format(
+                "#" * filled,
+                "-" * (width - filled),
+                progress["rendered"],
+                progress["total"],
+                100.0 * progress["rendered"] / total,
+            ),
+            "Throughput: {:.1f} frames/min   ETA: {}".format(
+                rate,
+                (
+                    "--"
+                    if rate <= 0
+                    else time.strftime(
+                        "%H:%M:%S",
+                        time.gmtime(
+                            60.0 * (progress["total"] - progress["rendered"]) / rate
+                        ),
+                    )
+                ),
+            ),
+            "Batches: {pending} pending, {running} running, {done} done, {failed} failed".format(
+                **progress
+            ),
+            "",
+        ]
+        for w in self.workers:
+            if not w.busy():
+                lines.append(
+                    "{:>10}: {}".format(
+                        w.name,
+                        "starting" if self.warm and w.client is None else "idle",
+                    )
+                )
+                continue
+            batch = self.queue.batch(w.batch_id)
+            lines.append(
+                "{:>10}: batch {:>4} frame {:>6} of {:>6}-{:<6} last heartbeat {:>4.0f}s ago".format(
+                    w.name,
+                    batch["id"],
+                    batch["next"],
+                    batch["start"],
+                    batch["end"] - 1,
+                    time.time() - batch["heartbeat"],
+                )
+            )
+        lines += [""] + self.events
+
+        # Redraw in place on a terminal, otherwise just append to the log
+        if sys.stdout.isatty():
+            sys.stdout.write("\x1b[H\x1b[2J")
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
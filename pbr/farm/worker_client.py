@@ -0,0 +1,42 @@
+import json
+import socket
+
+
+# Connection to a warm Blender worker (see worker.py)
+class WorkerClient:
+    def __init__(self, socket_path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.stream = self.sock.makefile("rw")
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, request):
+        self.stream.write(json.dumps(request) + "\n")
+        self.stream.flush()
+
+    def receive(self):
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("worker closed the connection")
+        return json.loads(line)
+
+    def request(self, request):
+        self.send(request)
+        return self.receive()
+
+    def ping(self):
+        return self.request({"command": "ping"})
+
+    # Blocks until every frame of the plan has been rendered
+    def render(self, plan):
+        return self.request({"command": "render", "plan": plan})
+
+    def shutdown(self):
+        return self.request({"command": "shutdown"})
@@ -0,0 +1,132 @@
+import os
+import json
+import math
+
+import numpy as np
+
+from config import scene_config
+
+# Smaller versions of the environment maps and their precomputed field masks, made by preprocess_hdr.py
+# Each environment has a directory in the cache mirroring its directory under resources["environment"]["path"],
+# holding an index.json
+#   "source": {"file", "size", "mtime"} of the raw HDR the cache was made from,
+#   "width", "height": size of the raw HDR,
+#   "variants": [{"file", "width", "height"}] half float EXR mip levels, largest first,
+#   "field_mask": bitmap of the field pixels of the environment's mask (see save_field_bitmap), or null,
+#   "field_detection": the scene_config.field_detection settings the field pixels were detected with
+
+
+# Cache directory of an environment
+def cache_dir(raw_path):
+    rel = os.path.relpath(
+        os.path.dirname(raw_path), scene_config.resources["environment"]["path"]
+    )
+    return os.path.join(scene_config.hdr_cache["path"], rel)
+
+
+# Description of the raw HDR used to check the cache is up to date
+def source_info(raw_path):
+    stat = os.stat(raw_path)
+    return {
+        "file": os.path.basename(raw_path),
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+    }
+
+
+# Load the cache index of an environment, with absolute paths
+# Returns None if the environment has no cache or the raw HDR changed since it was made
+def load_index(hdr_data):
+    path = os.path.join(cache_dir(hdr_data["raw_path"]), "index.json")
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        index = json.load(f)
+
+    if index["source"] != source_info(hdr_data["raw_path"]):
+        print(
+            "[WARN] HDR cache of '{}' is out of date, using the raw HDR".format(
+                hdr_data["raw_path"]
+            )
+        )
+        return None
+
+    root = os.path.dirname(path)
+    for v in index["variants"]:
+        v["path"] = os.path.join(root, v["file"])
+    index["field_mask_path"] = (
+        os.path.join(root, index["field_mask"])
+        if index["field_mask"] is not None
+        else None
+    )
+
+    # Field pixels detected with other settings are detected again from the mask image
+    if (
+        index["field_mask_path"] is not None
+        and index.get("field_detection") != scene_config.field_detection
+    ):
+        print(
+            "[WARN] Field pixels of '{}' were cached with other detection settings, detecting them again".format(
+                hdr_data["raw_path"]
+            )
+        )
+        index["field_mask_path"] = None
+    return index
+
+
+# Write a boolean image as bits packed 8 pixels to a byte
+def save_field_bitmap(path, field):
+    np.savez_compressed(
+        path, bits=np.packbits(field, axis=None), shape=np.array(field.shape)
+    )
+
+
+# Load a boolean image written by save_field_bitmap
+def load_field_bitmap(path):
+    try:
+        with np.load(path) as data:
+            shape = tuple(data["shape"])
+            bits = data["bits"]
+    except (OSError, ValueError, KeyError):
+        raise NameError("Cannot load image {0}".format(path))
+    return np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+
+# Width of the environment map needed to show the camera's most detailed pixels at the output resolution
+#   cam_config: the camera configuration of the frame ({"type", "fov", "focal_length"})
+#   sensor_width: sensor width (mm) used for the larger image dimension (sensor fit AUTO)
+def required_width(cam_config, sensor_width, width, height):
+    size = max(width, height)
+
+    if cam_config["type"] == "RECTILINEAR":
+        # Pixels per radian grow away from the image centre (x = f tan(theta)), the most are at the edge
+        half = math.tan(cam_config["fov"] / 2.0)
+        pixels_per_radian = (size / 2.0) / half * (1.0 + half**2)
+    elif cam_config["type"] == "EQUISOLID":
+        # r = 2 f sin(theta / 2), the most pixels per radian are at the image centre
+        pixels_per_radian = cam_config["focal_length"] * size / sensor_width
+    else:
+        raise ValueError("Unknown camera type {}".format(cam_config["type"]))
+
+    return int(
+        math.ceil(
+            2.0 * math.pi * pixels_per_radian * scene_config.hdr_cache["oversample"]
+        )
+    )
+
+
+# Path of the smallest version of an environment map with enough detail for the camera
+# Uses the raw HDR when there is no cache or no cached version is big enough
+def select(hdr_data, cam_config, sensor_width, width, height):
+    index = hdr_data.get("cache")
+    if index is None:
+        return hdr_data["raw_path"]
+
+    needed = required_width(cam_config, sensor_width, width, height)
+    path = hdr_data["raw_path"]
+    for v in index["variants"]:
+        if v["width"] < needed:
+            break
+        path = v["path"]
+    return path
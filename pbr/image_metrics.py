@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+
+
+# Load an image as floating point RGB in [0, 1], whatever its bit depth
+def load_image(path):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise NameError("Cannot load image {0}".format(path))
+
+    scale = np.iinfo(img.dtype).max if np.issubdtype(img.dtype, np.integer) else 1.0
+    img = img.astype(np.float64) / scale
+
+    # Drop alpha and convert from OpenCV's BGR order
+    if img.ndim == 3:
+        img = img[..., :3][..., ::-1]
+    return img
+
+
+# Peak signal to noise ratio (dB) between two images in [0, 1]
+def psnr(img, ref):
+    mse = np.mean((img - ref) ** 2)
+    if mse == 0:
+        return float("inf")
+    return float(10.0 * np.log10(1.0 / mse))
+
+
+# Structural similarity (Wang et al. 2004) of the luminance of two images in [0, 1]
+def ssim(img, ref, sigma=1.5):
+    if img.ndim == 3:
+        img = img @ [0.2126, 0.7152, 0.0722]
+        ref = ref @ [0.2126, 0.7152, 0.0722]
+
+    c1 = 0.01**2
+    c2 = 0.03**2
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), sigma)
+
+    mu_x = blur(img)
+    mu_y = blur(ref)
+    var_x = blur(img * img) - mu_x**2
+    var_y = blur(ref * ref) - mu_y**2
+    cov = blur(img * ref) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / (
+        (mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2)
+    )
+    return float(np.mean(ssim_map))
@@ -0,0 +1,122 @@
+import random
+
+import cv2
+import numpy as np
+
+from config import blend_config as blend_cfg
+
+# Camera imperfections (blur, red curve, noise, exposure) in NumPy, matching the imperfection nodes of the
+# compositor (see environment.setup_scene_composite) so they can be applied to rendered images afterwards
+# The compositor works on linear colours, so rendered sRGB images are linearised before applying them
+
+
+# Sample the imperfection parameters of a frame from blend_config.render["imperfections"]
+# Variants additionally get a white balance and sensor noise, which the compositor doesn't apply
+def sample_parameters(rng=random, variant=False):
+    imp_config = blend_cfg.render["imperfections"]
+
+    params = {
+        "blur": rng.randint(imp_config["min_blur"], imp_config["max_blur"]),
+        "red_curve": [
+            round(rng.uniform(0.5, imp_config["max_red"][0]), 2),
+            round(rng.uniform(0.5, imp_config["max_red"][1]), 2),
+        ],
+        "noise": round(
+            rng.uniform(imp_config["min_noise_fac"], imp_config["max_noise_fac"]),
+            2,
+        ),
+        "exposure": round(
+            rng.uniform(imp_config["min_exposure"], imp_config["max_exposure"]), 2
+        ),
+    }
+
+    if variant:
+        wb = imp_config["white_balance"]
+        params["white_balance"] = [
+            round(rng.uniform(1.0 - wb, 1.0 + wb), 3),
+            1.0,
+            round(rng.uniform(1.0 - wb, 1.0 + wb), 3),
+        ]
+        params["shot_noise"] = round(rng.uniform(0.0, imp_config["max_shot_noise"]), 4)
+        params["read_noise"] = round(rng.uniform(0.0, imp_config["max_read_noise"]), 4)
+
+    return params
+
+
+def srgb_to_linear(img):
+    return np.where(img <= 0.04045, img / 12.92, ((img + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(img):
+    img = np.clip(img, 0.0, 1.0)
+    return np.where(img <= 0.0031308, img * 12.92, 1.055 * img ** (1.0 / 2.4) - 0.055)
+
+
+# Lookup table of a smooth monotonic curve through the given (x, y) points (Fritsch-Carlson cubic)
+def curve_lut(points, size=1024):
+    x = np.array([p[0] for p in points], dtype=np.float64)
+    y = np.array([p[1] for p in points], dtype=np.float64)
+    h = np.diff(x)
+    d = np.diff(y) / h
+
+    # Tangents at each point, zero at local extrema so the curve never overshoots
+    m = np.empty(len(x))
+    m[0] = d[0]
+    m[-1] = d[-1]
+    for k in range(1, len(x) - 1):
+        if d[k - 1] * d[k] <= 0:
+            m[k] = 0.0
+        else:
+            w1 = 2 * h[k] + h[k - 1]
+            w2 = h[k] + 2 * h[k - 1]
+            m[k] = (w1 + w2) / (w1 / d[k - 1] + w2 / d[k])
+
+    # Evaluate the cubic Hermite segments
+    xs = np.linspace(0.0, 1.0, size)
+    k = np.clip(np.searchsorted(x, xs, side="right") - 1, 0, len(h) - 1)
+    t = (xs - x[k]) / h[k]
+    h00 = 2 * t**3 - 3 * t**2 + 1
+    h10 = t**3 - 2 * t**2 + t
+    h01 = -2 * t**3 + 3 * t**2
+    h11 = t**3 - t**2
+    return h00 * y[k] + h10 * h[k] * m[k] + h01 * y[k + 1] + h11 * h[k] * m[k + 1]
+
+
+# Apply imperfections to an sRGB image in [0, 1] with RGB(A) channel order
+# Noise is drawn from rng (a np.random.Generator) so a frame's noise can be reproduced
+def apply(img, params, rng):
+    rgb = srgb_to_linear(img[..., :3].astype(np.float32))
+
+    # Blur
+    size = int(params["blur"])
+    if size > 0:
+        rgb = cv2.GaussianBlur(rgb, (2 * size + 1, 2 * size + 1), 0)
+
+    # Red curve through (0, 0), the sampled point and (1, 1)
+    lut = curve_lut([(0.0, 0.0), tuple(params["red_curve"]), (1.0, 1.0)])
+    rgb[..., 0] = np.interp(
+        np.clip(rgb[..., 0], 0.0, 1.0), np.linspace(0, 1, len(lut)), lut
+    )
+
+    # Multiply by white noise, mixed in by the noise factor
+    noise = rng.random(rgb.shape[:2], dtype=np.float32)[..., None]
+    rgb *= 1.0 - params["noise"] + params["noise"] * noise
+
+    # Exposure in stops
+    rgb *= 2.0 ** params["exposure"]
+
+    # White balance gains per channel
+    if "white_balance" in params:
+        rgb *= np.array(params["white_balance"], dtype=np.float32)
+
+    # Sensor noise, with a variance growing linearly with the signal
+    if params.get("shot_noise", 0) > 0 or params.get("read_noise", 0) > 0:
+        sigma = np.sqrt(
+            params.get("shot_noise", 0) * np.clip(rgb, 0.0, None)
+            + params.get("read_noise", 0) ** 2
+        )
+        rgb += sigma * rng.standard_normal(rgb.shape, dtype=np.float32)
+
+    out = img.astype(np.float32, copy=True)
+    out[..., :3] = linear_to_srgb(rgb)
+    return out
@@ -0,0 +1,180 @@
+import os
+import json
+
+import cv2
+import numpy as np
+
+from config import scene_config
+
+# Compact encodings of the segmentation masks (see output_config.mask_format)
+# The rendered masks are colour images, these are turned into
+#   * class-index masks, single channel 8-bit PNGs holding the class index of each pixel, and
+#   * COCO RLE, {class index: {"size": [height, width], "counts": compressed run lengths}} of the pixels of each class
+# The palette comes from the mask colours of scene_config.resources, field lines are the field's index + 1 and pixels
+# of colours outside the palette (e.g. antialiased edges of a rendered environment mask) are ignore_index
+# This module doesn't need Blender, so data loaders can use it to read masks of any encoding with load()
+
+ignore_index = 255
+
+
+# Classes of the masks as a list of (index, name, (r, g, b)) with colours in [0, 1], sorted by index
+# Resources sharing an index (robot and misc_robot) are one class, named after the first of them
+def palette():
+    classes = {}
+    for name, resource in scene_config.resources.items():
+        mask = resource["mask"]
+        if mask["index"] not in classes:
+            classes[mask["index"]] = (mask["index"], name, tuple(mask["colour"][:3]))
+
+    field_mask = scene_config.resources["field"]["mask"]
+    line_index = field_mask["index"] + 1
+    classes[line_index] = (
+        line_index,
+        "field_line",
+        tuple(field_mask["line_colour"][:3]),
+    )
+
+    return [classes[k] for k in sorted(classes)]
+
+
+# (256, 3) array of the 8-bit RGB colour of each class index, indices outside the palette are black
+def palette_array():
+    colours = np.zeros((256, 3), dtype=np.uint8)
+    for index, _, colour in palette():
+        colours[index] = [int(round(v * 255)) for v in colour]
+    return colours
+
+
+# 24-bit keys of RGB colours in the last axis
+def colour_keys(rgb):
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+# Class-index mask of a colour mask loaded by OpenCV (BGR or BGRA, 8 or 16-bit)
+def encode(img):
+    if img.dtype != np.uint8:
+        img = np.round(img.astype(np.float32) * (255.0 / np.iinfo(img.dtype).max))
+    keys = colour_keys(img[..., 2::-1])
+
+    colours = palette_array()
+    indices = np.array([index for index, _, _ in palette()])
+    palette_keys = colour_keys(colours[indices])
+    order = np.argsort(palette_keys)
+    palette_keys = palette_keys[order]
+    indices = indices[order]
+
+    pos = np.minimum(np.searchsorted(palette_keys, keys), len(palette_keys) - 1)
+    return np.where(palette_keys[pos] == keys, indices[pos], ignore_index).astype(
+        np.uint8
+    )
+
+
+# RGB colour mask of a class-index mask
+def decode(classes):
+    return palette_array()[classes]
+
+
+# COCO compressed RLE of a binary mask (runs in column-major order, starting with a run of zeros)
+def rle_encode(binary):
+    height, width = binary.shape
+    flat = np.asarray(binary, dtype=bool).ravel(order="F")
+
+    bounds = np.concatenate(
+        [[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]]
+    )
+    counts = np.diff(bounds).tolist()
+    if flat.size > 0 and flat[0]:
+        counts = [0] + counts
+
+    # Each count is the difference to the count two before it, written 5 bits per character
+    chars = []
+    for ii, x in enumerate(counts):
+        if ii > 2:
+            x -= counts[ii - 2]
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+
+    return {"size": [height, width], "counts": "".join(chars)}
+
+
+# Binary mask of a COCO compressed RLE
+def rle_decode(rle):
+    height, width = rle["size"]
+    s = rle["counts"]
+
+    counts = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+
+    flat = np.repeat(np.arange(len(counts)) % 2 == 1, counts)
+    return flat.reshape((height, width), order="F")
+
+
+# RLE of each class present in a class-index mask, {str(index): rle}
+def encode_rle(classes):
+    return {
+        str(index): rle_encode(classes == index)
+        for index in np.unique(classes).tolist()
+        if index != ignore_index
+    }
+
+
+# Class-index mask of the RLEs of its classes
+def decode_rle(rles):
+    classes = None
+    for index, rle in rles.items():
+        if classes is None:
+            classes = np.full(rle["size"], ignore_index, dtype=np.uint8)
+        classes[rle_decode(rle)] = int(index)
+    return classes
+
+
+# Class-index mask of a mask file of any encoding: colour PNG, class-index PNG or RLE JSON
+def load(path):
+    if os.path.splitext(path)[1] == ".json":
+        with open(path, "r") as f:
+            return decode_rle(json.load(f))
+
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise NameError("Cannot load image {0}".format(path))
+    return img if img.ndim == 2 else encode(img)
+
+
+# Rewrite a rendered colour mask as a class-index PNG (in place) and/or an RLE JSON file in rle_dir
+def convert(path, index=True, rle_dir=None):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None or img.ndim != 3:
+        raise NameError("Cannot load image {0}".format(path))
+    classes = encode(img)
+
+    if rle_dir is not None:
+        name = os.path.splitext(os.path.basename(path))[0] + ".json"
+        with open(os.path.join(rle_dir, name), "w") as f:
+            json.dump(encode_rle(classes), f)
+
+    if index:
+        cv2.imwrite(path, classes)
+
+    return classes
@@ -0,0 +1,307 @@
+import os
+import json
+import importlib.util
+
+import numpy as np
+
+from config import output_config as out_cfg
+
+# Writes the meta of each frame as a row of one table per run shard (see output_config.meta_format)
+# Nested dictionaries become "a.b" columns, lists of numbers and of dictionaries "a.0" columns, and everything else
+# (lists of strings, annotations, instance tables) a JSON string
+# Rows are buffered and appended every meta_table["batch"] frames (and whenever sync() is called) to the shard's
+# journal of JSON lines, which survives a crash of the process. Closing the shard compacts the journal into the table
+#   * "parquet" and "arrow" (Arrow IPC) need pyarrow, without it the journal is kept as the table
+#   * "jsonl" keeps the journal as the table
+# Each process writes its own shard, <meta_dir>/meta_<first frame>_<pid>.<ext>, so workers never share a file. Rows
+# with columns of another type than the rest of the shard start a new part of the shard
+# The journal of a worker that died is left in place as a JSON lines shard
+
+# Entries kept as one JSON string column whatever they hold
+json_keys = {"annotations", "categories", "instances", "variants"}
+
+extensions = {"parquet": ".parquet", "arrow": ".arrow", "jsonl": ".jsonl"}
+
+
+# Flatten a meta dictionary into {column: value}
+def flatten(value, prefix="", row=None):
+    row = {} if row is None else row
+    key = prefix.rsplit(".", 1)[-1]
+
+    if isinstance(value, dict) and key not in json_keys:
+        for k, v in value.items():
+            flatten(v, "{}.{}".format(prefix, k) if prefix else str(k), row)
+    elif (
+        isinstance(value, (list, tuple))
+        and key not in json_keys
+        and all(
+            isinstance(v, (dict, list, tuple, int, float, np.number))
+            and not isinstance(v, bool)
+            for v in value
+        )
+    ):
+        for k, v in enumerate(value):
+            flatten(v, "{}.{}".format(prefix, k), row)
+    elif isinstance(value, (dict, list, tuple)):
+        row[prefix] = json.dumps(value, sort_keys=True)
+    elif isinstance(value, (bool, np.bool_)):
+        row[prefix] = bool(value)
+    elif isinstance(value, (int, float, np.number)):
+        # Columns holding whole numbers in some frames and fractions in others keep one type
+        row[prefix] = float(value)
+    else:
+        row[prefix] = value
+    return row
+
+
+# The table format to write, falling back to JSON lines without pyarrow
+def resolve_format(fmt):
+    if fmt not in extensions:
+        raise ValueError("Unknown meta table format {}".format(fmt))
+    if fmt == "jsonl":
+        return fmt
+    if importlib.util.find_spec("pyarrow") is None:
+        print("[WARN] pyarrow is not installed, writing the meta table as JSON lines")
+        return "jsonl"
+    return fmt
+
+
+# Arrow schema of the columns, from the Python type of each column's values
+def schema(names, types):
+    import pyarrow as pa
+
+    arrow_types = {
+        bool: pa.bool_(),
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        None: pa.null(),
+    }
+    return pa.schema([(n, arrow_types.get(types.get(n), pa.string())) for n in names])
+
+
+class MetaWriter:
+    def __init__(self, directory, fmt, batch_size):
+        self.directory = directory
+        self.fmt = resolve_format(fmt)
+        self.batch_size = batch_size
+        self.rows = []
+        self.name = None
+        self.writer = None
+        self.schema = None
+        # Paths of the parts of the table written while compacting
+        self.parts = []
+
+    def journal_path(self):
+        return os.path.join(self.directory, self.name + extensions["jsonl"])
+
+    def path(self, part):
+        suffix = "" if part == 0 else "_{}".format(part)
+        return os.path.join(self.directory, self.name + suffix + extensions[self.fmt])
+
+    # Add the meta of a frame, appending the buffered rows to the journal once there are batch_size of them
+    def append(self, frame_num, meta):
+        if self.name is None:
+            self.name = "meta_{}_{}".format(
+                str(frame_num).zfill(out_cfg.filename_len), os.getpid()
+            )
+        self.rows.append({"frame": frame_num, **flatten(meta)})
+        if len(self.rows) >= self.batch_size:
+            self.sync()
+
+    # Append the buffered rows to the journal
+    def sync(self):
+        if len(self.rows) == 0:
+            return
+        with open(self.journal_path(), "a") as f:
+            for row in self.rows:
+                f.write(json.dumps(row, sort_keys=True) + "\n")
+        self.rows = []
+
+    # Rewrite the journal as the table, batch_size rows at a time
+    def compact(self):
+        journal = self.journal_path()
+        if self.fmt == "jsonl" or not os.path.isfile(journal):
+            return
+
+        # Every row gets every column of the shard, typed by its first value, so batches share a schema
+        names = set()
+        types = {}
+        for row in read_jsonl(journal):
+            names.update(row)
+            for k, v in row.items():
+                if v is not None:
+                    types.setdefault(k, type(v))
+        names = ["frame"] + sorted(names - {"frame"})
+        self.schema = schema(names, types)
+
+        rows = []
+        for row in read_jsonl(journal):
+            rows.append({k: row.get(k) for k in names})
+            if len(rows) >= self.batch_size:
+                self.write_table(rows)
+                rows = []
+        self.write_table(rows)
+        self.close_writer()
+
+        # Parts are written under temporary names, so a crash while compacting leaves only the journal
+        for ii, part in enumerate(self.parts):
+            os.replace(part, self.path(ii))
+        os.remove(journal)
+
+    def write_table(self, rows):
+        if len(rows) == 0:
+            return
+
+        import pyarrow as pa
+
+        try:
+            table = pa.Table.from_pylist(rows, schema=self.schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # Rows with values of another type than the schema start a new part
+            self.close_writer()
+            table = pa.Table.from_pylist(rows)
+            self.schema = table.schema
+
+        if self.writer is None:
+            path = self.path(len(self.parts)) + ".tmp"
+            self.parts.append(path)
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+            else:
+                self.writer = pa.ipc.new_file(path, self.schema)
+
+        self.writer.write_table(table)
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        self.sync()
+        if self.name is not None:
+            self.compact()
+
+
+# Writer of the current process, opened with its first row
+_writer = None
+
+
+# Add the meta of a frame to the run's table
+def write(frame_num, meta):
+    global _writer
+    if _writer is None:
+        _writer = MetaWriter(
+            out_cfg.meta_dir, out_cfg.meta_table["format"], out_cfg.meta_table["batch"]
+        )
+    _writer.append(frame_num, meta)
+
+
+# Append the buffered rows to the journal, so they are kept if the process dies
+def sync():
+    if _writer is not None:
+        _writer.sync()
+
+
+# Write the buffered rows and close the table, the next row starts a new shard
+def close():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+# Rows of a JSON lines file, a line cut short by a crash while it was written is skipped
+def read_jsonl(path):
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+# Shards of the meta table in a directory, oldest first
+def shards(directory):
+    names = [
+        n
+        for n in os.listdir(directory)
+        if n.startswith("meta_") and os.path.splitext(n)[1] in extensions.values()
+    ]
+    return sorted(names, key=lambda n: os.path.getmtime(os.path.join(directory, n)))
+
+
+# Whether the meta of a run was only written as tables (meta_format "table"), judged from its meta directory
+def table_only(directory):
+    names = os.listdir(directory)
+    return any(n.startswith("meta_") for n in names) and not any(
+        n.endswith(".yaml") for n in names
+    )
+
+
+# Rows of one shard, only keeping the columns under the given top level keys when keys is given
+def read_shard(path, keys=None):
+    def keep(name):
+        return keys is None or name == "frame" or name.split(".", 1)[0] in keys
+
+    ext = os.path.splitext(path)[1]
+    if ext == extensions["jsonl"]:
+        for row in read_jsonl(path):
+            yield {k: v for k, v in row.items() if keep(k)}
+        return
+
+    import pyarrow as pa
+
+    if ext == extensions["parquet"]:
+        import pyarrow.parquet as pq
+
+        columns = [n for n in pq.read_schema(path).names if keep(n)]
+        table = pq.read_table(path, columns=columns)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        table = table.select([n for n in table.column_names if keep(n)])
+    yield from table.to_pylist()
+
+
+# Read the rows of every shard in a directory
+# Returns {frame: row}, a frame in several shards (rendered again after its worker died) keeps its newest row
+def read(directory, keys=None):
+    rows = {}
+    for name in shards(directory):
+        for row in read_shard(os.path.join(directory, name), keys):
+            rows[int(row.pop("frame"))] = row
+    return rows
+
+
+# Rebuild the nested meta of a frame from its row, dropping the columns it has no value for
+def unflatten(row):
+    meta = {}
+    for column, value in row.items():
+        if value is None:
+            continue
+        keys = column.split(".")
+        # Lists of strings and dictionaries of other keys are JSON strings
+        if isinstance(value, str) and value[:1] in ["[", "{"]:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        node = meta
+        for k in keys[:-1]:
+            node = node.setdefault(k, {})
+        node[keys[-1]] = value
+    return _lists(meta)
+
+
+# Turn the dictionaries of "a.0", "a.1", ... columns back into lists
+def _lists(value):
+    if not isinstance(value, dict):
+        return value
+    value = {k: _lists(v) for k, v in value.items()}
+    if len(value) > 0 and set(value) == {str(ii) for ii in range(len(value))}:
+        return [value[str(ii)] for ii in range(len(value))]
+    return value
@@ -6,6 +6,8 @@ import random
 import bpy
 import re
 import json
+import time
+import argparse
 
 # Add our current position to path to include package
 sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
@@ -14,6 +16,7 @@ sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
 from math import pi
 
 from config import output_config as out_cfg
+from config import blend_config as blend_cfg
 from config import scene_config
 
 from scene import environment as env
@@ -26,13 +29,74 @@ from scene.camera_anchor import CameraAnchor
 from scene.shadowcatcher import ShadowCatcher
 from scene.robot import Robot
 from scene.misc_robot import MiscRobot
+from scene.pose_sampler import PoseSampler
 
 # TODO: Reimplement field uv generation with Scikit-Image
 
 import util
-
-
-def main():
+import imperfections
+import hdr_cache
+from asset_sampler import AssetSampler, asset_names
+from scene_scorer import ScenePlanner
+import visibility
+import annotations
+import meta_writer
+import mask_codec
+
+
+# Options which change how the scene is constructed and rendered, shared with worker.py
+def add_scene_args(parser):
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="base random seed, each frame is seeded from this and its frame number",
+    )
+    parser.add_argument(
+        "--quality",
+        default=None,
+        choices=blend_cfg.quality_profiles.keys(),
+        help="sampling and denoising profile for the raw image",
+    )
+    parser.add_argument(
+        "--draft",
+        action="store_true",
+        help="render raw images cheaply at reduced resolution, masks and meta stay full quality",
+    )
+
+
+# Apply the scene options before the scene is constructed
+def apply_scene_args(args):
+    if args.quality is not None:
+        blend_cfg.render["quality"] = args.quality
+    if args.draft:
+        blend_cfg.render["draft"] = True
+
+    # Seed scene construction so every worker of a run builds the same scene
+    if args.seed is not None:
+        util.seed_frame(args.seed, 0)
+
+
+def parse_args():
+    # Blender passes anything after a lone "--" through to the script
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="pbr.py")
+    parser.add_argument("--start-frame", type=int, default=1)
+    parser.add_argument("--num-images", type=int, default=out_cfg.num_images)
+    add_scene_args(parser)
+    parser.add_argument(
+        "--queue", default=None, help="job queue database of a render farm run"
+    )
+    parser.add_argument(
+        "--batch", type=int, default=None, help="id of the queued batch to render"
+    )
+    return parser.parse_args(argv)
+
+
+# Load assets and construct every object in the scene
+# Everything here is done once, rendering a frame only updates what was constructed
+def build_scene():
     ##############################################
     ##              ASSET LOADING               ##
     ##############################################
@@ -43,48 +107,73 @@ def main():
     ##             ENVIRONMENT SETUP            ##
     ##############################################
 
-    with open(hdrs[0]["info_path"], "r") as f:
-        env_info = json.load(f)
-    render_layer_toggle, world = util.setup_environment(hdrs[0], env_info)
+    render_layer_toggle, world = util.setup_environment(hdrs[0], hdrs[0]["info"])
 
     ##############################################
     ##            SCENE CONSTRUCTION            ##
     ##############################################
 
+    # Every object gets its own pass index (see scene_config.instance_index) for the instance masks
     # Construct our default UV sphere ball
-    ball = Ball("Ball", scene_config.resources["ball"]["mask"]["index"], balls[0])
+    ball = Ball(
+        "Ball",
+        scene_config.instance_index(scene_config.resources["ball"]["mask"]["index"], 0),
+        balls[0],
+    )
 
     # Construct our goals
     goals = [
-        Goal(scene_config.resources["goal"]["mask"]["index"]),
-        Goal(scene_config.resources["goal"]["mask"]["index"]),
+        Goal(
+            scene_config.instance_index(
+                scene_config.resources["goal"]["mask"]["index"], ii
+            )
+        )
+        for ii in range(2)
     ]
 
     # Create robots to fill the scene
     robots = [
         Robot(
             "r{}".format(ii),
-            scene_config.resources["robot"]["mask"]["index"],
+            scene_config.instance_index(
+                scene_config.resources["robot"]["mask"]["index"], ii
+            ),
             scene_config.resources["robot"],
         )
         for ii in range(scene_config.num_robots + 1)
     ]
 
+    # Misc robots share the robots' class, so their instances follow the robots'
     misc_robots = [
         MiscRobot(
             "r{}".format(len(robots) + ii),
-            scene_config.resources["misc_robot"]["mask"]["index"],
+            scene_config.instance_index(
+                scene_config.resources["misc_robot"]["mask"]["index"],
+                len(robots) + ii,
+            ),
             scene_config.choose_misc_robot(),
         )
         for ii in range(scene_config.num_misc_robots)
     ]
 
+    # Gather the joints of every robot so their poses can be sampled together
+    pose_sampler = PoseSampler()
+    for r in robots:
+        pose_sampler.add(
+            r.name,
+            r.model,
+            r.robot_parts,
+            r.objs,
+            scene_config.resources["robot"]["kinematics_variance"],
+        )
+    for r in misc_robots:
+        pose_sampler.add(
+            r.name, r.model, r.robot_parts, r.objs, r.robot["kinematics_variance"]
+        )
+
     # Construct our shadowcatcher
     shadowcatcher = ShadowCatcher()
 
-    # Generate a new configuration for field configuration
-    config = scene_config.configure_scene()
-
     # Construct our grass field
     field = Field(scene_config.resources["field"]["mask"]["index"])
 
@@ -105,307 +194,596 @@ def main():
     # Add randomly generated shapes into scene
     shapes = [Shape("s{}".format(ii), 0) for ii in range(scene_config.num_shapes)]
 
-    ##############################################
-    ##               SCENE UPDATE               ##
-    ##############################################
-
-    for frame_num in range(1, out_cfg.num_images + 1):
-        # Generate a new configuration
-        config = scene_config.configure_scene()
-
-        cam_l.update(config["camera"])
-
-        if out_cfg.output_imperfections:
+    asset_sampler = AssetSampler(hdrs, balls, grasses)
+
+    return {
+        "hdrs": hdrs,
+        "balls": balls,
+        "grasses": grasses,
+        "asset_sampler": asset_sampler,
+        "scene_planner": ScenePlanner(asset_sampler),
+        "render_layer_toggle": render_layer_toggle,
+        "world": world,
+        "ball": ball,
+        "goals": goals,
+        "robots": robots,
+        "misc_robots": misc_robots,
+        "pose_sampler": pose_sampler,
+        "shadowcatcher": shadowcatcher,
+        "field": field,
+        "cam_l": cam_l,
+        "cam_r": cam_r,
+        "anch": anch,
+        "shapes": shapes,
+    }
+
+
+# Randomise the constructed scene for a single frame
+# Returns the configuration and the assets that were chosen for the frame
+def update_scene(scene, frame_num):
+    ball = scene["ball"]
+    goals = scene["goals"]
+    robots = scene["robots"]
+    misc_robots = scene["misc_robots"]
+    field = scene["field"]
+    cam_l = scene["cam_l"]
+    anch = scene["anch"]
+    shapes = scene["shapes"]
+
+    # Choose the environment, ball, grass and camera to use and generate a new configuration
+    assets, config = scene["scene_planner"].plan(frame_num)
+    hdr_data = assets["hdr"]
+    ball_data = assets["ball"]
+    grass_data = assets["grass"]
+    config["assets"] = asset_names(assets)
+
+    cam_l.update(config["camera"])
+
+    if out_cfg.output_imperfections:
+        config["imperfections"] = imperfections.sample_parameters()
+        if out_cfg.imperfections_mode == "compositor":
             composition_nodes = bpy.context.scene.node_tree.nodes
-            env.randomise_imperfections(
+            env.set_imperfections(
                 composition_nodes["Blur"],
                 composition_nodes["RGB Curves"],
                 composition_nodes["Mix"],
                 composition_nodes["Exposure"],
+                config["imperfections"],
             )
-
-        # Update shapes
-        for ii in range(len(shapes)):
-            shapes[ii].update(config["shape"][ii])
-            shapes[ii].obj.keyframe_insert(data_path="location", frame=frame_num)
-            shapes[ii].obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
-
-        # Select the ball, environment, and grass to use
-        hdr_data = random.choice(hdrs)
-        ball_data = random.choice(balls)
-        grass_data = random.choice(grasses)
-
-        # Load the environment information
-        with open(hdr_data["info_path"], "r") as f:
-            env_info = json.load(f)
-
-        is_semi_synthetic = (
-            not env_info["to_draw"]["goal"] or not env_info["to_draw"]["field"]
-        )
-
-        # In that case we must use the height provided by the file
-        if is_semi_synthetic:
-            config["robot"][0]["position"] = (
-                0.0,
-                0.0,
-                env_info["position"]["z"] - 0.33,
-            )
-
-        # Calculate camera location
-        camera_loc = (0.0, 0.0, env_info["position"]["z"])
-        # Only move camera robot if we're generating the field
-        robot_start = 1 if is_semi_synthetic else 0
-
-        points_on_field = util.point_on_field(
-            camera_loc, hdr_data["mask_path"], env_info, len(robots) + 1
+        else:
+            # Seeds the noise postprocess.py multiplies the image by
+            config["imperfections"]["noise_seed"] = random.getrandbits(32)
+
+    # Update shapes
+    for ii in range(len(shapes)):
+        shapes[ii].update(config["shape"][ii])
+        util.keyframe_transform(shapes[ii].obj, frame_num)
+
+    # The environment information is loaded once with the environment catalog
+    env_info = hdr_data["info"]
+    is_semi_synthetic = hdr_data["is_semi_synthetic"]
+
+    # In that case we must use the height provided by the file
+    if is_semi_synthetic:
+        config["robot"][0]["position"] = (
+            0.0,
+            0.0,
+            env_info["position"]["z"] - 0.33,
         )
-        print("Points on field: \n", points_on_field)
-        # Generate new world points for the robots and use this to update their location
-        world_points = util.generate_moves(scene_config.field_dims)
-        for ii in range(robot_start, len(robots)):
-            # If we are autoplacing update the configuration
-            if (
-                config["robot"][ii]["auto_position"]
-                and is_semi_synthetic
-                and len(points_on_field) > 0
-            ):
-
-                # Generate new ground point based on camera (actually robot parent of camera)
-                config["robot"][ii]["position"] = (
-                    world_points[ii - 1][0],
-                    world_points[ii - 1][1],
-                    (
-                        world_points[ii - 1][2]
-                        if ii == 0
-                        else config["robot"][ii]["position"][2]
-                    ),
-                )
-            # Update robot (and camera)
-            robots[ii].update(config["robot"][ii])
-            robots[ii].obj.keyframe_insert(data_path="location", frame=frame_num)
-            robots[ii].obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
-
-        num_robots = len(robots) - 1
-
-        for ii in range(len(misc_robots)):
-            config["misc_robot"][ii]["position"] = (
-                world_points[ii + num_robots][0],
-                world_points[ii + num_robots][1],
-                misc_robots[ii].get_height(),
-            )
-            misc_robots[ii].update(config["misc_robot"][ii])
-            misc_robots[ii].obj.keyframe_insert(data_path="location", frame=frame_num)
-            misc_robots[ii].obj.keyframe_insert(
-                data_path="rotation_euler", frame=frame_num
-            )
 
-        # Update ball
+    # Calculate camera location
+    camera_loc = (0.0, 0.0, env_info["position"]["z"])
+    # Only move camera robot if we're generating the field
+    robot_start = 1 if is_semi_synthetic else 0
+
+    # Pose every robot, the camera robot keeps its pose when it isn't moved
+    poses = scene["pose_sampler"].update(
+        exclude=[robots[0].name] if is_semi_synthetic else []
+    )
+
+    points_on_field = util.point_on_field(camera_loc, hdr_data, len(robots) + 1)
+    print("Points on field: \n", points_on_field)
+    # Generate new world points for the robots and use this to update their location
+    world_points = util.generate_moves(scene_config.field_dims)
+    for ii in range(robot_start, len(robots)):
         # If we are autoplacing update the configuration
         if (
-            config["ball"]["auto_position"]
+            config["robot"][ii]["auto_position"]
             and is_semi_synthetic
             and len(points_on_field) > 0
         ):
-            # Generate new ground point based on camera (actually robot parent of camera)
-            config["ball"]["position"] = (
-                points_on_field[0][0],
-                points_on_field[0][1],
-                config["ball"]["position"][2],
-            )
 
-        # Apply the updates
-        field.update(grass_data, config["field"])
-        field.obj.keyframe_insert(data_path="location", frame=frame_num)
-        field.obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
-
-        ball.update(ball_data, config["ball"])
-        ball.obj.keyframe_insert(data_path="location", frame=frame_num)
-        ball.obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
-
-        # Update goals
-        for g in goals:
-            g.update(config["goal"])
-        goals[1].rotate((0, 0, pi))
-
-        goal_height_offset = -3.0 if config["goal"]["shape"] == "square" else -1.0
-        goals[0].move(
-            (
-                config["field"]["length"] / 2.0,
-                0,
-                config["goal"]["height"]
-                + goal_height_offset * config["goal"]["post_width"],
+            # Generate new ground point based on camera (actually robot parent of camera)
+            config["robot"][ii]["position"] = (
+                world_points[ii - 1][0],
+                world_points[ii - 1][1],
+                (
+                    world_points[ii - 1][2]
+                    if ii == 0
+                    else config["robot"][ii]["position"][2]
+                ),
             )
+        # Stand robots posed from a library on the ground, the camera robot keeps its height
+        config["robot"][ii]["pose"] = poses[robots[ii].name]
+        base_height = scene["pose_sampler"].base_height(
+            robots[ii].model, config["robot"][ii]["pose"]
         )
-        goals[0].obj.keyframe_insert(data_path="location", frame=frame_num)
-        goals[0].obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
-
-        goals[1].move(
-            (
-                -config["field"]["length"] / 2.0,
-                0,
-                config["goal"]["height"]
-                + goal_height_offset * config["goal"]["post_width"],
+        if ii > 0 and base_height is not None:
+            config["robot"][ii]["position"] = (
+                config["robot"][ii]["position"][0],
+                config["robot"][ii]["position"][1],
+                base_height,
             )
+
+        # Update robot (and camera)
+        robots[ii].update(config["robot"][ii])
+        util.keyframe_transform(robots[ii].obj, frame_num)
+
+    num_robots = len(robots) - 1
+
+    for ii in range(len(misc_robots)):
+        config["misc_robot"][ii]["pose"] = poses[misc_robots[ii].name]
+        base_height = scene["pose_sampler"].base_height(
+            misc_robots[ii].model, config["misc_robot"][ii]["pose"]
+        )
+        config["misc_robot"][ii]["position"] = (
+            world_points[ii + num_robots][0],
+            world_points[ii + num_robots][1],
+            misc_robots[ii].get_height() if base_height is None else base_height,
+        )
+        misc_robots[ii].update(config["misc_robot"][ii])
+        util.keyframe_transform(misc_robots[ii].obj, frame_num)
+
+    # Update ball
+    # If we are autoplacing update the configuration
+    if (
+        config["ball"]["auto_position"]
+        and is_semi_synthetic
+        and len(points_on_field) > 0
+    ):
+        # Generate new ground point based on camera (actually robot parent of camera)
+        config["ball"]["position"] = (
+            points_on_field[0][0],
+            points_on_field[0][1],
+            config["ball"]["position"][2],
         )
 
-        goals[1].obj.keyframe_insert(data_path="location", frame=frame_num)
-        goals[1].obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
-
-        # Hide objects based on environment map
-        ball.obj.hide_render = not env_info["to_draw"]["ball"]
-        field.hide_render(not env_info["to_draw"]["field"])
-        goals[0].hide_render(not env_info["to_draw"]["goal"])
-        goals[1].hide_render(not env_info["to_draw"]["goal"])
-
-        # Update anchor
-        anch.update(config["anchor"])
-
-        # Set a tracking target randomly to anchor/ball or goal
-        valid_tracks = []
-        if env_info["to_draw"]["ball"]:  # Only track balls if it's rendered
-            valid_tracks.append(ball)
-        if env_info["to_draw"]["goal"]:  # Only track goals if they're rendered
-            valid_tracks.append(random.choice(goals))
-        if env_info["to_draw"][
-            "field"
-        ]:  # Only pick random points if the field is rendered
-            valid_tracks.append(anch)
-
-        tracking_target = random.choice(valid_tracks).obj
-        robots[0].update_main_robot(tracking_target)
-
-        cam_l.update(
-            config["camera"],
-            targets={
-                "robot": {
-                    "obj": robots[0].obj,
-                    "left_eye": bpy.data.objects["r0_L_Eye_Socket"],
-                },
-                "target": tracking_target,
+    # Apply the updates
+    field.update(grass_data, config["field"])
+    util.keyframe_transform(field.obj, frame_num)
+
+    ball.update(ball_data, config["ball"])
+    util.keyframe_transform(ball.obj, frame_num)
+
+    # Update goals
+    for g in goals:
+        g.update(config["goal"])
+    goals[1].rotate((0, 0, pi))
+
+    goal_height_offset = -3.0 if config["goal"]["shape"] == "square" else -1.0
+    goals[0].move(
+        (
+            config["field"]["length"] / 2.0,
+            0,
+            config["goal"]["height"]
+            + goal_height_offset * config["goal"]["post_width"],
+        )
+    )
+    util.keyframe_transform(goals[0].obj, frame_num)
+
+    goals[1].move(
+        (
+            -config["field"]["length"] / 2.0,
+            0,
+            config["goal"]["height"]
+            + goal_height_offset * config["goal"]["post_width"],
+        )
+    )
+
+    util.keyframe_transform(goals[1].obj, frame_num)
+
+    # Hide objects based on environment map
+    ball.obj.hide_render = not env_info["to_draw"]["ball"]
+    field.hide_render(not env_info["to_draw"]["field"])
+    goals[0].hide_render(not env_info["to_draw"]["goal"])
+    goals[1].hide_render(not env_info["to_draw"]["goal"])
+
+    # Update anchor
+    anch.update(config["anchor"])
+
+    # Set a tracking target randomly to anchor/ball or goal
+    valid_tracks = []
+    if env_info["to_draw"]["ball"]:  # Only track balls if it's rendered
+        valid_tracks.append(ball)
+    if env_info["to_draw"]["goal"]:  # Only track goals if they're rendered
+        valid_tracks.append(random.choice(goals))
+    if env_info["to_draw"]["field"]:  # Only pick random points if the field is rendered
+        valid_tracks.append(anch)
+
+    tracking_target = random.choice(valid_tracks).obj
+    robots[0].update_main_robot(tracking_target)
+    # Keyframe the new yaw, otherwise changing frame would restore the yaw keyframed above
+    util.keyframe_transform(robots[0].obj, frame_num)
+
+    cam_l.update(
+        config["camera"],
+        targets={
+            "robot": {
+                "obj": robots[0].obj,
+                "left_eye": bpy.data.objects["r0_L_Eye_Socket"],
             },
+            "target": tracking_target,
+        },
+    )
+
+    print(
+        '[INFO] Frame {0}: ball: "{1}", map: "{2}", target: {3}'.format(
+            frame_num,
+            os.path.basename(ball_data["colour_path"]),
+            os.path.basename(hdr_data["raw_path"]),
+            tracking_target.name,
         )
+    )
 
-        print(
-            '[INFO] Frame {0}: ball: "{1}", map: "{2}", target: {3}'.format(
-                frame_num,
-                os.path.basename(ball_data["colour_path"]),
-                os.path.basename(hdr_data["raw_path"]),
-                tracking_target.name,
-            )
-        )
+    # Update the camera then insert the rotation keyframe after rotating the camera
+    # Updates scene to rectify rotation and location matrices and set the frame number for the current scene
+    util.keyframe_transform(cam_l.obj, frame_num)
 
-        # Update the camera then insert the rotation keyframe after rotating the camera
-        # Updates scene to rectify rotation and location matrices and set the frame number for the current scene
-        cam_l.obj.keyframe_insert(data_path="location", frame=frame_num)
-        cam_l.obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
+    bpy.context.scene.frame_set(frame_num)
 
-        bpy.context.scene.frame_set(frame_num)
+    cam_l.set_tracking_target(tracking_target)
 
-        cam_l.set_tracking_target(tracking_target)
+    bpy.context.view_layer.update()
 
-        bpy.context.view_layer.update()
+    # Use the smallest cached version of the environment map with enough detail for the raw image
+    resolution = [
+        r * raw_percentage() / 100 for r in blend_cfg.render["dimensions"]["resolution"]
+    ]
+    hdr_path = hdr_cache.select(
+        hdr_data, config["camera"], cam_l.cam.sensor_width, *resolution
+    )
+
+    return {
+        "config": config,
+        "env_info": env_info,
+        "hdr_data": hdr_data,
+        "hdr_path": hdr_path,
+        "ball_data": ball_data,
+        "tracking_target": tracking_target,
+    }
+
+
+# Randomise the scene for a frame, resampling it until it passes the frame filter
+def plan_frame(scene, frame_num):
+    if not scene_config.frame_filter["enabled"]:
+        return update_scene(scene, frame_num)
+
+    max_attempts = scene_config.frame_filter["max_attempts"]
+    for attempt in range(1, max_attempts + 1):
+        frame = update_scene(scene, frame_num)
+        accepted, reasons, stats = visibility.check_frame(scene, frame)
+        if accepted:
+            break
+        print(
+            "[INFO] Frame {0}: resampling ({1})".format(frame_num, ", ".join(reasons))
+        )
+    else:
+        print(
+            "[WARN] Frame {0}: no scene passed the frame filter in {1} attempts".format(
+                frame_num, max_attempts
+            )
+        )
 
-        ##############################################
-        ##                RENDERING                 ##
-        ##############################################
+    frame["config"]["frame_filter"] = {
+        "attempts": attempt,
+        "accepted": accepted,
+        **stats,
+    }
+    return frame
+
+
+# Resolution percentage the raw image is rendered at
+def raw_percentage():
+    if blend_cfg.render["draft"]:
+        return blend_cfg.draft["percentage"]
+    return blend_cfg.render["dimensions"]["percentage"]
+
+
+# Whether the environment behind the objects of the mask is reprojected instead of rendered
+def reproject_mask_background(hdr_data):
+    return (
+        blend_cfg.render["mask_background"] == "reproject"
+        and hdr_data["mask_path"] is not None
+    )
+
+
+# Randomise the constructed scene and render the raw image, mask and meta for a single frame
+#   seeds: {"run", "frame"} seeds the random number generators were seeded with, recorded in the meta
+def render_frame(scene, frame_num, seeds=None):
+    render_layer_toggle = scene["render_layer_toggle"]
+    world = scene["world"]
+    shadowcatcher = scene["shadowcatcher"]
+    cam_l = scene["cam_l"]
+
+    start = time.time()
+    frame = plan_frame(scene, frame_num)
+    frame["seeds"] = seeds
+    timing = {"plan": time.time() - start}
+    config = frame["config"]
+    env_info = frame["env_info"]
+    hdr_data = frame["hdr_data"]
 
-        filename = str(frame_num).zfill(out_cfg.filename_len)
+    ##############################################
+    ##                RENDERING                 ##
+    ##############################################
 
-        if out_cfg.output_depth:
-            # Set depth filename
-            render_layer_toggle[2].file_slots[0].path = filename + ".exr"
+    filename = str(frame_num).zfill(out_cfg.filename_len)
+
+    if out_cfg.output_depth:
+        # Set depth filename
+        render_layer_toggle[2].file_slots[0].path = filename + ".exr"
+    if out_cfg.output_instances:
+        # Set instance mask filename
+        render_layer_toggle[3].file_slots[0].path = filename + ".png"
+
+    # Render for the main camera only
+    bpy.context.scene.camera = cam_l.obj
+
+    # Use multiview stereo if stereo output is enabled
+    # (this will automatically render the second camera)
+    if out_cfg.output_stereo:
+        bpy.context.scene.render.use_multiview = True
+
+    # Render raw image
+    raw_start = time.time()
+    util.render_image(
+        isMaskImage=False,
+        toggle=render_layer_toggle,
+        shadowcatcher=shadowcatcher,
+        world=world,
+        env=env,
+        hdr_path=frame["hdr_path"],
+        strength=config["environment"]["strength"],
+        env_info=env_info,
+        output_path=os.path.join(out_cfg.render_image_dir, "{}.png".format(filename)),
+    )
+    timing["raw"] = time.time() - raw_start
+
+    # Render mask image, reprojecting the environment mask behind the objects if enabled
+    mask_start = time.time()
+    reproject = reproject_mask_background(hdr_data)
+    mask_paths = util.render_image(
+        isMaskImage=True,
+        toggle=render_layer_toggle,
+        shadowcatcher=shadowcatcher,
+        world=world,
+        env=env,
+        hdr_path=None if reproject else hdr_data["mask_path"],
+        strength=1.0,
+        env_info=env_info,
+        output_path=os.path.join(out_cfg.mask_dir, "{}.png".format(filename)),
+        transparent=reproject,
+    )
+    if reproject:
+        util.composite_mask_background(
+            mask_paths, hdr_data["mask_path"], config["camera"], cam_l, env_info
+        )
+    compact_masks(mask_paths)
+
+    if out_cfg.output_depth:
+        rename_file_output(out_cfg.depth_dir, filename, ".exr")
+        util.upscale_depth([os.path.join(out_cfg.depth_dir, filename + ".exr")])
+    if out_cfg.output_instances:
+        rename_file_output(out_cfg.instance_dir, filename, ".png")
+    timing["mask"] = time.time() - mask_start
+
+    # Durations (s) of the frame's planning and renders
+    timing["total"] = time.time() - start
+    frame["timing"] = timing
+
+    # Check that the rotation matrix of the main camera is valid
+    print(f"Rotation matrix of {cam_l.obj.name}: \n", cam_l.obj.matrix_world)
+
+    write_meta(scene, frame_num, frame)
+
+
+# Rewrite rendered masks in the encodings of out_cfg.mask_format and out_cfg.output_mask_rle (see mask_codec.py)
+def compact_masks(mask_paths):
+    index = out_cfg.mask_format == "index"
+    rle_dir = out_cfg.mask_rle_dir if out_cfg.output_mask_rle else None
+    if not index and rle_dir is None:
+        return
+
+    for output_path in mask_paths:
+        # Stereo renders write one mask per view
+        root, ext = os.path.splitext(output_path)
+        for path in [output_path, root + "_L" + ext, root + "_R" + ext]:
+            if os.path.isfile(path):
+                mask_codec.convert(path, index=index, rle_dir=rle_dir)
+
+
+# Rename our mis-named file output(s) due to Blender's file output node naming scheme!
+def rename_file_output(directory, filename, ext):
+    suffixes = ["_L", "_R"] if out_cfg.output_stereo else [""]
+    for suffix in suffixes:
+        os.rename(
+            os.path.join(directory, filename) + suffix + ext + "0001",
+            os.path.join(directory, filename) + suffix + ext,
+        )
 
-        # Render for the main camera only
-        bpy.context.scene.camera = cam_l.obj
 
-        # Use multiview stereo if stereo output is enabled
-        # (this will automatically render the second camera)
-        if out_cfg.output_stereo:
-            bpy.context.scene.render.use_multiview = True
-
-        # Render raw image
-        util.render_image(
-            isMaskImage=False,
-            toggle=render_layer_toggle,
-            shadowcatcher=shadowcatcher,
-            world=world,
-            env=env,
-            hdr_path=hdr_data["raw_path"],
-            strength=config["environment"]["strength"],
-            env_info=env_info,
-            output_path=os.path.join(out_cfg.image_dir, "{}.png".format(filename)),
+# The objects of each instance id in the instance masks of a frame
+# Returns {id: {"name", "category"}}, ids missing from the table are the environment
+def instance_table(scene, frame):
+    to_draw = frame["env_info"]["to_draw"]
+    objects = []
+    if to_draw["ball"]:
+        objects.append((scene["ball"], scene["ball"].obj.name, "ball"))
+    if to_draw["goal"]:
+        objects += [(g, g.obj.name, "goal") for g in scene["goals"]]
+    if to_draw["field"]:
+        objects.append((scene["field"], "field", "field"))
+    objects += [(r, r.name, "robot") for r in scene["robots"]]
+    objects += [(r, r.name, "misc_robot") for r in scene["misc_robots"]]
+
+    table = {}
+    for obj, name, category in objects:
+        table[obj.pass_index] = {"name": name, "category": category}
+        if category in ["robot", "misc_robot"]:
+            table[obj.pass_index]["model"] = obj.model
+    return table
+
+
+# Write the meta file of a rendered frame from the frame's configuration and the current scene
+def write_meta(scene, frame_num, frame):
+    cam_l = scene["cam_l"]
+    cam_r = scene["cam_r"]
+    config = frame["config"]
+    env_info = frame["env_info"]
+    hdr_data = frame["hdr_data"]
+    tracking_target = frame["tracking_target"]
+
+    filename = str(frame_num).zfill(out_cfg.filename_len)
+
+    # Annotate the objects in view before the camera configuration is split for stereo
+    if out_cfg.output_annotations:
+        cameras = (
+            {"left": cam_l, "right": cam_r} if out_cfg.output_stereo else {"": cam_l}
         )
+        frame_annotations = annotations.frame_annotations(scene, frame, cameras)
+
+    # Gather metadata
+    meta = config
+
+    meta.update({"rendered": env_info["to_draw"]})
+
+    # Mark frames whose raw image was rendered in draft mode
+    if blend_cfg.render["draft"]:
+        meta["draft"] = True
+
+    # Add basic camera information
+    meta["camera"]["focus"] = tracking_target.name
+    meta["camera"]["lens"] = {}
+    meta["camera"]["lens"]["sensor_height"] = cam_l.cam.sensor_height
+    meta["camera"]["lens"]["sensor_width"] = cam_l.cam.sensor_width
+
+    # Add the final camera matrices
+    if not out_cfg.output_stereo:
+        meta["camera"]["matrix"] = util.matrix_to_list(cam_l.obj.matrix_world)
+    else:
+        template = meta["camera"]
+        meta["camera"] = {
+            "left": {
+                **template,
+                "matrix": util.matrix_to_list(cam_l.obj.matrix_world),
+            },
+            "right": {
+                **template,
+                "matrix": util.matrix_to_list(cam_r.obj.matrix_world),
+            },
+        }
 
-        # Render mask image
-        util.render_image(
-            isMaskImage=True,
-            toggle=render_layer_toggle,
-            shadowcatcher=shadowcatcher,
-            world=world,
-            env=env,
-            hdr_path=hdr_data["mask_path"],
-            strength=1.0,
-            env_info=env_info,
-            output_path=os.path.join(out_cfg.mask_dir, "{}.png".format(filename)),
+    if out_cfg.output_annotations:
+        if out_cfg.output_stereo:
+            meta["camera"]["left"]["annotations"] = frame_annotations["left"]
+            meta["camera"]["right"]["annotations"] = frame_annotations["right"]
+        else:
+            meta["annotations"] = frame_annotations[""]
+        meta["categories"] = annotations.categories()
+
+    if out_cfg.output_instances:
+        meta["instances"] = instance_table(scene, frame)
+
+    meta["environment"]["file"] = os.path.relpath(
+        hdr_data["raw_path"], scene_config.res_path
+    )
+    if frame["hdr_path"] != hdr_data["raw_path"]:
+        meta["environment"]["variant"] = os.path.relpath(
+            frame["hdr_path"], scene_config.res_path
         )
 
-        if out_cfg.output_depth:
-            # Rename our mis-named depth file(s) due to Blender's file output node naming scheme!
-            if out_cfg.output_stereo:
-                os.rename(
-                    os.path.join(out_cfg.depth_dir, filename) + "_L.exr0001",
-                    os.path.join(out_cfg.depth_dir, filename) + "_L.exr",
-                )
-                os.rename(
-                    os.path.join(out_cfg.depth_dir, filename) + "_R.exr0001",
-                    os.path.join(out_cfg.depth_dir, filename) + "_R.exr",
-                )
-            else:
-                os.rename(
-                    os.path.join(out_cfg.depth_dir, filename) + ".exr0001",
-                    os.path.join(out_cfg.depth_dir, filename) + ".exr",
-                )
-
-        # Check that the rotation matrix of the main camera is valid
-        print(f"Rotation matrix of {cam_l.obj.name}: \n", cam_l.obj.matrix_world)
-
-        # Generate meta file
+    if frame.get("seeds") is not None:
+        meta["seeds"] = frame["seeds"]
+    if "timing" in frame:
+        meta["timing"] = frame["timing"]
+
+    # Write metadata to file
+    if out_cfg.meta_format in ["json", "both"]:
         with open(
             os.path.join(out_cfg.meta_dir, "{}.yaml".format(filename)), "w"
         ) as meta_file:
-            # Gather metadata
-            meta = config
-
-            meta.update({"rendered": env_info["to_draw"]})
-
-            # Add basic camera information
-            meta["camera"]["focus"] = tracking_target.name
-            meta["camera"]["lens"] = {}
-            meta["camera"]["lens"]["sensor_height"] = cam_l.cam.sensor_height
-            meta["camera"]["lens"]["sensor_width"] = cam_l.cam.sensor_width
-
-            # Add the final camera matrices
-            if not out_cfg.output_stereo:
-                meta["camera"]["matrix"] = util.matrix_to_list(cam_l.obj.matrix_world)
-            else:
-                template = meta["camera"]
-                meta["camera"] = {
-                    "left": {
-                        **template,
-                        "matrix": util.matrix_to_list(cam_l.obj.matrix_world),
-                    },
-                    "right": {
-                        **template,
-                        "matrix": util.matrix_to_list(cam_r.obj.matrix_world),
-                    },
-                }
-
-            meta["environment"]["file"] = os.path.relpath(
-                hdr_data["raw_path"], scene_config.res_path
+            json.dump(meta, meta_file, indent=4, sort_keys=True)
+    if out_cfg.meta_format in ["table", "both"]:
+        meta_writer.write(frame_num, meta)
+
+
+# Render frames [start_frame, end_frame), optionally as a batch of a render farm job queue
+# Returns the number of frames rendered
+def render_frames(scene, start_frame, end_frame, seed=None, queue=None, batch=None):
+    frame_num = start_frame
+    try:
+        while frame_num < end_frame:
+            seeds = None
+            if seed is not None:
+                seeds = {"run": seed, "frame": util.seed_frame(seed, frame_num)}
+
+            render_frame(scene, frame_num, seeds)
+
+            # Report the finished frame, another worker may have stolen the end of our batch
+            if queue is not None:
+                # A resumed batch starts after the reported frame, so its meta row has to be in the journal first
+                meta_writer.sync()
+                end_frame = queue.heartbeat(batch, frame_num)
+
+            frame_num += 1
+    finally:
+        # Compact the meta rows of the batch into its table, each batch of frames gets its own shard
+        meta_writer.close()
+
+    return frame_num - start_frame
+
+
+# Render the batch of frames described by a frame plan
+#   * {"start_frame": 1, "num_images": 10, "seed": 42} renders a fixed range of frames
+#   * {"queue": "<run>/queue.sqlite", "batch": 3, "seed": 42} renders a batch of a render farm queue
+def render_plan(scene, plan):
+    seed = plan.get("seed")
+
+    if plan.get("queue") is not None:
+        from farm.job_queue import JobQueue
+
+        queue = JobQueue(plan["queue"])
+        try:
+            start_frame = queue.batch(plan["batch"])["next"]
+            end_frame = queue.heartbeat(plan["batch"])
+            return render_frames(
+                scene, start_frame, end_frame, seed, queue, plan["batch"]
             )
+        finally:
+            queue.close()
 
-            # Write metadata to file
-            json.dump(meta, meta_file, indent=4, sort_keys=True)
+    start_frame = plan.get("start_frame", 1)
+    return render_frames(
+        scene, start_frame, start_frame + plan["num_images"], seed=seed
+    )
+
+
+def main():
+    args = parse_args()
+
+    apply_scene_args(args)
+    scene = build_scene()
+
+    render_plan(
+        scene,
+        {
+            "start_frame": args.start_frame,
+            "num_images": args.num_images,
+            "seed": args.seed,
+            "queue": args.queue,
+            "batch": args.batch,
+        },
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+#!/usr/local/bin/blender -P
+
+import os
+import re
+import sys
+import bpy
+import argparse
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import numpy as np
+
+from config import scene_config as scene_cfg
+
+from scene import environment as env
+from scene import robot_model
+from scene import pose_sampler
+
+# Builds the pose library of each robot model used by PoseSampler
+# Poses are sampled from the model's kinematics, and forward kinematics (Blender's world matrices) give
+# the lowest point of the posed robot. Poses standing on anything other than the feet are rejected, and
+# the base height putting the feet on the ground is stored with each pose so no physics is needed at
+# render time
+#   blender -b -P pbr/pose_library.py -- --poses 2000 --models NUgus_esh darwin
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="pose_library.py")
+    parser.add_argument(
+        "--poses", type=int, default=1000, help="number of poses to keep per model"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=None,
+        help="names of the models to build libraries for, all models by default",
+    )
+    parser.add_argument(
+        "--variance",
+        type=float,
+        default=None,
+        help="kinematics variance to sample with, the model's configured variance by default",
+    )
+    parser.add_argument(
+        "--feet",
+        default=r"foot|ankle|sole",
+        help="regex matching the parts that may touch the ground",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="how far (m) below the feet another part may reach before a pose is rejected",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=scene_cfg.pose_library["path"])
+    return parser.parse_args(argv)
+
+
+# Every robot model in the scene configuration keyed by model name
+def robot_models():
+    robots = [scene_cfg.resources["robot"]] + list(
+        scene_cfg.resources["misc_robot"]["robot_list"].values()
+    )
+    return {os.path.splitext(os.path.basename(r["mesh_path"]))[0]: r for r in robots}
+
+
+# Vertices of each part in the part's local coordinates, as homogeneous (n, 4) arrays
+def part_vertices(objs):
+    verts = {}
+    for p, obj in objs.items():
+        co = np.empty(len(obj.data.vertices) * 3, dtype=np.float64)
+        obj.data.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3)
+        verts[p] = np.hstack([co, np.ones((len(co), 1))])
+    return verts
+
+
+# Lowest world z of the given parts
+def lowest_point(objs, verts, parts):
+    lowest = np.inf
+    for p in parts:
+        if len(verts[p]) == 0:
+            continue
+        # Only the z row of the world matrix is needed
+        z = verts[p] @ np.array(objs[p].matrix_world)[2]
+        lowest = min(lowest, float(z.min()))
+    return lowest
+
+
+def build_library(name, robot_info, args):
+    model = robot_model.load(robot_info)
+    objs = robot_model.instantiate(model, name, 0)
+    root = [obj for obj in objs.values() if obj.parent is None][0]
+    root.location = (0.0, 0.0, 0.0)
+
+    variance = (
+        robot_info["kinematics_variance"] if args.variance is None else args.variance
+    )
+    sampler = pose_sampler.PoseSampler()
+    sampler.add(
+        name,
+        model["name"],
+        model["parts"],
+        {"{}_{}".format(name, p): obj for p, obj in objs.items()},
+        variance,
+    )
+
+    # MiscRobot.update replaces the delta rotation of the base with the robot's yaw
+    reset_root = robot_info is not scene_cfg.resources["robot"]
+
+    verts = part_vertices(objs)
+    feet = [p for p in objs.keys() if re.search(args.feet, p, re.I) is not None]
+    if len(feet) == 0:
+        print(
+            "[WARN] No parts of {} match '{}', using all parts".format(name, args.feet)
+        )
+        feet = list(objs.keys())
+
+    poses = []
+    heights = []
+    attempts = 0
+    while len(poses) < args.poses and attempts < args.poses * 20:
+        attempts += 1
+
+        angles = pose_sampler.sample_triangular(sampler.limits, sampler.variance)
+        sampler.apply(angles)
+        if reset_root:
+            root.delta_rotation_euler = (0.0, 0.0, 0.0)
+        bpy.context.view_layer.update()
+
+        lowest = lowest_point(objs, verts, objs.keys())
+        lowest_foot = lowest_point(objs, verts, feet)
+
+        # Reject poses which would stand on a hand, the head, etc.
+        if lowest_foot - lowest > args.tolerance:
+            continue
+
+        poses.append(np.degrees(angles))
+        heights.append(root.location[2] - lowest)
+
+    if len(poses) < args.poses:
+        print(
+            "[WARN] Only {} of {} sampled poses of {} stand on their feet".format(
+                len(poses), attempts, name
+            )
+        )
+
+    return {
+        "joints": np.array(sampler.joints),
+        "poses": np.array(poses, dtype=np.float32).reshape(len(poses), -1),
+        "base_height": np.array(heights, dtype=np.float32),
+    }
+
+
+def main():
+    args = parse_args()
+    np.random.seed(args.seed)
+
+    models = robot_models()
+    if args.models is not None:
+        models = {m: models[m] for m in args.models}
+
+    env.clear_env()
+    os.makedirs(args.output, exist_ok=True)
+
+    for name, robot_info in models.items():
+        library = build_library(name, robot_info, args)
+        path = os.path.join(args.output, "{}.npz".format(name))
+        np.savez_compressed(path, **library)
+        print(
+            "[INFO] Saved {} poses of {} to '{}' (base height {:.3f} to {:.3f}m)".format(
+                len(library["poses"]),
+                name,
+                path,
+                float(library["base_height"].min()) if len(library["poses"]) else 0.0,
+                float(library["base_height"].max()) if len(library["poses"]) else 0.0,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
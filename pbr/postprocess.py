@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import zlib
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import cv2
+import numpy as np
+
+import imperfections
+
+# Applies the image imperfections of a run rendered with imperfections_mode = "postprocess"
+# Clean renders in <run>/raw_clean are written to <run>/raw with the imperfection parameters recorded in each
+# frame's meta, spread over a pool of processes. Runs that only wrote meta tables (see meta_writer.py) are read from
+# the table rows, and their variants are recorded in <run>/variants/variants.json
+# With --variants, each render also gets K variants in <run>/variants with their own imperfections, white balance
+# and sensor noise, which share the render's mask, depth and meta
+#   python3 pbr/postprocess.py outputs/run_1 --workers 8 --variants 4
+
+
+# Frame of a rendered image, stereo renders share the meta of their frame
+def frame_name(image_name):
+    stem = os.path.splitext(image_name)[0]
+    if stem.endswith("_L") or stem.endswith("_R"):
+        stem = stem[:-2]
+    return stem
+
+
+def load_image(path):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise NameError("Cannot load image {0}".format(path))
+    return img
+
+
+# Apply imperfections to an image loaded by OpenCV and write it with the same bit depth
+def write_image(path, img, params, rng):
+    dtype = img.dtype
+    scale = np.iinfo(dtype).max
+
+    # OpenCV loads BGR(A)
+    order = [2, 1, 0, 3][: img.shape[2]]
+    out = imperfections.apply(img[..., order].astype(np.float32) / scale, params, rng)
+
+    out = np.round(np.clip(out[..., order], 0.0, 1.0) * scale).astype(dtype)
+    cv2.imwrite(path, out)
+
+
+# Apply the imperfections of one image and make its variants
+# Returns whether the raw image was written and the file name and parameters of each variant
+def process(clean_path, output_path, params, variant_dir, num_variants):
+    img = load_image(clean_path)
+    name = os.path.basename(clean_path)
+    # Numbers read back from a meta table are floats
+    seed = 0 if params is None else int(params.get("noise_seed", 0))
+
+    # Every image (and stereo view) of a frame gets its own reproducible noise
+    written = False
+    if params is not None:
+        rng = np.random.default_rng([seed, zlib.crc32(name.encode())])
+        write_image(output_path, img, params, rng)
+        written = True
+
+    variants = []
+    root, ext = os.path.splitext(name)
+    for k in range(1, num_variants + 1):
+        variant_name = "{}_v{}{}".format(root, k, ext)
+        variant_params = imperfections.sample_parameters(
+            random.Random("{}:{}".format(seed, variant_name)), variant=True
+        )
+        rng = np.random.default_rng([seed, zlib.crc32(variant_name.encode())])
+        write_image(os.path.join(variant_dir, variant_name), img, variant_params, rng)
+        variants.append((variant_name, variant_params))
+
+    return written, variants
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply image imperfections to the clean renders of a run"
+    )
+    parser.add_argument("run_dir", help="output directory of the run")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes",
+    )
+    parser.add_argument(
+        "-k",
+        "--variants",
+        type=int,
+        default=0,
+        help="extra variants with their own imperfections to make of each render",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="process images which already have their outputs",
+    )
+    args = parser.parse_args()
+
+    # Point the output config at the run instead of claiming a new run directory
+    os.environ["NUPBR_OUTPUT_DIR"] = os.path.abspath(args.run_dir)
+    from config import output_config as out_cfg
+    import meta_writer
+
+    # The imperfections of each frame come from its meta file, or its row of the meta table
+    table = meta_writer.table_only(out_cfg.meta_dir)
+    if table:
+        rows = meta_writer.read(out_cfg.meta_dir, keys=["imperfections"])
+        metas = {
+            str(frame).zfill(out_cfg.filename_len): meta_writer.unflatten(row)
+            for frame, row in rows.items()
+        }
+
+    clean_dir = os.path.join(out_cfg.output_dir, out_cfg.clean_dirname)
+    if not os.path.isdir(clean_dir):
+        parser.error("no clean renders found in '{}'".format(clean_dir))
+
+    variant_dir = os.path.join(out_cfg.output_dir, out_cfg.variant_dirname)
+    if args.variants > 0:
+        os.makedirs(variant_dir, exist_ok=True)
+
+    tasks = []
+    frames = []
+    for name in sorted(os.listdir(clean_dir)):
+        output_path = os.path.join(out_cfg.image_dir, name)
+        frame = frame_name(name)
+        root, ext = os.path.splitext(name)
+
+        if table:
+            if frame not in metas:
+                print("[WARN] No meta table row for frame {}".format(frame))
+                continue
+            params = metas[frame].get("imperfections")
+        else:
+            with open(os.path.join(out_cfg.meta_dir, frame + ".yaml"), "r") as f:
+                params = json.load(f).get("imperfections")
+
+        # Frames without imperfection parameters only get variants
+        outputs = [output_path] if params is not None else []
+        outputs += [
+            os.path.join(variant_dir, "{}_v{}{}".format(root, k, ext))
+            for k in range(1, args.variants + 1)
+        ]
+        if not args.force and all(os.path.isfile(o) for o in outputs):
+            continue
+        tasks.append((os.path.join(clean_dir, name), output_path, params))
+        frames.append(frame)
+
+    written = 0
+    variants = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = (
+            pool.map(
+                process,
+                *zip(*tasks),
+                [variant_dir] * len(tasks),
+                [args.variants] * len(tasks),
+                chunksize=8,
+            )
+            if tasks
+            else []
+        )
+        for frame, (raw, made) in zip(frames, results):
+            written += raw
+            variants.setdefault(frame, []).extend(made)
+
+    # Record the variants in the meta of their frame, stereo views share the meta
+    # Meta tables are not rewritten, the variants of their frames are kept in a file of their own
+    table_variants_path = os.path.join(variant_dir, "variants.json")
+    table_variants = {}
+    if table and os.path.isfile(table_variants_path):
+        with open(table_variants_path, "r") as f:
+            table_variants = json.load(f)
+    for frame, made in variants.items():
+        if len(made) == 0:
+            continue
+        meta_path = os.path.join(out_cfg.meta_dir, frame + ".yaml")
+        if table:
+            meta = table_variants.setdefault(frame, {})
+        else:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        entries = {v["file"]: v for v in meta.get("variants", [])}
+        for variant_name, params in made:
+            file = os.path.join(out_cfg.variant_dirname, variant_name)
+            entries[file] = {"file": file, "imperfections": params}
+        meta["variants"] = [entries[k] for k in sorted(entries.keys())]
+        if not table:
+            with open(meta_path, "w") as f:
+                json.dump(meta, f, indent=4, sort_keys=True)
+    if len(table_variants) > 0:
+        with open(table_variants_path, "w") as f:
+            json.dump(table_variants, f, indent=4, sort_keys=True)
+
+    print(
+        "[INFO] Applied imperfections to {} of {} images in '{}'".format(
+            written, len(tasks), out_cfg.image_dir
+        )
+    )
+    if args.variants > 0:
+        print(
+            "[INFO] Made {} variants in '{}'".format(
+                sum(len(v) for v in variants.values()), variant_dir
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/local/bin/blender -P
+
+import os
+import sys
+import json
+import bpy
+import argparse
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import cv2
+import numpy as np
+
+from config import scene_config
+
+import util
+import hdr_cache
+
+# Builds the HDR cache used to render each frame with the smallest environment map with enough detail
+# Every raw HDR under resources["environment"]["path"] is halved into mip levels down to hdr_cache["min_width"],
+# which are written as half float EXRs, and the field pixels of its mask image are stored as a packed bitmap
+# (see hdr_cache.py). Environments whose cache is up to date are skipped, and only the field pixels are detected again
+# when scene_config.field_detection changed
+#   blender -b -P pbr/preprocess_hdr.py -- --min-width 2048
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="preprocess_hdr.py")
+    parser.add_argument(
+        "--min-width",
+        type=int,
+        default=scene_config.hdr_cache["min_width"],
+        help="width (pixels) of the smallest version to make",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild caches which are already up to date",
+    )
+    return parser.parse_args(argv)
+
+
+# Load an image as a float (height, width, 4) array in Blender's bottom to top row order
+def load_pixels(path):
+    try:
+        img = bpy.data.images.load(path)
+    except:
+        raise NameError("Cannot load image {0}".format(path))
+
+    width, height = img.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    img.pixels.foreach_get(pixels)
+    bpy.data.images.remove(img)
+    return pixels.reshape(height, width, 4)
+
+
+# Halve an image with a box filter, repeating the last row or column of odd sizes
+def halve(pixels):
+    if pixels.shape[0] % 2 == 1:
+        pixels = np.concatenate([pixels, pixels[-1:]], axis=0)
+    if pixels.shape[1] % 2 == 1:
+        pixels = np.concatenate([pixels, pixels[:, -1:]], axis=1)
+    return 0.25 * (
+        pixels[0::2, 0::2]
+        + pixels[1::2, 0::2]
+        + pixels[0::2, 1::2]
+        + pixels[1::2, 1::2]
+    )
+
+
+# Write a float (height, width, 4) array as a half float EXR
+def save_exr(pixels, path):
+    height, width = pixels.shape[:2]
+    img = bpy.data.images.new(
+        os.path.basename(path), width, height, alpha=False, float_buffer=True
+    )
+    img.pixels.foreach_set(np.ascontiguousarray(pixels, dtype=np.float32).ravel())
+
+    settings = bpy.context.scene.render.image_settings
+    settings.file_format = "OPEN_EXR"
+    settings.color_mode = "RGB"
+    settings.color_depth = "16"
+    settings.exr_codec = "ZIP"
+    img.save_render(path, scene=bpy.context.scene)
+    bpy.data.images.remove(img)
+
+
+def build_cache(hdr, args):
+    out_dir = hdr_cache.cache_dir(hdr["raw_path"])
+    index_path = os.path.join(out_dir, "index.json")
+    source = hdr_cache.source_info(hdr["raw_path"])
+
+    index = None
+    if not args.force and os.path.isfile(index_path):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        if index["source"] != source:
+            index = None
+        elif index.get("field_detection") == scene_config.field_detection:
+            return False
+
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(hdr["raw_path"]))[0]
+
+    # Mip levels, largest first, unless only the field pixels are out of date
+    if index is None:
+        pixels = load_pixels(hdr["raw_path"])
+        index = {
+            "source": source,
+            "width": pixels.shape[1],
+            "height": pixels.shape[0],
+            "variants": [],
+        }
+
+        while pixels.shape[1] // 2 >= args.min_width:
+            pixels = halve(pixels)
+            file = "{}_{}.exr".format(stem, pixels.shape[1])
+            save_exr(pixels, os.path.join(out_dir, file))
+            index["variants"].append(
+                {"file": file, "width": pixels.shape[1], "height": pixels.shape[0]}
+            )
+
+    # Field pixels of the environment's mask
+    index["field_mask"] = None
+    index["field_detection"] = scene_config.field_detection
+    if hdr["mask_path"] is not None:
+        img = cv2.imread(hdr["mask_path"])
+        if img is None:
+            raise NameError("Cannot load image {0}".format(hdr["mask_path"]))
+        file = "{}_field.npz".format(stem)
+        hdr_cache.save_field_bitmap(os.path.join(out_dir, file), util.field_pixels(img))
+        index["field_mask"] = file
+
+    # Written last so an interrupted run is rebuilt
+    with open(index_path, "w") as f:
+        json.dump(index, f, indent=4, sort_keys=True)
+    return True
+
+
+def main():
+    args = parse_args()
+
+    hdrs = util.populate_environments()
+
+    built = 0
+    for hdr in hdrs:
+        if build_cache(hdr, args):
+            built += 1
+            print("[INFO] Cached '{}'".format(hdr["raw_path"]))
+
+    print(
+        "[INFO] Built {} of {} HDR caches in '{}'".format(
+            built, len(hdrs), scene_config.hdr_cache["path"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
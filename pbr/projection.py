@@ -0,0 +1,171 @@
+import math
+
+import numpy as np
+
+# Projection between the cameras, the world and the equirectangular environment maps in NumPy
+# Follows Cycles' camera models and the World_HDR nodes (Generated coordinates -> Mapping -> Environment Texture, see
+# environment.setup_hdri_env) so an environment map can be reprojected into a camera, or objects located in the
+# image, without rendering
+# Camera space is Blender's: x right, y up, looking down -z
+
+# Camera rays are the same for every frame with the same camera, so they are computed once
+_ray_cache = {}
+
+
+# Unit direction of the ray through the centre of each pixel in camera space
+# Returns an (height, width, 3) array of directions and an (height, width) mask of pixels the camera can see
+#   cam_config: the camera configuration of the frame ({"type", "fov", "focal_length"})
+#   sensor_width: sensor width (mm) used for the larger image dimension (sensor fit AUTO)
+def camera_rays(cam_config, sensor_width, width, height):
+    key = (
+        cam_config["type"],
+        cam_config["fov"],
+        cam_config.get("focal_length"),
+        sensor_width,
+        width,
+        height,
+    )
+    if key in _ray_cache:
+        return _ray_cache[key]
+
+    # Position of each pixel centre on a [-0.5, 0.5] sensor, y up
+    aspect = height / width
+    x = (np.arange(width, dtype=np.float64) + 0.5) / width - 0.5
+    y = 0.5 - (np.arange(height, dtype=np.float64) + 0.5) / height
+    x, y = np.meshgrid(x, y)
+    if aspect > 1:
+        x, y = x / aspect, y
+    else:
+        y = y * aspect
+
+    if cam_config["type"] == "RECTILINEAR":
+        # The field of view covers the larger dimension
+        scale = 2.0 * math.tan(cam_config["fov"] / 2.0)
+        rays = np.stack([x * scale, y * scale, -np.ones_like(x)], axis=-1)
+        rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
+        valid = np.ones(x.shape, dtype=bool)
+
+    elif cam_config["type"] == "EQUISOLID":
+        # Distance from the image centre on the sensor (mm)
+        u = x * sensor_width
+        v = y * sensor_width
+        r = np.hypot(u, v)
+
+        # Equisolid angle: r = 2 f sin(theta / 2)
+        s = r / (2.0 * cam_config["focal_length"])
+        valid = s <= 1.0
+        theta = 2.0 * np.arcsin(np.clip(s, 0.0, 1.0))
+        valid &= theta <= cam_config["fov"] / 2.0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sin_theta = np.where(r > 0, np.sin(theta) / r, 0.0)
+        rays = np.stack([u * sin_theta, v * sin_theta, -np.cos(theta)], axis=-1)
+
+    else:
+        raise ValueError("Unknown camera type {}".format(cam_config["type"]))
+
+    _ray_cache[key] = (rays, valid)
+    return rays, valid
+
+
+# Rotation matrix of an environment's Mapping node from the environment info (degrees)
+def environment_rotation(env_info):
+    alpha = math.radians(env_info["rotation"]["roll"])
+    beta = math.radians(env_info["rotation"]["pitch"])
+    gamma = math.radians(env_info["rotation"]["yaw"])
+
+    sa, ca = math.sin(alpha), math.cos(alpha)
+    sb, cb = math.sin(beta), math.cos(beta)
+    sg, cg = math.sin(gamma), math.cos(gamma)
+
+    rot_x = np.array([[1, 0, 0], [0, ca, -sa], [0, sa, ca]])  # yapf: disable
+    rot_y = np.array([[cb, 0, sb], [0, 1, 0], [-sb, 0, cb]])  # yapf: disable
+    rot_z = np.array([[cg, -sg, 0], [sg, cg, 0], [0, 0, 1]])  # yapf: disable
+
+    # Blender's XYZ euler rotation
+    return rot_z @ rot_y @ rot_x
+
+
+# Environment map lookup direction of camera rays
+#   matrix: the camera's 4x4 world matrix
+def environment_directions(rays, matrix, env_info):
+    rotation = np.asarray(matrix, dtype=np.float64)[:3, :3]
+    # Remove any scale of the camera object
+    rotation = rotation / np.linalg.norm(rotation, axis=0, keepdims=True)
+
+    # The Mapping node rotates and then translates the view direction
+    directions = rays @ (environment_rotation(env_info) @ rotation).T
+    if "location" in env_info:
+        directions = directions + np.array(
+            [
+                env_info["location"]["x"],
+                env_info["location"]["y"],
+                env_info["location"]["z"],
+            ]
+        )
+    return directions
+
+
+# Pixel coordinates (row, column) of directions in an equirectangular image of the given shape
+def equirectangular_coords(directions, shape):
+    x = directions[..., 0]
+    y = directions[..., 1]
+    z = directions[..., 2]
+
+    u = -np.arctan2(y, x) / (2.0 * math.pi) + 0.5
+    v = np.arctan2(z, np.hypot(x, y)) / math.pi + 0.5
+
+    # Nearest pixel, rows go from the top of the image down
+    col = np.clip(np.floor(u * shape[1]).astype(np.int64), 0, shape[1] - 1)
+    row = np.clip(np.floor((1.0 - v) * shape[0]).astype(np.int64), 0, shape[0] - 1)
+    return row, col
+
+
+# Reproject an equirectangular environment image into a camera
+# Returns the (height, width, channels) image seen by the camera and the mask of pixels the camera can see
+# Nearest neighbour sampling is used so mask colours are never blended
+def reproject(env_img, cam_config, sensor_width, matrix, env_info, width, height):
+    rays, valid = camera_rays(cam_config, sensor_width, width, height)
+    row, col = equirectangular_coords(
+        environment_directions(rays, matrix, env_info), env_img.shape
+    )
+    return env_img[row, col], valid
+
+
+# Project world points into a camera's image
+# Returns (n, 2) continuous (column, row) pixel coordinates, with (0, 0) the top left corner of the image, and a mask
+# of the points in front of the camera that its model can see (which may still be outside the image)
+#   matrix: the camera's 4x4 world matrix
+def project_points(points, cam_config, sensor_width, matrix, width, height):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    rotation = matrix[:3, :3] / np.linalg.norm(matrix[:3, :3], axis=0, keepdims=True)
+
+    # Camera space, the camera looks down -z
+    p = (np.asarray(points, dtype=np.float64).reshape(-1, 3) - matrix[:3, 3]) @ rotation
+    size = max(width, height)
+
+    if cam_config["type"] == "RECTILINEAR":
+        valid = p[:, 2] < 0
+        depth = np.where(valid, -p[:, 2], 1.0)
+        scale = 2.0 * math.tan(cam_config["fov"] / 2.0)
+        x = p[:, 0] / depth / scale
+        y = p[:, 1] / depth / scale
+
+    elif cam_config["type"] == "EQUISOLID":
+        norm = np.linalg.norm(p, axis=-1)
+        d = p / np.where(norm > 0, norm, 1.0)[:, None]
+        theta = np.arccos(np.clip(-d[:, 2], -1.0, 1.0))
+        valid = (norm > 0) & (theta <= cam_config["fov"] / 2.0)
+
+        # Equisolid angle: r = 2 f sin(theta / 2), as a fraction of the sensor width
+        r = 2.0 * cam_config["focal_length"] * np.sin(theta / 2.0) / sensor_width
+        planar = np.hypot(d[:, 0], d[:, 1])
+        planar = np.where(planar > 0, planar, 1.0)
+        x = r * d[:, 0] / planar
+        y = r * d[:, 1] / planar
+
+    else:
+        raise ValueError("Unknown camera type {}".format(cam_config["type"]))
+
+    pixels = np.stack([width / 2.0 + x * size, height / 2.0 - y * size], axis=-1)
+    return pixels, valid
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import subprocess
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import render_profile
+
+from farm.job_queue import JobQueue, queue_path
+from farm.scheduler import Scheduler
+
+
+# Calibrate the render profile for each distinct CPU share the workers will be pinned to
+def calibrate(blender, output_dir, num_workers):
+    script = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "calibrate_render.py"
+    )
+    env = dict(os.environ, NUPBR_OUTPUT_DIR=output_dir)
+
+    # Without CPU affinity the workers are not pinned, and every one of them renders with all the CPUs
+    pin = hasattr(os, "sched_setaffinity")
+    calibrated = set()
+    for cpus in render_profile.partition_cpus(num_workers if pin else 1):
+        if len(cpus) in calibrated:
+            continue
+        calibrated.add(len(cpus))
+        print("[INFO] Calibrating render profile for {} CPUs".format(len(cpus)))
+        subprocess.run(
+            [blender, "-b", "-P", script],
+            env=env,
+            check=True,
+            preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if pin else None,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render a dataset with a pool of local Blender workers"
+    )
+    parser.add_argument(
+        "-n", "--num-images", type=int, help="total number of frames to render"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=max(1, os.cpu_count() // 8),
+        help="number of concurrent Blender processes",
+    )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=50, help="frames per queued batch"
+    )
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="base random seed, makes every frame reproducible regardless of which worker renders it",
+    )
+    parser.add_argument(
+        "--resume", metavar="RUN_DIR", help="continue the queue of an existing run"
+    )
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=600,
+        help="seconds without a finished frame before a worker is considered hung",
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=600,
+        help="seconds a warm worker may take to construct its scene before it is considered hung",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="attempts per batch before giving up",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="keep one resident Blender worker per slot instead of starting one per batch",
+    )
+    parser.add_argument(
+        "--calibrate",
+        action="store_true",
+        help="find the fastest thread and tile settings for the workers before rendering",
+    )
+    parser.add_argument(
+        "--no-pin",
+        action="store_true",
+        help="do not pin each worker to its own share of the CPUs",
+    )
+    args, worker_args = parser.parse_known_args()
+
+    if args.resume is not None:
+        output_dir = os.path.abspath(args.resume)
+        if not os.path.isfile(queue_path(output_dir)):
+            parser.error("no job queue found in '{}'".format(output_dir))
+    else:
+        if args.num_images is None:
+            parser.error("--num-images is required when starting a new run")
+        # Importing the output config claims a fresh run directory
+        from config import output_config as out_cfg
+
+        output_dir = out_cfg.output_dir
+
+    queue = JobQueue(queue_path(output_dir))
+
+    # The seed is part of the job, so a resumed run keeps rendering the same frames
+    if args.resume is not None:
+        seed = queue.get_setting("seed")
+        seed = None if seed is None else int(seed)
+    else:
+        queue.create(args.num_images, args.batch_size)
+        seed = args.seed
+        if seed is not None:
+            queue.set_setting("seed", seed)
+
+    print("[INFO] Rendering into '{}'".format(output_dir))
+
+    if args.calibrate:
+        calibrate(args.blender, output_dir, 1 if args.no_pin else args.workers)
+
+    scheduler = Scheduler(
+        queue,
+        output_dir,
+        args.workers,
+        blender=args.blender,
+        seed=seed,
+        heartbeat_timeout=args.heartbeat_timeout,
+        startup_timeout=args.startup_timeout,
+        max_attempts=args.max_attempts,
+        worker_args=worker_args,
+        warm=args.warm,
+        pin=not args.no_pin,
+    )
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        print("[INFO] Interrupted, resume with --resume {}".format(output_dir))
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
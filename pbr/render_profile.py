@@ -0,0 +1,154 @@
+import os
+import re
+import glob
+import json
+import socket
+
+# Render thread and tile settings suited to the CPUs this process may run on
+# Profiles found by calibrate_render.py are stored per host, otherwise a heuristic is used
+
+# Tile sizes tried for CPU rendering, CPUs prefer small tiles so every thread stays busy
+cpu_tile_sizes = [16, 32, 64, 128]
+
+
+# Parse a kernel cpu list such as "0-3,8,10-11"
+def parse_cpu_list(text):
+    cpus = set()
+    for part in text.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+# CPUs this process is allowed to run on
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(0))
+    return set(range(os.cpu_count()))
+
+
+# Available CPUs grouped by NUMA node
+def numa_nodes():
+    cpus = available_cpus()
+    nodes = []
+    for path in sorted(
+        glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"),
+        key=lambda p: int(re.search(r"node(\d+)", p).group(1)),
+    ):
+        with open(path, "r") as f:
+            node = parse_cpu_list(f.read()) & cpus
+        if len(node) > 0:
+            nodes.append(node)
+
+    return nodes if len(nodes) > 0 else [cpus]
+
+
+# Number of physical cores among the available CPUs (hyperthread siblings count once)
+def physical_cores():
+    cpus = available_cpus()
+    cores = set()
+    for cpu in cpus:
+        path = "/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list".format(cpu)
+        try:
+            with open(path, "r") as f:
+                cores.add(min(parse_cpu_list(f.read())))
+        except (OSError, ValueError):
+            cores.add(cpu)
+    return len(cores)
+
+
+# Split the available CPUs between worker processes without splitting NUMA nodes where possible
+# Returns one set of CPUs per worker
+def partition_cpus(num_workers):
+    nodes = numa_nodes()
+
+    # Fewer workers than nodes, give each worker whole nodes
+    if num_workers <= len(nodes):
+        partitions = [set() for ii in range(num_workers)]
+        for ii, node in enumerate(nodes):
+            partitions[ii % num_workers] |= node
+        return partitions
+
+    # Give each node a share of the workers proportional to its size
+    total = sum(len(n) for n in nodes)
+    shares = [max(1, round(num_workers * len(n) / total)) for n in nodes]
+    while sum(shares) > num_workers:
+        shares[shares.index(max(shares))] -= 1
+    while sum(shares) < num_workers:
+        shares[shares.index(min(shares))] += 1
+
+    partitions = []
+    for node, share in zip(nodes, shares):
+        node = sorted(node)
+        for ii in range(share):
+            part = set(node[ii * len(node) // share : (ii + 1) * len(node) // share])
+            # More workers than CPUs on this node, let them share the node
+            partitions.append(part if len(part) > 0 else set(node))
+
+    return partitions
+
+
+# Candidate (threads, tile size) combinations for a calibration run
+def candidates():
+    threads = sorted({len(available_cpus()), physical_cores()}, reverse=True)
+    return [(t, tile) for t in threads for tile in cpu_tile_sizes]
+
+
+# Pick a tile size giving enough tiles to keep every thread busy until the end of the frame
+def heuristic_tile(resolution, threads):
+    best = cpu_tile_sizes[0]
+    for tile in cpu_tile_sizes:
+        num_tiles = -(-resolution[0] // tile) * -(-resolution[1] // tile)
+        if num_tiles >= 16 * threads:
+            best = tile
+    return best
+
+
+def profile_path():
+    cache = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(
+        cache, "nupbr", "render_profile_{}.json".format(socket.gethostname())
+    )
+
+
+# Profiles depend on the device, output size and the CPUs the process was given
+def profile_key(device, resolution):
+    return "{}_{}x{}_{}cpus".format(
+        device, resolution[0], resolution[1], len(available_cpus())
+    )
+
+
+def load_profiles():
+    try:
+        with open(profile_path(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_profile(device, resolution, profile):
+    profiles = load_profiles()
+    profiles[profile_key(device, resolution)] = profile
+
+    os.makedirs(os.path.dirname(profile_path()), exist_ok=True)
+    with open(profile_path(), "w") as f:
+        json.dump(profiles, f, indent=4, sort_keys=True)
+
+
+# Thread count and tile size for rendering on this host
+# Returns {"threads": n, "tile": [x, y], "source": "calibrated" | "heuristic"}
+def choose(device, resolution):
+    profile = load_profiles().get(profile_key(device, resolution))
+    if profile is not None:
+        return {**profile, "source": "calibrated"}
+
+    threads = len(available_cpus())
+    tile = heuristic_tile(resolution, threads)
+    return {"threads": threads, "tile": [tile, tile], "source": "heuristic"}
@@ -2,7 +2,6 @@
 
 import os
 import bpy
-import random
 
 from math import radians
 
@@ -10,6 +9,9 @@ from config import blend_config as blend_cfg
 from config import output_config as out_cfg
 from config import scene_config
 
+import render_profile
+
+
 # Clear environment of all objects
 def clear_env():
     for obj in bpy.data.objects:
@@ -37,17 +39,7 @@ def setup_render():
     context.scene.render.use_file_extension = False
 
     # Enable rendering devices
-    cycles = context.preferences.addons["cycles"]
-    cycles.preferences.compute_device_type = "CUDA"
-    scene.cycles.device = rend_cfg["render"]["cycles_device"]
-    
-    for d in cycles.preferences.devices:
-        d["use"] = 1
-
-    # Set denoising settings
-    context.scene.view_layers[0].cycles.use_denoising = blend_cfg.layers["denoising"][
-        "use_denoising"
-    ]
+    device = setup_devices(rend_cfg["render"])
 
     # Set dimensions settings
     [scene.render.resolution_x, scene.render.resolution_y] = rend_cfg["dimensions"][
@@ -55,8 +47,11 @@ def setup_render():
     ]
     scene.render.resolution_percentage = rend_cfg["dimensions"]["percentage"]
 
-    # Set sampling settings
-    scene.cycles.samples = rend_cfg["sampling"]["cycles_samples"]
+    # Set sampling and denoising settings
+    if rend_cfg["draft"]:
+        apply_quality(blend_cfg.draft["quality"])
+    else:
+        apply_quality(rend_cfg["quality"])
     scene.cycles.preview_samples = rend_cfg["sampling"]["cycles_preview_samples"]
 
     # Set light paths settings
@@ -79,17 +74,33 @@ def setup_render():
     scene.use_nodes = True
 
     # Set performance Settings
-    [context.scene.render.tile_x, context.scene.render.tile_y] = rend_cfg[
-        "performance"
-    ]["render_tile"]
+    tile = rend_cfg["performance"]["render_tile"]
+    threads = rend_cfg["performance"]["threads"]
+    if rend_cfg["performance"]["use_render_profile"]:
+        resolution = [
+            int(r * rend_cfg["dimensions"]["percentage"] / 100)
+            for r in rend_cfg["dimensions"]["resolution"]
+        ]
+        profile = render_profile.choose(device, resolution)
+        threads = {"mode": "FIXED", "num_threads": profile["threads"]}
+        # GPUs render best with the large tiles from the config
+        if device == "CPU":
+            tile = profile["tile"]
+        print(
+            "[INFO] Rendering on {} with {} threads and {}x{} tiles ({} profile)".format(
+                device, threads["num_threads"], tile[0], tile[1], profile["source"]
+            )
+        )
+
+    [context.scene.render.tile_x, context.scene.render.tile_y] = tile
 
     # Disable splash screen
     context.preferences.view.show_splash = False
 
     # Limit blender thread usage
-    if rend_cfg["performance"]["threads"]["mode"] == "FIXED":
+    if threads["mode"] == "FIXED":
         scene.render.threads_mode = "FIXED"
-        scene.render.threads = rend_cfg["performance"]["threads"]["num_threads"]
+        scene.render.threads = threads["num_threads"]
     else:
         scene.render.threads_mode = "AUTO"
 
@@ -101,6 +112,65 @@ def setup_render():
         bpy.context.scene.render.use_multiview = False
 
 
+# Select the Cycles device, returns the device that will be used ("GPU" or "CPU")
+def setup_devices(device_cfg):
+    scene = bpy.data.scenes["Scene"]
+    prefs = bpy.context.preferences.addons["cycles"].preferences
+
+    device = device_cfg["cycles_device"]
+    if device == "CPU":
+        prefs.compute_device_type = "NONE"
+    else:
+        prefs.compute_device_type = device_cfg["compute_device_type"]
+        # Refresh the device list for the selected compute device type
+        prefs.get_devices()
+        if not any(d.type != "CPU" for d in prefs.devices):
+            if device == "GPU":
+                print(
+                    "[WARN] No {} devices found, rendering on the CPU".format(
+                        device_cfg["compute_device_type"]
+                    )
+                )
+            device = "CPU"
+            prefs.compute_device_type = "NONE"
+        else:
+            device = "GPU"
+
+    scene.cycles.device = device
+
+    for d in prefs.devices:
+        d["use"] = 1
+
+    return device
+
+
+# Apply a named sampling and denoising profile from blend_config.quality_profiles
+def apply_quality(name):
+    try:
+        profile = {
+            **blend_cfg.render["sampling"],
+            **blend_cfg.layers["denoising"],
+            **blend_cfg.quality_profiles[name],
+        }
+    except KeyError:
+        raise NameError("Unknown quality profile {0}".format(name))
+
+    scene = bpy.data.scenes["Scene"]
+
+    scene.cycles.samples = profile["cycles_samples"]
+    scene.cycles.use_adaptive_sampling = profile["adaptive_sampling"]
+    scene.cycles.adaptive_threshold = profile["adaptive_threshold"]
+    scene.cycles.adaptive_min_samples = profile["adaptive_min_samples"]
+
+    # Only the raw image is denoised, the segmentation layers must keep their exact colours
+    scene.cycles.use_denoising = profile["use_denoising"]
+    scene.cycles.denoiser = profile["denoiser"]
+    for layer in scene.view_layers:
+        layer.cycles.use_denoising = (
+            profile["use_denoising"] and layer.name == "View Layer"
+        )
+
+
 # Setup background HDRI environment
 def setup_hdri_env(img_path, env_info):
     # Get world
@@ -146,7 +216,8 @@ def setup_hdri_env(img_path, env_info):
     return world
 
 
-def update_hdri_env(world, img_path, env_info):
+# Mask backgrounds are loaded as data so their values reach the Raw view transform of the mask render unchanged
+def update_hdri_env(world, img_path, env_info, is_data=False):
     node_list = bpy.data.worlds["World_HDR"].node_tree.nodes
 
     n_env_tex = node_list["Environment Texture"]
@@ -155,7 +226,7 @@ def update_hdri_env(world, img_path, env_info):
 
     tl = bpy.data.worlds["World_HDR"].node_tree.links
 
-    n_map.inputs['Rotation'].default_value = (
+    n_map.inputs["Rotation"].default_value = (
         radians(env_info["rotation"]["roll"]),
         radians(env_info["rotation"]["pitch"]),
         radians(env_info["rotation"]["yaw"]),
@@ -163,7 +234,7 @@ def update_hdri_env(world, img_path, env_info):
 
     # Raise the HDR to make it appear bigger for some HDRs
     if "location" in env_info:
-        n_map.inputs['Location'].default_value = (
+        n_map.inputs["Location"].default_value = (
             env_info["location"]["x"],
             env_info["location"]["y"],
             env_info["location"]["z"],
@@ -181,9 +252,11 @@ def update_hdri_env(world, img_path, env_info):
             tl.new(n_map.outputs["Vector"], n_env_tex.inputs["Vector"])
             tl.new(n_env_tex.outputs[0], n_bg.inputs[0])
         try:
-            img = bpy.data.images.load(img_path)
+            # Reuse the image if it is still loaded from an earlier frame
+            img = bpy.data.images.load(img_path, check_existing=True)
         except:
             raise NameError("Cannot load image {0}".format(img_path))
+        img.colorspace_settings.is_data = is_data
         n_env_tex.image = img
     elif link is not None:
         tl.remove(link)
@@ -203,6 +276,10 @@ def setup_image_seg_mat(total_classes):
     # Create our nodes
     # Create node to get object index
     n_obj_info = node_list.new("ShaderNodeObjectInfo")
+    # Create modulo node (the pass index of an object is unique to its instance, see scene_config.instance_index)
+    n_mod = node_list.new("ShaderNodeMath")
+    n_mod.operation = "MODULO"
+    n_mod.inputs[1].default_value = len(scene_config.resources)
     # Create division node
     n_div = node_list.new("ShaderNodeMath")
     n_div.operation = "DIVIDE"
@@ -229,8 +306,10 @@ def setup_image_seg_mat(total_classes):
 
     # Link our shaders
     tl = seg_mat.node_tree.links
-    # Link object index to divide node
-    tl.new(n_obj_info.outputs[2], n_div.inputs[0])
+    # Link object index to modulo node
+    tl.new(n_obj_info.outputs[2], n_mod.inputs[0])
+    # Link modulo to divide node
+    tl.new(n_mod.outputs[0], n_div.inputs[0])
     # Link divide to colour ramp factor
     tl.new(n_div.outputs[0], n_col_ramp.inputs[0])
     # Link colour ramp output to emission
@@ -316,8 +395,11 @@ def setup_scene_composite(l_image_raw, l_image_seg, l_field_seg):
     n_image_rl = node_list.new("CompositorNodeRLayers")
     n_image_rl.layer = l_image_raw.name
 
-    # If the raw image requires imperfections
-    if out_cfg.output_imperfections:
+    # If the raw image requires imperfections (otherwise postprocess.py applies them)
+    compositor_imperfections = (
+        out_cfg.output_imperfections and out_cfg.imperfections_mode == "compositor"
+    )
+    if compositor_imperfections:
 
         # Add blur
         n_img_blur = node_list.new("CompositorNodeBlur")
@@ -327,17 +409,16 @@ def setup_scene_composite(l_image_raw, l_image_seg, l_field_seg):
 
         # Add noise texture
         n_img_texture = node_list.new("CompositorNodeTexture")
-        img_noise_texture = bpy.data.textures.new("RawImgNoise", 'NOISE')
+        img_noise_texture = bpy.data.textures.new("RawImgNoise", "NOISE")
         n_img_texture.texture = img_noise_texture
 
         # Apply noise to image
         n_img_multiply = node_list.new("CompositorNodeMixRGB")
-        n_img_multiply.blend_type = 'MULTIPLY'
+        n_img_multiply.blend_type = "MULTIPLY"
 
         # Adjust image exposure
         n_img_exposure = node_list.new("CompositorNodeExposure")
 
-
     n_depth_out = None
     if out_cfg.output_depth:
         # File Output node for mist
@@ -350,6 +431,21 @@ def setup_scene_composite(l_image_raw, l_image_seg, l_field_seg):
         n_depth_out.width = blend_cfg.render["dimensions"]["resolution"][0]
         n_depth_out.height = blend_cfg.render["dimensions"]["resolution"][1]
 
+    n_instance_out = None
+    if out_cfg.output_instances:
+        # File Output node for the object index of the image segment
+        n_instance_out = node_list.new("CompositorNodeOutputFile")
+        n_instance_out.name = "Instance_Out"
+        n_instance_out.base_path = out_cfg.instance_dir
+        n_instance_out.format.file_format = "PNG"
+        n_instance_out.format.color_mode = "BW"
+        n_instance_out.format.color_depth = "16"
+        n_instance_out.format.compression = 100
+        # Scale the object index so the 16-bit image holds the index itself
+        n_instance_scale = node_list.new("CompositorNodeMath")
+        n_instance_scale.operation = "DIVIDE"
+        n_instance_scale.inputs[1].default_value = 65535
+
     # Render layer for image segment
     n_img_seg_rl = node_list.new("CompositorNodeRLayers")
     n_img_seg_rl.layer = l_image_seg.name
@@ -379,7 +475,7 @@ def setup_scene_composite(l_image_raw, l_image_seg, l_field_seg):
     # Link shaders
     tl = bpy.context.scene.node_tree.links
 
-    if out_cfg.output_imperfections:
+    if compositor_imperfections:
         # Link original raw output image to blur
         tl.new(n_image_rl.outputs[0], n_img_blur.inputs[0])
         # Link blur to RGB curve
@@ -396,10 +492,13 @@ def setup_scene_composite(l_image_raw, l_image_seg, l_field_seg):
         # Link raw image render layer to switch
         tl.new(n_image_rl.outputs[0], n_switch.inputs[0])
 
-
     if out_cfg.output_depth:
         # Link depth from raw image to depth file output
         tl.new(n_image_rl.outputs["Depth"], n_depth_out.inputs[0])
+    if out_cfg.output_instances:
+        # Link object index from image segment to instance file output
+        tl.new(n_img_seg_rl.outputs["IndexOB"], n_instance_scale.inputs[0])
+        tl.new(n_instance_scale.outputs[0], n_instance_out.inputs[0])
     # Link image segment render layer
     tl.new(n_img_seg_rl.outputs[0], n_alpha.inputs[1])
     # Link field segment render layer
@@ -415,7 +514,7 @@ def setup_scene_composite(l_image_raw, l_image_seg, l_field_seg):
     tl.new(n_switch.outputs[0], n_comp.inputs[0])
 
     # Return switch node to toggle composite output
-    return n_switch, n_alpha, n_depth_out
+    return n_switch, n_alpha, n_depth_out, n_instance_out
 
 
 def setup_render_layers(num_objects):
@@ -431,6 +530,8 @@ def setup_render_layers(num_objects):
     l_image_seg = render_layers.new("Image_Seg")
     l_image_seg.use_strand = blend_cfg.render["layers"]["use_hair"]
     l_image_seg.samples = 1
+    l_image_seg.cycles.use_denoising = False
+    l_image_seg.use_pass_object_index = out_cfg.output_instances
     image_seg_mat = setup_image_seg_mat(num_objects)
     l_image_seg.material_override = image_seg_mat
 
@@ -439,43 +540,42 @@ def setup_render_layers(num_objects):
     l_field_seg.use_strand = blend_cfg.render["layers"]["use_hair"]
     l_field_seg.use_sky = False
     l_field_seg.samples = 1
+    l_field_seg.cycles.use_denoising = False
     field_seg_mat = setup_field_seg_mat(num_objects - 1, num_objects)
     l_field_seg.material_override = field_seg_mat
 
     # Setup scene render layer composite and return switch to control raw image or mask
     return setup_scene_composite(render_layers["View Layer"], l_image_seg, l_field_seg)
 
-def randomise_imperfections(n_img_blur, n_img_RGB, n_img_multiply, n_img_exposure):
-    imp_config = blend_cfg.render["imperfections"]
 
-    # Randomise blur value
-    blur_val = random.randint(imp_config["min_blur"], imp_config["max_blur"])
-    n_img_blur.size_x = blur_val
-    n_img_blur.size_y = blur_val
+# Set the compositor imperfection nodes from imperfection parameters (see imperfections.sample_parameters)
+def set_imperfections(n_img_blur, n_img_RGB, n_img_multiply, n_img_exposure, params):
+    # Set blur value
+    n_img_blur.size_x = params["blur"]
+    n_img_blur.size_y = params["blur"]
 
-    # Randomise red levels in image
-    img_RGB_curve = n_img_RGB.mapping.curves[0] #Selects the Red channel of the RGB curve
+    # Set red levels in image
+    img_RGB_curve = n_img_RGB.mapping.curves[
+        0
+    ]  # Selects the Red channel of the RGB curve
 
-    curve_x = round(random.uniform(0.5, imp_config["max_red"][0]), 2)
-    curve_y = round(random.uniform(0.5, imp_config["max_red"][1]), 2)
+    curve_x, curve_y = params["red_curve"]
 
     RGB_curve_points = img_RGB_curve.points
 
-    #Remove newly added point (node originally contains 2 points)
+    # Remove newly added point (node originally contains 2 points)
     while len(RGB_curve_points) > 2:
         RGB_curve_points.remove(RGB_curve_points[1])
 
     # Reset locations of original 2 points
-    RGB_curve_points[0].location = (0,0)
-    RGB_curve_points[1].location = (1,1)
+    RGB_curve_points[0].location = (0, 0)
+    RGB_curve_points[1].location = (1, 1)
 
     img_RGB_curve.points.update()
     img_RGB_curve.points.new(curve_x, curve_y)
 
-    # Randomise noise level
-    n_img_multiply.inputs[0].default_value = round(random.uniform(imp_config["min_noise_fac"], imp_config["max_noise_fac"]), 2)
-
-    # Randomise image exposure
-    n_img_exposure.inputs[1].default_value = round(random.uniform(imp_config["min_exposure"], imp_config["max_exposure"]), 2)
-
+    # Set noise level
+    n_img_multiply.inputs[0].default_value = params["noise"]
 
+    # Set image exposure
+    n_img_exposure.inputs[1].default_value = params["exposure"]
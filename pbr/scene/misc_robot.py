@@ -1,16 +1,14 @@
 #!/usr/local/blender -P
 
-import os
 import bpy
-import json
-import re
 from math import radians
-from random import triangular, randint
+from random import randint
 
 from config import blend_config as blend_cfg
 from config import scene_config as scene_cfg
 
 from scene.blender_object import BlenderObject
+from scene import robot_model
 
 
 class MiscRobot(BlenderObject):
@@ -18,6 +16,7 @@ class MiscRobot(BlenderObject):
         self.mat = {}
         self.sc_plane = None
         self.robot = None
+        self.model = None
         self.robot_parts = None
         self.pass_index = class_index
         self.objs = {}
@@ -29,45 +28,34 @@ class MiscRobot(BlenderObject):
 
     # Setup robot object
     def construct(self, robot_info):
-        robot_mesh = None
-        robot_obj = {}
-
         self.robot = robot_info
 
-        mesh_path = self.robot["mesh_path"]
-
         self.height = self.robot["height"]
 
-        with open(self.robot["kinematics_path"], "r") as file:
-            self.robot_parts = json.loads(file.read())
-
-        bpy.ops.import_scene.fbx(
-            filepath=self.robot["mesh_path"], axis_forward="X", axis_up="Z"
-        )
+        # Import the robot model once and create this robot as a linked duplicate of it
+        model = robot_model.load(self.robot)
+        self.model = model["name"]
+        self.robot_parts = model["parts"]
+        objs = robot_model.instantiate(model, self.name, self.pass_index)
 
         # Pure black is too dark
         if (self.colour == 0):
             self.colour = 0.1
 
-        for p in self.robot_parts.keys():
-            obj = bpy.data.objects[p]
-
-            obj.data.materials.clear()
-
+        for p, obj in objs.items():
             if obj.parent == None:
                 self.obj = obj
 
-            obj.name = "{}_{}".format(self.name, p)
             self.objs.update({obj.name: obj})
 
-            obj.pass_index = self.pass_index
+            # Set material for robot, shared by every robot of the model
+            mat_name = "{}_tex".format(model["name"])
+            if mat_name not in model["materials"]:
+                model["materials"][mat_name] = self.set_material(obj, mat_name)
+            robot_model.set_material(obj, model["materials"][mat_name])
+            self.mat.update({obj.name: model["materials"][mat_name]})
 
-            # Configure robot to have correct pass index
-            obj.pass_index = self.pass_index
-
-            # Set material for robot
-            self.mat.update({obj.name: self.set_material(obj, self.name + "_tex")})
-            obj.data.materials.append(self.mat[obj.name])
+        robot_model.set_colour(self.objs.values(), self.colour)
 
         self.initialise_kinematics()
 
@@ -98,18 +86,15 @@ class MiscRobot(BlenderObject):
             "base_col"
         ]
 
-        n_principled.inputs["Base Color"].default_value = (
-            self.colour,
-            self.colour,
-            self.colour,
-            1.0,
-        )
+        # Take the base colour from the robot's colour
+        n_obj_info = node_list.new("ShaderNodeObjectInfo")
 
         # Create output node
         n_output = node_list.new("ShaderNodeOutputMaterial")
 
         # Link shaders
         tl = l_mat.node_tree.links
+        tl.new(n_obj_info.outputs["Color"], n_principled.inputs["Base Color"])
         tl.new(n_principled.outputs[0], n_output.inputs[0])
 
         return l_mat
@@ -131,28 +116,6 @@ class MiscRobot(BlenderObject):
                 "{}_{}".format(self.name, k)
             ].delta_rotation_euler = delta_rot
 
-    def update_kinematics(self):
-        # Set all joints to neutral pose
-        for k in self.robot_parts.keys():
-            # Calculate min, max and mode limits
-            lim = self.robot_parts[k]["limits"]
-            var = self.robot["kinematics_variance"]
-            # Calculate delta rotation for the relevant axis
-            (v_min, v_max) = (
-                lim[1] - var * (lim[1] - lim[0]),
-                lim[1] - var * (lim[1] - lim[2]),
-            )
-            # Calculate delta rotation for the relevant axis
-            delta_rot = [0.0, 0.0, 0.0]
-            delta_rot[self.robot_parts[k]["rot_axis"]] = radians(
-                triangular(v_min, v_max, lim[1])
-            )
-            # Add to output dictionary
-            bpy.data.objects[
-                "{}_{}".format(self.name, k)
-            ].delta_rotation_euler = delta_rot
-
     def update(self, cfg):
-        self.update_kinematics()
         bpy.data.objects[self.name + "_Torso"].location = cfg["position"]
         bpy.data.objects[self.name + "_Torso"].delta_rotation_euler = cfg["rotation"]
@@ -0,0 +1,145 @@
+#!/usr/local/blender -P
+
+import os
+import json
+import numpy as np
+
+from config import scene_config as scene_cfg
+
+
+# Samples the joint angles of every robot in the scene at once
+# Joint limits and objects are gathered when robots are added, so each frame is a single NumPy
+# sample followed by one write per joint
+class PoseSampler:
+    def __init__(self):
+        self.robots = []
+        self.objs = []
+        self.axes = []
+        self.joints = []
+        self.limits = np.zeros((0, 3))
+        self.variance = np.zeros(0)
+        self.libraries = {}
+
+    # Add a robot's joints to the sampler
+    #   parts: kinematics information of the robot's model ({joint: {"limits", "rot_axis"}})
+    def add(self, name, model, parts, objs, variance):
+        start = len(self.objs)
+        for k in parts.keys():
+            self.objs.append(objs["{}_{}".format(name, k)])
+            self.axes.append(parts[k]["rot_axis"])
+            self.joints.append(k)
+
+        self.robots.append(
+            {"name": name, "model": model, "joints": slice(start, len(self.objs))}
+        )
+        self.limits = np.concatenate(
+            [self.limits, np.radians([parts[k]["limits"] for k in parts.keys()])]
+        )
+        self.variance = np.concatenate(
+            [self.variance, np.full(len(parts), variance, dtype=np.float64)]
+        )
+
+        if model not in self.libraries:
+            self.libraries[model] = load_library(model)
+
+    # Sample joint angles (radians) for every joint of every robot
+    # Returns the angles and, for each robot, the index of the library pose used or None
+    def sample(self):
+        angles = sample_triangular(self.limits, self.variance)
+
+        poses = {}
+        probability = scene_cfg.pose_library["probability"]
+        for robot in self.robots:
+            library = self.libraries[robot["model"]]
+            poses[robot["name"]] = None
+            if library is None or np.random.random() >= probability:
+                continue
+
+            # Replace the joints the library knows with one of its poses
+            pose = np.random.randint(len(library["poses"]))
+            joints = robot["joints"]
+            for ii in range(joints.start, joints.stop):
+                column = library["columns"].get(self.joints[ii])
+                if column is not None:
+                    angles[ii] = library["poses"][pose, column]
+            poses[robot["name"]] = pose
+
+        return angles, poses
+
+    # Set the joint rotations, skipping the robots named in exclude
+    def apply(self, angles, exclude=()):
+        for robot in self.robots:
+            if robot["name"] in exclude:
+                continue
+            joints = robot["joints"]
+            for ii in range(joints.start, joints.stop):
+                # The other axes of the delta rotation are left at zero by initialise_kinematics
+                self.objs[ii].delta_rotation_euler[self.axes[ii]] = angles[ii]
+
+    # Sample and apply a new pose for every robot
+    # Returns the index of the library pose used for each robot, or None for a random pose
+    def update(self, exclude=()):
+        angles, poses = self.sample()
+        self.apply(angles, exclude)
+        return {name: pose for name, pose in poses.items() if name not in exclude}
+
+    # Height of a robot's base above the ground that puts its feet on the ground in a library pose
+    # Returns None for random poses or libraries without base heights
+    def base_height(self, model, pose):
+        library = self.libraries.get(model)
+        if pose is None or library is None or library["base_height"] is None:
+            return None
+        return float(library["base_height"][pose])
+
+
+# Sample from a triangular distribution around each joint's neutral angle
+#   limits: (n, 3) array of [min, neutral, max] angles
+#   variance: (n,) fraction of the range between the neutral angle and each limit to sample
+def sample_triangular(limits, variance):
+    mode = limits[:, 1]
+    low = mode - variance * (mode - limits[:, 0])
+    high = mode - variance * (mode - limits[:, 2])
+
+    # Inverse of the triangular CDF, which unlike np.random.triangular allows zero width ranges
+    u = np.random.random(len(mode))
+    width = high - low
+    with np.errstate(divide="ignore", invalid="ignore"):
+        split = np.where(width != 0, (mode - low) / width, 0.0)
+    angles = np.where(
+        u < split,
+        low + np.sqrt(u * width * (mode - low)),
+        high - np.sqrt((1 - u) * width * (high - mode)),
+    )
+    return np.where(width != 0, angles, mode)
+
+
+# Load the pose library for a robot model from the pose library path, if it has one
+# Libraries are .npz or .json files with
+#   "joints": joint names, "poses": (n, joints) angles in degrees,
+#   "base_height": optional (n,) height of the robot's base above the ground in each pose
+# pose_library.py builds these libraries
+def load_library(model):
+    base = os.path.join(scene_cfg.pose_library["path"], model)
+
+    if os.path.isfile(base + ".npz"):
+        with np.load(base + ".npz") as f:
+            data = {k: f[k] for k in f.files}
+    elif os.path.isfile(base + ".json"):
+        with open(base + ".json", "r") as f:
+            data = json.load(f)
+    else:
+        return None
+
+    poses = np.radians(np.asarray(data["poses"], dtype=np.float64))
+    if len(poses) == 0:
+        return None
+
+    return {
+        "columns": {str(j): ii for ii, j in enumerate(data["joints"])},
+        "poses": poses.reshape(len(poses), -1),
+        "base_height": (
+            np.asarray(data["base_height"], dtype=np.float64)
+            if data.get("base_height") is not None
+            else None
+        ),
+    }
@@ -2,15 +2,14 @@
 
 import os
 import bpy
-import json
 import re
 from math import radians
-from random import triangular, randint
+from random import randint
 
 from config import blend_config as blend_cfg
-from config import scene_config as scene_cfg
 
 from scene.blender_object import BlenderObject
+from scene import robot_model
 
 import numpy as np
 
@@ -19,6 +18,7 @@ class Robot(BlenderObject):
     def __init__(self, name, class_index, robot_info):
         self.mat = {}
         self.sc_plane = None
+        self.model = None
         self.robot_parts = None
         self.pass_index = class_index
         self.objs = {}
@@ -29,46 +29,45 @@ class Robot(BlenderObject):
 
     # Setup robot object
     def construct(self, robot_info):
-        robot_mesh = None
-        robot_obj = {}
-
-        # Load kinematics information
-        with open(robot_info["kinematics_path"], "r") as file:
-            self.robot_parts = json.loads(file.read())
-        # Load robot object
-        bpy.ops.import_scene.fbx(
-            filepath=robot_info["mesh_path"], axis_forward="X", axis_up="Z"
-        )
-        # Add object to our list of parts
-        for p in self.robot_parts.keys():
-            obj = bpy.data.objects[p]
+        # Import the robot model once and create this robot as a linked duplicate of it
+        model = robot_model.load(robot_info)
+        self.model = model["name"]
+        self.robot_parts = model["parts"]
+        objs = robot_model.instantiate(model, self.name, self.pass_index)
 
+        # Add object to our list of parts
+        for p, obj in objs.items():
             # Set base hip as main robot object
             if obj.parent == None:
                 self.obj = obj
-            obj.name = "{}_{}".format(self.name, p)
             self.objs.update({obj.name: obj})
-            # Configure each part to have correct pass index
-            obj.pass_index = self.pass_index
-
-            col_re = r"Base_?Color.*"
-            nor_re = r"Normal.*"
-
-            # Use regex to find colour and normal map
-            tex_path = os.path.join(
-                robot_info["texture_path"], self.robot_parts[p]["dir"]
-            )
-            col_path = ""
-            nor_path = ""
-            for file in os.listdir(tex_path):
-                if re.search(col_re, file, re.I) is not None:
-                    col_path = os.path.join(tex_path, file)
-                if re.search(nor_re, file, re.I) is not None:
-                    nor_path = os.path.join(tex_path, file)
-
-            # Set material for limb
-            self.mat.update({obj.name: self.set_material(obj, p, col_path, nor_path)})
-            obj.data.materials.append(self.mat[obj.name])
+
+            # Create the part's material the first time the model is used
+            mat_name = "{}_{}".format(model["name"], p)
+            if mat_name not in model["materials"]:
+                col_re = r"Base_?Color.*"
+                nor_re = r"Normal.*"
+
+                # Use regex to find colour and normal map
+                tex_path = os.path.join(
+                    robot_info["texture_path"], self.robot_parts[p]["dir"]
+                )
+                col_path = ""
+                nor_path = ""
+                for file in os.listdir(tex_path):
+                    if re.search(col_re, file, re.I) is not None:
+                        col_path = os.path.join(tex_path, file)
+                    if re.search(nor_re, file, re.I) is not None:
+                        nor_path = os.path.join(tex_path, file)
+
+                # Set material for limb
+                model["materials"][mat_name] = self.set_material(
+                    obj, mat_name, col_path, nor_path
+                )
+                robot_model.set_material(obj, model["materials"][mat_name])
+            self.mat.update({obj.name: model["materials"][mat_name]})
+
+        robot_model.set_colour(self.objs.values(), self.colour)
 
         self.initialise_kinematics()
 
@@ -91,19 +90,14 @@ class Robot(BlenderObject):
         n_uv_map = node_list.new("ShaderNodeTexImage")
         n_uv_map.name = "UV_Image"
         try:
-            img = bpy.data.images.load(colour_path)
+            img = bpy.data.images.load(colour_path, check_existing=True)
         except:
             raise NameError("Cannot load image {0}".format(colour_path))
         n_uv_map.image = img
 
-        # Create RGB mixer to change base colour of colour map
+        # Create RGB mixer to change base colour of colour map to the robot's colour
         n_mix_col_map = node_list.new("ShaderNodeMixRGB")
-        n_mix_col_map.inputs[2].default_value = (
-            self.colour,
-            self.colour,
-            self.colour,
-            1.0,
-        )
+        n_obj_info = node_list.new("ShaderNodeObjectInfo")
 
         # Create normal map node for texture
         if normal_path is not None:
@@ -111,7 +105,7 @@ class Robot(BlenderObject):
             n_norm_map.name = "Norm_Map"
 
             try:
-                norm_map = bpy.data.images.load(normal_path)
+                norm_map = bpy.data.images.load(normal_path, check_existing=True)
             except:
                 raise NameError("Cannot load image {0}".format(normal_path))
             n_norm_map.image = norm_map
@@ -136,6 +130,7 @@ class Robot(BlenderObject):
 
         # Link texture image and normal map
         tl.new(n_uv_map.outputs[0], n_mix_col_map.inputs[1])
+        tl.new(n_obj_info.outputs["Color"], n_mix_col_map.inputs[2])
         tl.new(n_mix_col_map.outputs[0], n_principled.inputs[0])
         if normal_path is not None:
             tl.new(n_norm_map.outputs["Color"], n_norm_map_conv.inputs["Color"])
@@ -172,39 +167,11 @@ class Robot(BlenderObject):
                 "{}_{}".format(self.name, k)
             ].delta_rotation_euler = delta_rot
 
-    def update_kinematics(self):
-        # Set all joints to neutral pose
-        for k in self.robot_parts.keys():
-            # Calculate min, max and mode limits
-            lim = self.robot_parts[k]["limits"]
-            var = scene_cfg.resources["robot"]["kinematics_variance"]
-            # Calculate delta rotation for the relevant axis
-            (v_min, v_max) = (
-                lim[1] - var * (lim[1] - lim[0]),
-                lim[1] - var * (lim[1] - lim[2]),
-            )
-            # Calculate delta rotation for the relevant axis
-            delta_rot = [0.0, 0.0, 0.0]
-            delta_rot[self.robot_parts[k]["rot_axis"]] = radians(
-                triangular(v_min, v_max, lim[1])
-            )
-            # Add to output dictionary
-            bpy.data.objects[
-                "{}_{}".format(self.name, k)
-            ].delta_rotation_euler = delta_rot
-
     def update(self, cfg):
-        self.update_kinematics()
         self.obj.location = cfg["position"]
         # Randomly reassign robot colour
-        col = randint(0, 1)
-        for k in self.objs.keys():
-            self.mat[k].node_tree.nodes["Mix"].inputs[2].default_value = (
-                col,
-                col,
-                col,
-                1,
-            )
+        self.colour = randint(0, 1)
+        robot_model.set_colour(self.objs.values(), self.colour)
 
     # This function specifically updates the main robot's yaw to properly track the target
     def update_main_robot(self, target):
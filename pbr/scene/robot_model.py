@@ -0,0 +1,85 @@
+#!/usr/local/blender -P
+
+import os
+import bpy
+import json
+
+# Robot models are imported once and kept out of the scene as templates
+# Every robot is a linked duplicate of its model's template, sharing its mesh and image data, so
+# startup time and memory scale with the number of distinct models rather than number of robots
+
+# Imported models keyed by the name of their mesh file
+models = {}
+
+
+# Import a robot model, or return it if it has already been imported
+# Returns {"name": model name, "parts": kinematics information, "objs": {part: template object},
+#          "materials": {name: material shared by every robot of the model}}
+def load(robot_info):
+    name = os.path.splitext(os.path.basename(robot_info["mesh_path"]))[0]
+    if name in models:
+        return models[name]
+
+    # Load kinematics information
+    with open(robot_info["kinematics_path"], "r") as file:
+        parts = json.loads(file.read())
+
+    # Load robot object
+    bpy.ops.import_scene.fbx(
+        filepath=robot_info["mesh_path"], axis_forward="X", axis_up="Z"
+    )
+
+    objs = {}
+    for p in parts.keys():
+        obj = bpy.data.objects[p]
+        # Rename the template so the next model imported can use the same part names
+        obj.name = "{}_template_{}".format(name, p)
+
+        # Leave a single empty material slot for the shared material
+        obj.data.materials.clear()
+        obj.data.materials.append(None)
+
+        # Remove the template from the scene but keep it around to duplicate
+        for collection in obj.users_collection:
+            collection.objects.unlink(obj)
+        obj.use_fake_user = True
+
+        objs.update({p: obj})
+
+    models[name] = {"name": name, "parts": parts, "objs": objs, "materials": {}}
+    return models[name]
+
+
+# Create a robot from a loaded model, its parts are named "{name}_{part}"
+# Returns {part: object}
+def instantiate(model, name, pass_index):
+    objs = {}
+    parts = {}
+    for p, template in model["objs"].items():
+        # Copying the object shares its mesh data with the template
+        obj = template.copy()
+        obj.name = "{}_{}".format(name, p)
+        obj.pass_index = pass_index
+        bpy.context.scene.collection.objects.link(obj)
+        objs.update({p: obj})
+        parts.update({template.name: p})
+
+    # The copies are still parented to the template, move them to the matching copied part
+    for obj in objs.values():
+        if obj.parent is not None and obj.parent.name in parts:
+            obj.parent = objs[parts[obj.parent.name]]
+
+    return objs
+
+
+# Set the material of a part for every robot of the model, as they share the part's mesh data
+# Robots are coloured by setting the colour of their objects, which the material reads through an
+# Object Info node, so the shader is only compiled once per model
+def set_material(obj, mat):
+    obj.data.materials[0] = mat
+
+
+# Set the colour of every part of a robot
+def set_colour(objs, colour):
+    for obj in objs:
+        obj.color = (colour, colour, colour, 1.0)
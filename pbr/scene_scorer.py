@@ -0,0 +1,144 @@
+import os
+import math
+import pickle
+import random
+import importlib
+
+import numpy as np
+
+from config import scene_config
+
+from asset_sampler import asset_names
+
+# Biases the scenes that get rendered towards those an external scorer rates highly, e.g. where a detector performs
+# worst (see scene_config.scene_scoring)
+# Each frame, a batch of candidate scenes (assets and configuration) is planned and scored in one call, and one
+# candidate is chosen with probability growing with its score before anything is changed in Blender
+# The first candidate has the frame's assets from the asset sampler, the others draw theirs from the asset weights. In
+# the planned asset modes (see scene_config.asset_sampling) scoring so trades some of the plan's balance for scenes
+# the scorer prefers
+#
+# A scorer is either
+#   * "package.module:function", called with the list of candidates and returning one score per candidate, or
+#   * the path of a pickled model with a predict method, called with the (candidates, features) array of the
+#     candidates' flattened numeric features (in the order of the model's feature_names_in_ if it has them)
+# Each candidate is {"assets": {"hdr", "ball", "grass", "camera"} (paths relative to the resource directory and the
+# camera type), "config": the scene configuration, "features": {name: value} of its flattened numeric values}
+
+
+# Flatten the numbers of a nested configuration into {"a.b.0": value}
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple)):
+        items = enumerate(value)
+    elif isinstance(value, (bool, int, float, np.number)):
+        return {prefix: float(value)}
+    else:
+        return {}
+
+    features = {}
+    for k, v in items:
+        features.update(flatten(v, "{}.{}".format(prefix, k) if prefix else str(k)))
+    return features
+
+
+# Array of the features of the candidates, missing features are NaN
+def feature_array(candidates, names=None):
+    if names is None:
+        names = sorted(set().union(*[c["features"].keys() for c in candidates]))
+    return np.array(
+        [[c["features"].get(n, np.nan) for n in names] for c in candidates],
+        dtype=np.float64,
+    )
+
+
+# Load a scorer from a "module:function" name or a pickled model
+# Returns a function scoring a list of candidates
+def load_scorer(spec):
+    if os.path.isfile(spec):
+        with open(spec, "rb") as f:
+            model = pickle.load(f)
+        names = getattr(model, "feature_names_in_", None)
+
+        def score(candidates):
+            return model.predict(feature_array(candidates, names))
+
+        return score
+
+    module, sep, name = spec.partition(":")
+    if not sep:
+        raise ValueError(
+            "Scene scorer '{}' is neither a file nor 'module:function'".format(spec)
+        )
+    return getattr(importlib.import_module(module), name)
+
+
+# Plans the assets and configuration of each frame, scoring batches of candidates when a scorer is configured
+class ScenePlanner:
+    def __init__(self, asset_sampler):
+        self.asset_sampler = asset_sampler
+        self.scorer = None
+
+        spec = scene_config.scene_scoring["scorer"]
+        if spec is not None:
+            self.scorer = load_scorer(spec)
+            print("[INFO] Scoring candidate scenes with '{}'".format(spec))
+
+    # A random candidate scene for a frame, with the frame's own assets or assets drawn from the weights
+    def candidate(self, frame_num, planned=True):
+        assets = (
+            self.asset_sampler.choose(frame_num)
+            if planned
+            else self.asset_sampler.sample()
+        )
+        config = scene_config.configure_scene(camera_type=assets["camera"])
+        return {
+            "assets": asset_names(assets),
+            "config": config,
+            "features": flatten(config),
+            "chosen": assets,
+        }
+
+    # Choose the assets and configuration of a frame
+    # Returns the assets chosen by the asset sampler and the scene configuration
+    def plan(self, frame_num):
+        if self.scorer is None:
+            assets = self.asset_sampler.choose(frame_num)
+            return assets, scene_config.configure_scene(camera_type=assets["camera"])
+
+        num_candidates = scene_config.scene_scoring["candidates"]
+        candidates = [
+            self.candidate(frame_num, planned=ii == 0) for ii in range(num_candidates)
+        ]
+        scores = np.asarray(
+            self.scorer(
+                [
+                    {k: c[k] for k in ["assets", "config", "features"]}
+                    for c in candidates
+                ]
+            ),
+            dtype=np.float64,
+        ).reshape(-1)
+        if len(scores) != len(candidates):
+            raise ValueError(
+                "Scene scorer returned {} scores for {} candidates".format(
+                    len(scores), len(candidates)
+                )
+            )
+        scores = np.where(np.isfinite(scores), scores, -np.inf)
+
+        # Softmax over the scores, a temperature of 0 always takes the best candidate
+        temperature = scene_config.scene_scoring["temperature"]
+        if temperature <= 0 or not np.isfinite(scores).any():
+            choice = int(np.argmax(scores))
+        else:
+            weights = np.exp((scores - scores.max()) / temperature)
+            choice = random.choices(range(len(candidates)), weights=weights)[0]
+
+        chosen = candidates[choice]
+        chosen["config"]["scoring"] = {
+            "score": float(scores[choice]) if math.isfinite(scores[choice]) else None,
+            "candidates": len(candidates),
+        }
+        return chosen["chosen"], chosen["config"]
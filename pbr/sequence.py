@@ -0,0 +1,300 @@
+#!/usr/local/bin/blender -P
+
+import os
+import sys
+import copy
+import time
+import random
+import bpy
+import argparse
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import numpy as np
+
+from config import output_config as out_cfg
+from config import scene_config
+
+from scene import environment as env
+
+import pbr
+import util
+import meta_writer
+
+# Renders temporally coherent clips instead of independent frames
+# Each clip is randomised like a single frame at its first frame, then the ball rolls, the robots walk and change
+# pose, and the camera robot walks while tracking its target until the last frame of the clip. The motion is
+# keyframed and each clip is rendered with Blender's animation render, so only transforms change between frames
+#   blender -b -P pbr/sequence.py -- --num-clips 10 --clip-length 30
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="sequence.py")
+    parser.add_argument("--start-frame", type=int, default=1)
+    parser.add_argument("--num-clips", type=int, default=1)
+    parser.add_argument("--clip-length", type=int, default=30, help="frames per clip")
+    pbr.add_scene_args(parser)
+    return parser.parse_args(argv)
+
+
+# Remove the keyframes of the previous clip
+def clear_animation():
+    for obj in bpy.data.objects:
+        if obj.animation_data is not None:
+            obj.animation_data_clear()
+
+
+# Keep a ground position within the field and its border
+def clamp_to_field(position, field_cfg):
+    x_lim = field_cfg["length"] / 2.0 + scene_config.field_dims["border_width"]
+    y_lim = field_cfg["width"] / 2.0 + scene_config.field_dims["border_width"]
+    return (
+        float(np.clip(position[0], -x_lim, x_lim)),
+        float(np.clip(position[1], -y_lim, y_lim)),
+        position[2],
+    )
+
+
+# Displacement of something moving in a random direction at a random speed from the range for the given time
+def random_move(speed_range, duration):
+    heading = random.uniform(-np.pi, np.pi)
+    distance = random.uniform(*speed_range) * duration
+    return np.array([np.cos(heading), np.sin(heading), 0.0]) * distance
+
+
+# Keyframe the joints of every robot at the given frame
+def keyframe_pose(pose_sampler, frame_num):
+    for obj in pose_sampler.objs:
+        obj.keyframe_insert(data_path="delta_rotation_euler", frame=frame_num)
+
+
+# Randomise the scene at the first frame of a clip and keyframe its motion until the last frame
+def animate_clip(scene, start_frame, end_frame):
+    ball = scene["ball"]
+    robots = scene["robots"]
+    misc_robots = scene["misc_robots"]
+    pose_sampler = scene["pose_sampler"]
+
+    clear_animation()
+
+    # Randomise and keyframe the first frame of the clip
+    frame = pbr.update_scene(scene, start_frame)
+    config = frame["config"]
+    is_semi_synthetic = frame["hdr_data"]["is_semi_synthetic"]
+    tracking = bpy.data.objects["Tracking_Target"]
+    tracking.keyframe_insert(data_path="location", frame=start_frame)
+    keyframe_pose(pose_sampler, start_frame)
+
+    duration = (end_frame - start_frame) / scene_config.sequence["fps"]
+
+    # Roll the ball
+    ball_move = random_move(scene_config.sequence["ball_speed"], duration)
+    start_location = np.array(ball.obj.location)
+    ball.obj.location = clamp_to_field(start_location + ball_move, config["field"])
+    ball_move = np.array(ball.obj.location) - start_location
+    radius = ball.obj.dimensions[0] / 2.0
+    ball.obj.rotation_euler[0] -= ball_move[1] / radius
+    ball.obj.rotation_euler[1] += ball_move[0] / radius
+    ball.obj.keyframe_insert(data_path="location", frame=end_frame)
+    ball.obj.keyframe_insert(data_path="rotation_euler", frame=end_frame)
+
+    # Move the tracking target with the ball when following it
+    if frame["tracking_target"] == ball.obj:
+        tracking.location = np.array(tracking.location) + ball_move
+    tracking.keyframe_insert(data_path="location", frame=end_frame)
+
+    # Change pose, keeping the yaw misc robots store in the delta rotation of their base
+    misc_yaw = [tuple(r.obj.delta_rotation_euler) for r in misc_robots]
+    poses = pose_sampler.update(exclude=[robots[0].name] if is_semi_synthetic else [])
+    for r, yaw in zip(misc_robots, misc_yaw):
+        r.obj.delta_rotation_euler = yaw
+    keyframe_pose(pose_sampler, end_frame)
+
+    # Walk the robots, the camera robot only moves when the field is generated
+    for ii, r in enumerate(robots + misc_robots):
+        if ii == 0 and is_semi_synthetic:
+            continue
+
+        speed = scene_config.sequence[
+            "camera_robot_speed" if ii == 0 else "robot_speed"
+        ]
+        location = clamp_to_field(
+            np.array(r.obj.location) + random_move(speed, duration), config["field"]
+        )
+
+        # Stand robots with a new library pose on the ground
+        base_height = pose_sampler.base_height(r.model, poses.get(r.name))
+        if ii > 0 and base_height is not None:
+            location = (location[0], location[1], base_height)
+
+        r.obj.location = location
+        util.keyframe_transform(r.obj, end_frame)
+
+    # Keep the camera robot facing its target
+    robots[0].update_main_robot(tracking)
+    util.keyframe_transform(robots[0].obj, end_frame)
+
+    return frame
+
+
+# Configuration of the frame with the positions the animation has reached
+def frame_config(scene, config, clip, start_frame, frame_num, length):
+    config = copy.deepcopy(config)
+
+    config["ball"]["position"] = tuple(scene["ball"].obj.location)
+    config["ball"]["rotation"] = tuple(scene["ball"].obj.rotation_euler)
+    for ii, r in enumerate(scene["robots"]):
+        config["robot"][ii]["position"] = tuple(r.obj.location)
+    for ii, r in enumerate(scene["misc_robots"]):
+        config["misc_robot"][ii]["position"] = tuple(r.obj.location)
+
+    config["sequence"] = {
+        "clip": clip,
+        "start_frame": start_frame,
+        "index": frame_num - start_frame,
+        "length": length,
+    }
+    return config
+
+
+#   seeds: {"run", "frame"} seeds the random number generators were seeded with at the start of the clip
+def render_clip(scene, clip, start_frame, length, seeds=None):
+    render_layer_toggle = scene["render_layer_toggle"]
+    end_frame = start_frame + length - 1
+
+    start = time.time()
+    frame = animate_clip(scene, start_frame, end_frame)
+    frame["seeds"] = seeds
+    timing = {"plan": time.time() - start}
+
+    bpy_scene = bpy.context.scene
+    bpy_scene.frame_start = start_frame
+    bpy_scene.frame_end = end_frame
+    bpy_scene.render.fps = scene_config.sequence["fps"]
+
+    # Blender replaces the "#"s of the output paths with the frame number
+    pattern = "#" * out_cfg.filename_len
+
+    if out_cfg.output_depth:
+        render_layer_toggle[2].file_slots[0].path = pattern + ".exr"
+    if out_cfg.output_instances:
+        render_layer_toggle[3].file_slots[0].path = pattern + ".png"
+
+    # Render for the main camera only
+    bpy_scene.camera = scene["cam_l"].obj
+
+    # Use multiview stereo if stereo output is enabled
+    # (this will automatically render the second camera)
+    if out_cfg.output_stereo:
+        bpy_scene.render.use_multiview = True
+
+    # Render raw images
+    raw_start = time.time()
+    util.render_image(
+        isMaskImage=False,
+        toggle=render_layer_toggle,
+        shadowcatcher=scene["shadowcatcher"],
+        world=scene["world"],
+        env=env,
+        hdr_path=frame["hdr_path"],
+        strength=frame["config"]["environment"]["strength"],
+        env_info=frame["env_info"],
+        output_path=os.path.join(out_cfg.render_image_dir, pattern + ".png"),
+        animation=True,
+    )
+
+    timing["raw"] = time.time() - raw_start
+
+    # Render mask images
+    mask_start = time.time()
+    reproject = pbr.reproject_mask_background(frame["hdr_data"])
+    mask_paths = util.render_image(
+        isMaskImage=True,
+        toggle=render_layer_toggle,
+        shadowcatcher=scene["shadowcatcher"],
+        world=scene["world"],
+        env=env,
+        hdr_path=None if reproject else frame["hdr_data"]["mask_path"],
+        strength=1.0,
+        env_info=frame["env_info"],
+        output_path=os.path.join(out_cfg.mask_dir, pattern + ".png"),
+        animation=True,
+        transparent=reproject,
+    )
+
+    # The camera moves over the clip, so the background of each frame is reprojected with its camera
+    if reproject:
+        for frame_num, mask_path in zip(range(start_frame, end_frame + 1), mask_paths):
+            bpy_scene.frame_set(frame_num)
+            util.composite_mask_background(
+                [mask_path],
+                frame["hdr_data"]["mask_path"],
+                frame["config"]["camera"],
+                scene["cam_l"],
+                frame["env_info"],
+            )
+
+    pbr.compact_masks(mask_paths)
+    if out_cfg.output_depth:
+        util.upscale_depth(
+            [
+                os.path.join(
+                    out_cfg.depth_dir, str(f).zfill(out_cfg.filename_len) + ".exr"
+                )
+                for f in range(start_frame, end_frame + 1)
+            ]
+        )
+    timing["mask"] = time.time() - mask_start
+    timing["total"] = time.time() - start
+
+    # The clip is rendered at once, so each frame records its share of the clip's durations
+    frame["timing"] = {k: v / length for k, v in timing.items()}
+
+    # Write the meta of every frame of the clip
+    for frame_num in range(start_frame, end_frame + 1):
+        bpy_scene.frame_set(frame_num)
+        pbr.write_meta(
+            scene,
+            frame_num,
+            {
+                **frame,
+                "config": frame_config(
+                    scene, frame["config"], clip, start_frame, frame_num, length
+                ),
+            },
+        )
+
+    print(
+        "[INFO] Rendered clip {} (frames {} to {})".format(clip, start_frame, end_frame)
+    )
+
+
+def main():
+    args = parse_args()
+
+    # Sequences are animated through the keyframes of the scene update
+    out_cfg.output_keyframes = True
+
+    pbr.apply_scene_args(args)
+    scene = pbr.build_scene()
+
+    for clip in range(args.num_clips):
+        start_frame = args.start_frame + clip * args.clip_length
+        seeds = None
+        if args.seed is not None:
+            seeds = {"run": args.seed, "frame": util.seed_frame(args.seed, start_frame)}
+
+        render_clip(scene, clip, start_frame, args.clip_length, seeds)
+
+        # Objects rebuilt for every clip leave their old data behind
+        util.purge_orphans()
+
+    # Write the rows of the meta table still buffered
+    meta_writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 import os
 import re
 import bpy
+import json
 import random as rand
 import numpy as np
 import math
 import cv2
 
+from config import blend_config as blend_cfg
+from config import output_config as out_cfg
 from config import scene_config
 from scene import environment as env
 from mathutils import Vector
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+
+import projection
+import hdr_cache
+
 
 # Import assets from path as defined by asset_list
 # Where asset list ('assets') is a list of two-tuples, each containing
@@ -74,6 +83,49 @@ def load_assets():
     )
     print("[INFO] \tNumber of balls imported: {0}".format(len(balls)))
 
+    # Catalog of the environments, loaded once so choosing one for a frame needs no file access
+    hdrs = populate_environments()
+    workers = resources["environment"]["preload_workers"]
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hdrs = tuple(pool.map(load_environment, hdrs))
+    else:
+        hdrs = tuple(load_environment(hdr) for hdr in hdrs)
+    print(
+        "[INFO] \tNumber of environments with cached versions: {0}".format(
+            sum(hdr["cache"] is not None for hdr in hdrs)
+        )
+    )
+
+    # Populate list of grass textures
+    grass_img_ext = "(?:{})$".format(
+        "|".join([re.escape(s) for s in resources["field"]["grass"]["img_types"]])
+    )
+    grass_diffuse_re = r"diffuse.*" + grass_img_ext
+    grass_normal_re = r"normal.*" + grass_img_ext
+    grass_bump_re = r"bump.*" + grass_img_ext
+    print(
+        "[INFO] Importing grass textures from '{0}'".format(
+            resources["field"]["grass"]["path"]
+        )
+    )
+    grasses = populate_assets(
+        resources["field"]["grass"]["path"],
+        [
+            ("diffuse", grass_diffuse_re),
+            ("normal", grass_normal_re),
+            ("bump", grass_bump_re),
+        ],
+    )
+    print("[INFO] \tNumber of grass textures imported: {0}".format(len(grasses)))
+
+    return hdrs, balls, grasses
+
+
+# Find the raw, mask and info files of every environment
+def populate_environments():
+    resources = scene_config.resources
+
     env_raw_ext = "(?:{})$".format(
         "|".join([re.escape(s) for s in resources["environment"]["hdri_types"]])
     )
@@ -101,29 +153,78 @@ def load_assets():
     )
     print("[INFO] \tNumber of environments imported: {0}".format(len(hdrs)))
 
-    # Populate list of grass textures
-    grass_img_ext = "(?:{})$".format(
-        "|".join([re.escape(s) for s in resources["field"]["grass"]["img_types"]])
-    )
-    grass_diffuse_re = r"diffuse.*" + grass_img_ext
-    grass_normal_re = r"normal.*" + grass_img_ext
-    grass_bump_re = r"bump.*" + grass_img_ext
-    print(
-        "[INFO] Importing grass textures from '{0}'".format(
-            resources["field"]["grass"]["path"]
-        )
-    )
-    grasses = populate_assets(
-        resources["field"]["grass"]["path"],
-        [
-            ("diffuse", grass_diffuse_re),
-            ("normal", grass_normal_re),
-            ("bump", grass_bump_re),
-        ],
+    return hdrs
+
+
+# Load everything a frame needs to know about an environment
+# Returns a read only entry with the environment's paths and
+#   cache: its HDR cache index (see hdr_cache.py) or None,
+#   info: its parsed info file, to_draw: the objects drawn over it,
+#   is_semi_synthetic: whether the field or goals come from the environment instead of being drawn,
+#   mask_shape: (height, width) of its mask image or None,
+#   field_coords: (n, 2) read only array of the (row, column) field pixels of its mask image,
+#   field_fraction: fraction of the mask image which is field
+def load_environment(hdr):
+    with open(hdr["info_path"], "r") as f:
+        info = json.load(f)
+
+    cache = hdr_cache.load_index(hdr)
+
+    # Field pixels of the mask, precomputed by preprocess_hdr.py when cached
+    field = None
+    if cache is not None and cache["field_mask_path"] is not None:
+        field = hdr_cache.load_field_bitmap(cache["field_mask_path"])
+    elif hdr["mask_path"] is not None:
+        img = cv2.imread(hdr["mask_path"])
+        if img is None:
+            raise NameError("Cannot load image {0}".format(hdr["mask_path"]))
+        field = field_pixels(img)
+
+    if field is not None:
+        field_coords = np.stack(field.nonzero(), axis=-1)
+        mask_shape = field.shape
+        field_fraction = float(len(field_coords)) / field.size
+    else:
+        field_coords = np.zeros((0, 2), dtype=np.int64)
+        mask_shape = None
+        field_fraction = 0.0
+    field_coords.setflags(write=False)
+
+    return MappingProxyType(
+        {
+            **hdr,
+            "cache": cache,
+            "info": info,
+            "to_draw": info["to_draw"],
+            "is_semi_synthetic": not info["to_draw"]["goal"]
+            or not info["to_draw"]["field"],
+            "mask_shape": mask_shape,
+            "field_coords": field_coords,
+            "field_fraction": field_fraction,
+        }
     )
-    print("[INFO] \tNumber of grass textures imported: {0}".format(len(grasses)))
 
-    return hdrs, balls, grasses
+
+# Remove data blocks which are no longer used by anything in the scene
+# Objects that are rebuilt every frame (ball, field, goals) otherwise leave their old data behind
+def purge_orphans():
+    for blocks in [
+        bpy.data.meshes,
+        bpy.data.materials,
+        bpy.data.textures,
+        bpy.data.images,
+        bpy.data.curves,
+    ]:
+        for block in list(blocks):
+            if block.users == 0:
+                blocks.remove(block)
+
+
+# Keyframe an object's location and rotation at the given frame, if keyframes are enabled
+def keyframe_transform(obj, frame_num):
+    if out_cfg.output_keyframes:
+        obj.keyframe_insert(data_path="location", frame=frame_num)
+        obj.keyframe_insert(data_path="rotation_euler", frame=frame_num)
 
 
 def setup_environment(hdr, env_info):
@@ -139,6 +240,9 @@ def setup_environment(hdr, env_info):
 
 
 # Renders image frame for either raw or mask image (defined by <isRawImage>)
+# With <animation> every frame of the scene's frame range is rendered, <output_path> then needs a "#" pattern
+# With <transparent> the world background is left transparent (see composite_mask_background)
+# Returns the output paths of the rendered frames
 def render_image(
     isMaskImage,
     toggle,
@@ -149,6 +253,8 @@ def render_image(
     strength,
     env_info,
     output_path,
+    animation=False,
+    transparent=False,
 ):
     # Turn off all render layers
     for l in bpy.context.scene.view_layers:
@@ -158,9 +264,12 @@ def render_image(
     bpy.context.scene.view_layers["View Layer"].use = not isMaskImage
     toggle[0].check = isMaskImage
     toggle[1].inputs[0].default_value = 1 if isMaskImage else 0
+    # The instance ids come from the image segment layer, which only renders with the mask
+    if toggle[3] is not None:
+        toggle[3].mute = not isMaskImage
     shadowcatcher.obj.hide_render = isMaskImage
     # Update HDRI map
-    env.update_hdri_env(world, hdr_path, env_info)
+    env.update_hdri_env(world, hdr_path, env_info, is_data=isMaskImage)
     bpy.context.scene.world.node_tree.nodes["Background"].inputs[
         "Strength"
     ].default_value = strength
@@ -168,15 +277,163 @@ def render_image(
     scene = bpy.data.scenes["Scene"]
     scene.render.filepath = output_path
 
+    # Draft mode renders the raw image cheaply, masks are always rendered in full
+    draft = blend_cfg.render["draft"] and not isMaskImage
+    if draft:
+        scene.render.engine = blend_cfg.draft["render_engine"]
+        scene.render.resolution_percentage = blend_cfg.draft["percentage"]
+    else:
+        scene.render.engine = blend_cfg.render["render_engine"]
+        scene.render.resolution_percentage = blend_cfg.render["dimensions"][
+            "percentage"
+        ]
+
     # Prevent colour transform settings from being applied to the seg image output
+    # (the display transform of Standard would also change the instance ids, so the mask values are written raw, and
+    # the environment mask is read as data rather than sRGB so its values pass through unchanged)
     if isMaskImage:
-        scene.view_settings.view_transform = "Standard"
+        scene.view_settings.view_transform = "Raw"
     else:
         scene.view_settings.view_transform = "Filmic"
 
     scene.render.image_settings.color_depth = "16"
     scene.render.image_settings.compression = 0
-    bpy.ops.render.render(write_still=True)
+
+    # Keep the alpha of a transparent background
+    color_mode = scene.render.image_settings.color_mode
+    scene.render.film_transparent = transparent
+    if transparent:
+        scene.render.image_settings.color_mode = "RGBA"
+
+    if animation:
+        bpy.ops.render.render(animation=True)
+        output_paths = [
+            scene.render.frame_path(frame=f)
+            for f in range(scene.frame_start, scene.frame_end + 1)
+        ]
+    else:
+        bpy.ops.render.render(write_still=True)
+        output_paths = [output_path]
+
+    scene.render.film_transparent = False
+    scene.render.image_settings.color_mode = color_mode
+
+    if draft and blend_cfg.draft["upscale"]:
+        for path in view_paths(output_paths):
+            upscale_image(path, full_resolution())
+
+    return output_paths
+
+
+# The environment mask image last used by composite_mask_background, consecutive frames often share it
+_env_mask = {"path": None, "img": None}
+
+
+# Fill the transparent background of a rendered mask with the environment's mask image reprojected into the camera
+# Rendering the mask on a transparent background and compositing the environment afterwards avoids sampling the
+# environment mask texture in the render. Stereo renders write one mask per view, which share the camera rotation
+# and so the background
+#   cam_config: the camera configuration of the frame
+#   cam: the camera the mask was rendered with (the left camera for stereo)
+def composite_mask_background(output_paths, env_mask_path, cam_config, cam, env_info):
+    if _env_mask["path"] != env_mask_path:
+        img = cv2.imread(env_mask_path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise NameError("Cannot load image {0}".format(env_mask_path))
+        _env_mask.update({"path": env_mask_path, "img": img})
+    env_img = _env_mask["img"]
+
+    # Write the masks with the channels of the output format
+    color_mode = bpy.context.scene.render.image_settings.color_mode
+    channels = 4 if color_mode == "RGBA" else 3
+
+    for output_path in output_paths:
+        root, ext = os.path.splitext(output_path)
+        for path in [output_path, root + "_L" + ext, root + "_R" + ext]:
+            if not os.path.isfile(path):
+                continue
+
+            # Rendered with alpha as BGRA
+            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if img is None or img.ndim != 3 or img.shape[2] != 4:
+                raise NameError("Cannot load image {0}".format(path))
+            scale = float(np.iinfo(img.dtype).max)
+
+            background, valid = projection.reproject(
+                env_img,
+                cam_config,
+                cam.cam.sensor_width,
+                cam.obj.matrix_world,
+                env_info,
+                img.shape[1],
+                img.shape[0],
+            )
+            background = background.astype(np.float64) * (
+                scale / np.iinfo(env_img.dtype).max
+            )
+            # Pixels outside a fisheye's image circle stay black
+            background[~valid] = 0.0
+
+            # Alpha is stored unpremultiplied, so antialiased edges blend into the background
+            alpha = img[..., 3:].astype(np.float64) / scale
+            img[..., :3] = np.round(
+                img[..., :3] * alpha + background * (1.0 - alpha)
+            ).astype(img.dtype)
+            img[..., 3] = np.iinfo(img.dtype).max
+
+            cv2.imwrite(path, img[..., :channels])
+
+
+# Resolution [width, height] of full renders, which the masks are always rendered at
+def full_resolution():
+    return [
+        int(r * blend_cfg.render["dimensions"]["percentage"] / 100)
+        for r in blend_cfg.render["dimensions"]["resolution"]
+    ]
+
+
+# The existing files of the rendered output paths, stereo renders write one file per view
+def view_paths(output_paths):
+    paths = []
+    for output_path in output_paths:
+        root, ext = os.path.splitext(output_path)
+        for path in [output_path, root + "_L" + ext, root + "_R" + ext]:
+            if os.path.isfile(path):
+                paths.append(path)
+    return paths
+
+
+# Draft renders write depth from the raw image's view layer at the draft resolution, scale it to the masks'
+def upscale_depth(output_paths):
+    if not blend_cfg.render["draft"]:
+        return
+    for path in view_paths(output_paths):
+        # OpenCV only writes OpenEXR when enabled in its environment, so Blender scales the depth
+        try:
+            img = bpy.data.images.load(path)
+        except:
+            raise NameError("Cannot load image {0}".format(path))
+        img.scale(*full_resolution())
+        img.save()
+        bpy.data.images.remove(img)
+
+
+# Resize a rendered image in place to the given [width, height]
+def upscale_image(path, resolution):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise NameError("Cannot load image {0}".format(path))
+    img = cv2.resize(img, tuple(resolution), interpolation=cv2.INTER_CUBIC)
+    cv2.imwrite(path, img)
+
+
+# Seed both random number generators so a frame renders identically on any worker
+# Returns the seed of the frame
+def seed_frame(seed, frame_num):
+    frame_seed = (seed * 1000003 + frame_num) % 2**32
+    rand.seed(frame_seed)
+    np.random.seed(frame_seed)
+    return frame_seed
 
 
 def matrix_to_list(mat):
@@ -188,10 +445,11 @@ def matrix_to_list(mat):
     ]
 
 
-def project_to_ground(y, x, cam_location, img, env_info):
+# Project the pixel (y, x) of an environment image with the given shape to the ground
+def project_to_ground(y, x, cam_location, shape, env_info):
     # Normalise the coordinates into a form useful for making unit vectors
-    phi = (y / img.shape[0]) * math.pi
-    theta = (0.5 - (x / img.shape[1])) * math.pi * 2
+    phi = (y / shape[0]) * math.pi
+    theta = (0.5 - (x / shape[1])) * math.pi * 2
     target_vector = np.array(
         [
             math.sin(phi) * math.cos(theta),
@@ -240,48 +498,42 @@ def project_to_ground(y, x, cam_location, img, env_info):
     return (ground_point[0], ground_point[1])
 
 
-def point_on_field(cam_location, mask_path, env_info, num_points):
-    try:
-        img = cv2.imread(mask_path)
-    except:
-        raise NameError("Cannot load image {0}".format(mask_path))
-
-    # Get coordinates where colour is field colour or field line colour
-    field_coords = np.stack(
-        (
-            np.logical_or(
-                np.all(
-                    img
-                    == [
-                        [
-                            [
-                                int(round(v * 255))
-                                for v in scene_config.resources["field"]["mask"][
-                                    "colour"
-                                ][:3][::-1]
-                            ]
-                        ]
-                    ],
-                    axis=-1,
-                ),
-                np.all(
-                    img
-                    == [
-                        [
-                            [
-                                int(round(v * 255))
-                                for v in scene_config.resources["field"]["mask"][
-                                    "line_colour"
-                                ][:3][::-1]
-                            ]
-                        ]
-                    ],
-                    axis=-1,
-                ),
-            )
-        ).nonzero(),
-        axis=-1,
-    )
+# Pixels of an environment mask image (BGR, as loaded by OpenCV) with the field or field line colour
+def field_pixels(img):
+    cfg = scene_config.field_detection
+    field_mask = scene_config.resources["field"]["mask"]
+
+    # Pixels within the tolerance of the field or line colour
+    mask = np.zeros(img.shape[:2], dtype=np.uint8)
+    for colour in [field_mask["colour"], field_mask["line_colour"]]:
+        bgr = np.array([int(round(v * 255)) for v in colour[:3][::-1]])
+        mask |= cv2.inRange(
+            img[..., :3],
+            np.clip(bgr - cfg["tolerance"], 0, 255),
+            np.clip(bgr + cfg["tolerance"], 0, 255),
+        )
+
+    # Remove specks and fill holes, wrapping around the left and right edges of the equirectangular image
+    pad = max(cfg["open"], cfg["close"])
+    if pad > 0:
+        mask = cv2.copyMakeBorder(mask, 0, 0, pad, pad, cv2.BORDER_WRAP)
+        for op, size in [
+            (cv2.MORPH_OPEN, cfg["open"]),
+            (cv2.MORPH_CLOSE, cfg["close"]),
+        ]:
+            if size > 0:
+                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+                mask = cv2.morphologyEx(mask, op, kernel)
+        mask = mask[:, pad:-pad]
+
+    return mask > 0
+
+
+# Random ground points in view of the field of an environment from the environment catalog (see load_environment)
+def point_on_field(cam_location, hdr_data, num_points):
+    env_info = hdr_data["info"]
+    field_coords = hdr_data["field_coords"]
+    shape = hdr_data["mask_shape"]
 
     ground_points = []
 
@@ -290,7 +542,7 @@ def point_on_field(cam_location, mask_path, env_info, num_points):
         while len(ground_points) < scene_config.num_robots:
             # Get random field point
             y, x = field_coords[rand.randint(0, field_coords.shape[0] - 1)]
-            yproj, xproj = project_to_ground(y, x, cam_location, img, env_info)
+            yproj, xproj = project_to_ground(y, x, cam_location, shape, env_info)
 
             if any(
                 [
@@ -301,7 +553,7 @@ def point_on_field(cam_location, mask_path, env_info, num_points):
             ):
                 continue
 
-            ground_points.append(project_to_ground(y, x, cam_location, img, env_info))
+            ground_points.append(project_to_ground(y, x, cam_location, shape, env_info))
 
     return ground_points
 
@@ -350,6 +602,7 @@ def generate_moves(field_meta, z_coord=0.3):
 
     return world_points
 
+
 # Find the forward vector of an object that you pass in
 def find_forward_vector(obj):
     local_matrix = obj.matrix_local
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import cv2
+import numpy as np
+
+import mask_codec
+
+# Checks the outputs of a run and reports statistics of the dataset
+# Every frame's raw images, masks, depth, instance masks, mask RLEs and meta are checked for missing or corrupt files,
+# and the frames' class pixel frequencies, mask colours outside the palette, asset usage and render timings are
+# summarised. Frames are scanned by a pool of processes. Runs that only wrote meta tables (see meta_writer.py) are
+# checked for a table row of every frame instead of a meta file
+# Results of each frame are cached in <run>/validation.sqlite with the sizes and modification times of its files, so
+# a later scan only reads new or changed frames. The report is written to <run>/validation.json
+#   python3 pbr/validate_dataset.py outputs/run_1 --workers 8
+
+# Version of the cached frame results, a scan with another version rescans every frame
+cache_version = 1
+
+# Number of frames written to the cache at once
+commit_size = 1000
+
+# Number of problems and colours outside the palette listed in the printed report
+print_limit = 20
+
+# Magic number at the start of OpenEXR files
+exr_magic = b"\x76\x2f\x31\x01"
+
+
+# Frame name and view ("", "_L" or "_R") of an output file name
+def frame_name(name):
+    stem = os.path.splitext(name)[0]
+    for view in ["_L", "_R"]:
+        if stem.endswith(view):
+            return stem[: -len(view)], view
+    return stem, ""
+
+
+# Sizes and modification times of the files of each frame in the output directories
+# Returns {frame: {dirname: {file name: (size, mtime)}}}
+def list_outputs(run_dir, dirnames):
+    frames = {}
+    for dirname in dirnames:
+        path = os.path.join(run_dir, dirname)
+        if not os.path.isdir(path):
+            continue
+        with os.scandir(path) as it:
+            for entry in it:
+                # Meta table shards (see meta_writer.py) hold many frames rather than being one
+                if not entry.is_file() or entry.name.startswith("meta_"):
+                    continue
+                stat = entry.stat()
+                frame, _ = frame_name(entry.name)
+                frames.setdefault(frame, {}).setdefault(dirname, {})[entry.name] = (
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+    return frames
+
+
+def signature(files):
+    return json.dumps(files, sort_keys=True)
+
+
+def load_image(path):
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise NameError("Cannot load image {0}".format(path))
+    return img
+
+
+# Class pixel counts of a mask and the counts of its colours outside the palette
+def mask_statistics(img):
+    colours = {}
+    if img.ndim == 2:
+        classes = img
+    else:
+        classes = mask_codec.encode(img)
+
+        # Colours of the pixels outside the palette as 8-bit RGB hex
+        outside = classes == mask_codec.ignore_index
+        if outside.any():
+            rgb = img[outside][:, 2::-1]
+            if rgb.dtype != np.uint8:
+                rgb = np.round(rgb * (255.0 / np.iinfo(rgb.dtype).max))
+            keys, counts = np.unique(mask_codec.colour_keys(rgb), return_counts=True)
+            colours = {"#{:06x}".format(int(k)): int(c) for k, c in zip(keys, counts)}
+
+    counts = np.bincount(classes.ravel(), minlength=256)
+    known = {index for index, _, _ in mask_codec.palette()}
+    for index in np.flatnonzero(counts).tolist():
+        if index not in known and img.ndim == 2:
+            colours["index {}".format(index)] = int(counts[index])
+
+    return {str(k): int(counts[k]) for k in np.flatnonzero(counts).tolist()}, colours
+
+
+# Check the files of one frame and gather its statistics
+#   files: {dirname: {file name: (size, mtime)}} of the frame
+#   dirs: {kind: dirname} of the run's output directories
+def scan_frame(run_dir, frame, files, dirs):
+    result = {
+        "missing": [],
+        "corrupt": [],
+        "classes": {},
+        "off_palette": {},
+        "assets": {},
+        "timing": {},
+    }
+
+    # Stereo frames have a left and right view of each image
+    views = {frame_name(n)[1] for names in files.values() for n in names}
+    views = ["_L", "_R"] if "_L" in views or "_R" in views else [""]
+
+    expected = {
+        "image": [frame + v + ".png" for v in views],
+        "mask": [frame + v + ".png" for v in views],
+        "depth": [frame + v + ".exr" for v in views],
+        "instance": [frame + v + ".png" for v in views],
+        "mask_rle": [frame + v + ".json" for v in views],
+        "meta": [frame + ".yaml"],
+    }
+
+    shapes = {}
+    for kind, dirname in dirs.items():
+        present = files.get(dirname, {})
+        for name in expected[kind]:
+            file = os.path.join(dirname, name)
+            if name not in present:
+                result["missing"].append(file)
+                continue
+            path = os.path.join(run_dir, file)
+            if present[name][0] == 0:
+                result["corrupt"].append(file)
+                continue
+
+            try:
+                if kind == "depth":
+                    with open(path, "rb") as f:
+                        if f.read(4) != exr_magic:
+                            raise ValueError("Not an OpenEXR file")
+                elif kind in ["mask_rle", "meta"]:
+                    with open(path, "r") as f:
+                        data = json.load(f)
+                    if kind == "meta":
+                        # Runs from before the assets were recorded only name the environment
+                        result["assets"] = data.get(
+                            "assets",
+                            {"hdr": data.get("environment", {}).get("file")},
+                        )
+                        result["timing"] = data.get("timing", {})
+                else:
+                    img = load_image(path)
+                    # Draft renders may leave the raw image smaller than the masks
+                    if kind in ["mask", "instance"]:
+                        shapes.setdefault(name, set()).add(img.shape[:2])
+                    if kind == "mask":
+                        classes, colours = mask_statistics(img)
+                        for k, v in classes.items():
+                            result["classes"][k] = result["classes"].get(k, 0) + v
+                        for k, v in colours.items():
+                            result["off_palette"][k] = (
+                                result["off_palette"].get(k, 0) + v
+                            )
+            except Exception:
+                result["corrupt"].append(file)
+
+    # The masks of a view must have the same size
+    for name, sizes in shapes.items():
+        if len(sizes) > 1:
+            result["corrupt"].append("{} (sizes differ)".format(name))
+
+    return result
+
+
+# Cache of the results of each frame
+class ScanCache:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS frames (
+                frame TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                signature TEXT NOT NULL,
+                result TEXT NOT NULL
+            )""")
+
+    def close(self):
+        self.db.close()
+
+    # Cached results of frames with unchanged files, {frame: result}
+    def results(self, signatures):
+        cached = {}
+        for frame, version, sig, result in self.db.execute(
+            "SELECT frame, version, signature, result FROM frames"
+        ):
+            if version == cache_version and signatures.get(frame) == sig:
+                cached[frame] = json.loads(result)
+        return cached
+
+    def store(self, rows):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO frames (frame, version, signature, result) VALUES (?, ?, ?, ?)",
+            [(frame, cache_version, sig, json.dumps(r)) for frame, sig, r in rows],
+        )
+        self.db.commit()
+
+    # Forget frames whose files are gone
+    def prune(self, frames):
+        stale = [
+            (f,)
+            for (f,) in self.db.execute("SELECT frame FROM frames")
+            if f not in frames
+        ]
+        self.db.executemany("DELETE FROM frames WHERE frame = ?", stale)
+        self.db.commit()
+
+
+# Check that every frame has a row in the meta tables of a run, and take its assets and timings from the row
+# Returns the results with the rows' statistics and the meta table shards that could not be read
+def check_table(results, meta_dir, meta_dirname, filename_len):
+    import meta_writer
+
+    rows = {}
+    corrupt = []
+    for name in meta_writer.shards(meta_dir):
+        try:
+            shard = list(
+                meta_writer.read_shard(
+                    os.path.join(meta_dir, name), ["assets", "environment", "timing"]
+                )
+            )
+        except Exception:
+            corrupt.append(os.path.join(meta_dirname, name))
+            continue
+        for row in shard:
+            rows[str(int(row.pop("frame"))).zfill(filename_len)] = row
+
+    checked = {}
+    for frame, result in results.items():
+        result = dict(result)
+        if frame not in rows:
+            result["missing"] = result["missing"] + [
+                "{} row of frame {}".format(meta_dirname, frame)
+            ]
+        else:
+            meta = meta_writer.unflatten(rows[frame])
+            result["assets"] = meta.get(
+                "assets", {"hdr": meta.get("environment", {}).get("file")}
+            )
+            result["timing"] = meta.get("timing", {})
+        checked[frame] = result
+    return checked, corrupt
+
+
+# Summary statistics of a list of durations
+def timing_statistics(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "frames": len(values),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+        "total": float(values.sum()),
+    }
+
+
+# Combine the results of every frame into the report of the run
+def summarise(results):
+    names = {str(index): name for index, name, _ in mask_codec.palette()}
+    names[str(mask_codec.ignore_index)] = "outside palette"
+
+    classes = Counter()
+    off_palette = Counter()
+    assets = {}
+    timing = {}
+    missing = []
+    corrupt = []
+    for frame in sorted(results):
+        r = results[frame]
+        classes.update(r["classes"])
+        off_palette.update(r["off_palette"])
+        for kind, name in r["assets"].items():
+            assets.setdefault(kind, Counter())[str(name)] += 1
+        for key, value in r["timing"].items():
+            if isinstance(value, (int, float)):
+                timing.setdefault(key, []).append(value)
+        missing += r["missing"]
+        corrupt += r["corrupt"]
+
+    total = sum(classes.values())
+    return {
+        "frames": len(results),
+        "problem_frames": sum(
+            1 for r in results.values() if len(r["missing"]) + len(r["corrupt"]) > 0
+        ),
+        "missing": missing,
+        "corrupt": corrupt,
+        "classes": {
+            names.get(k, "index {}".format(k)): {
+                "pixels": v,
+                "fraction": v / total if total > 0 else 0.0,
+            }
+            for k, v in sorted(classes.items(), key=lambda kv: int(kv[0]))
+        },
+        "off_palette": dict(off_palette.most_common()),
+        "assets": {k: dict(v.most_common()) for k, v in sorted(assets.items())},
+        "timing": {k: timing_statistics(v) for k, v in sorted(timing.items())},
+    }
+
+
+def print_report(report):
+    print(
+        "[INFO] {} frames, {} with missing or corrupt files".format(
+            report["frames"], report["problem_frames"]
+        )
+    )
+    for kind in ["missing", "corrupt"]:
+        for file in report[kind][:print_limit]:
+            print("[WARN] {}: {}".format(kind.capitalize(), file))
+        if len(report[kind]) > print_limit:
+            print(
+                "[WARN] ... and {} more {} files".format(
+                    len(report[kind]) - print_limit, kind
+                )
+            )
+
+    print("[INFO] Class pixel frequencies")
+    for name, c in report["classes"].items():
+        print(
+            "    {:<16} {:>8.4%} ({} pixels)".format(name, c["fraction"], c["pixels"])
+        )
+
+    if len(report["off_palette"]) > 0:
+        print(
+            "[WARN] {} mask colours outside the palette, most common:".format(
+                len(report["off_palette"])
+            )
+        )
+        for colour, count in list(report["off_palette"].items())[:print_limit]:
+            print("    {} ({} pixels)".format(colour, count))
+
+    for kind, usage in report["assets"].items():
+        counts = list(usage.values())
+        print(
+            "[INFO] {} {} used, {} to {} frames each".format(
+                len(usage), kind, min(counts), max(counts)
+            )
+        )
+
+    for key, t in report["timing"].items():
+        print(
+            "[INFO] Timing {}: mean {:.2f}s, p50 {:.2f}s, p95 {:.2f}s, max {:.2f}s".format(
+                key, t["mean"], t["p50"], t["p95"], t["max"]
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the outputs of a run and report statistics of the dataset"
+    )
+    parser.add_argument("run_dir", help="output directory of the run")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rescan frames which are already in the cache",
+    )
+    args = parser.parse_args()
+
+    # Point the output config at the run instead of claiming a new run directory
+    os.environ["NUPBR_OUTPUT_DIR"] = os.path.abspath(args.run_dir)
+    from config import output_config as out_cfg
+    import meta_writer
+
+    run_dir = out_cfg.output_dir
+    dirnames = {
+        "image": out_cfg.image_dirname,
+        "mask": out_cfg.mask_dirname,
+        "depth": out_cfg.depth_dirname,
+        "instance": out_cfg.instance_dirname,
+        "mask_rle": out_cfg.mask_rle_dirname,
+        "meta": out_cfg.meta_dirname,
+    }
+    # Outputs are only expected in the directories the run wrote
+    dirs = {
+        k: d
+        for k, d in dirnames.items()
+        if os.path.isdir(os.path.join(run_dir, d))
+        and (
+            k in ["image", "mask", "meta"]
+            or len(os.listdir(os.path.join(run_dir, d))) > 0
+        )
+    }
+    # Runs that only wrote meta tables have a table row per frame instead of a meta file
+    meta_dir = os.path.join(run_dir, out_cfg.meta_dirname)
+    table = os.path.isdir(meta_dir) and meta_writer.table_only(meta_dir)
+    if table:
+        del dirs["meta"]
+    # Until postprocess.py has run, runs with postprocessed imperfections only have clean renders
+    clean_dir = os.path.join(run_dir, out_cfg.clean_dirname)
+    image_dir = os.path.join(run_dir, out_cfg.image_dirname)
+    if os.path.isdir(clean_dir) and len(os.listdir(image_dir)) == 0:
+        dirs["image"] = out_cfg.clean_dirname
+
+    frames = list_outputs(run_dir, dirs.values())
+    signatures = {f: signature(files) for f, files in frames.items()}
+
+    cache = ScanCache(os.path.join(run_dir, "validation.sqlite"))
+    try:
+        results = {} if args.force else cache.results(signatures)
+        tasks = sorted(f for f in frames if f not in results)
+        print(
+            "[INFO] Scanning {} new or changed frames of {} in '{}'".format(
+                len(tasks), len(frames), run_dir
+            )
+        )
+
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            scanned = (
+                pool.map(
+                    scan_frame,
+                    [run_dir] * len(tasks),
+                    tasks,
+                    [frames[f] for f in tasks],
+                    [dirs] * len(tasks),
+                    chunksize=16,
+                )
+                if tasks
+                else []
+            )
+            rows = []
+            for frame, result in zip(tasks, scanned):
+                results[frame] = result
+                rows.append((frame, signatures[frame], result))
+                # Keep what was scanned if the scan is interrupted
+                if len(rows) >= commit_size:
+                    cache.store(rows)
+                    rows = []
+            cache.store(rows)
+
+        cache.prune(frames)
+    finally:
+        cache.close()
+
+    corrupt = []
+    if table:
+        results, corrupt = check_table(
+            results, meta_dir, out_cfg.meta_dirname, out_cfg.filename_len
+        )
+
+    report = summarise(results)
+    report["corrupt"] += corrupt
+    with open(os.path.join(run_dir, "validation.json"), "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+
+    print_report(report)
+    print(
+        "[INFO] Report written to '{}'".format(os.path.join(run_dir, "validation.json"))
+    )
+
+
+if __name__ == "__main__":
+    main()
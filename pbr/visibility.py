@@ -0,0 +1,177 @@
+import bpy
+import numpy as np
+
+from mathutils import Vector
+
+from config import blend_config as blend_cfg
+from config import scene_config
+
+import projection
+
+# Cheap checks of what a randomised frame will show, made before it is rendered (see scene_config.frame_filter)
+# Objects are located in the image by projecting the corners of their bounding boxes with the camera model, and the
+# ball's occlusion is tested by casting rays from the camera, which takes milliseconds instead of a render
+
+
+# Resolution of the rendered masks
+def mask_resolution():
+    return [
+        int(r * blend_cfg.render["dimensions"]["percentage"] / 100)
+        for r in blend_cfg.render["dimensions"]["resolution"]
+    ]
+
+
+# An object and all of its descendants
+def with_children(obj):
+    objs = [obj]
+    for child in obj.children:
+        objs += with_children(child)
+    return objs
+
+
+# World coordinates of the bounding box corners of objects and their descendants
+def box_corners(objs):
+    corners = []
+    for obj in objs:
+        for o in with_children(obj):
+            if o.type != "MESH" or o.hide_render:
+                continue
+            m = np.array(o.matrix_world)
+            box = np.array([tuple(c) for c in o.bound_box], dtype=np.float64)
+            corners.append(box @ m[:3, :3].T + m[:3, 3])
+    return np.concatenate(corners) if len(corners) > 0 else np.zeros((0, 3))
+
+
+# Pixel box (x0, y0, x1, y1) an object covers within the image, or None if it is out of view
+# Only corners the camera can see are used, so boxes of objects partly behind a camera are approximate
+def image_box(objs, cam, cam_config, resolution):
+    width, height = resolution
+    pixels, valid = projection.project_points(
+        box_corners(objs),
+        cam_config,
+        cam.cam.sensor_width,
+        cam.obj.matrix_world,
+        width,
+        height,
+    )
+    if not valid.any():
+        return None
+
+    x0, y0 = np.clip(pixels[valid].min(axis=0), 0, [width, height])
+    x1, y1 = np.clip(pixels[valid].max(axis=0), 0, [width, height])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (float(x0), float(y0), float(x1), float(y1))
+
+
+def box_area(box):
+    return 0.0 if box is None else (box[2] - box[0]) * (box[3] - box[1])
+
+
+# Whether a world point is within the image
+def in_view(point, cam, cam_config, resolution):
+    width, height = resolution
+    pixels, valid = projection.project_points(
+        [tuple(point)],
+        cam_config,
+        cam.cam.sensor_width,
+        cam.obj.matrix_world,
+        width,
+        height,
+    )
+    x, y = pixels[0]
+    return bool(valid[0]) and 0 <= x < width and 0 <= y < height
+
+
+# Fraction of rays from the camera to the centre and four points around the centre of an object which reach it
+# Objects hidden from the render (e.g. the field of a semi-synthetic environment) don't block rays
+def visible_fraction(obj, cam):
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    origin = cam.obj.matrix_world.translation
+    centre = obj.matrix_world.translation
+    radius = max(obj.dimensions) / 4.0
+
+    # Points around the centre, perpendicular to the line of sight
+    view = (centre - origin).normalized()
+    side = view.cross(Vector((0.0, 0.0, 1.0)))
+    if side.length < 1e-6:
+        side = Vector((1.0, 0.0, 0.0))
+    side.normalize()
+    up = side.cross(view).normalized()
+    targets = [centre] + [centre + d * radius for d in [side, -side, up, -up]]
+
+    reached = 0
+    for target in targets:
+        start = origin.copy()
+        direction = (target - start).normalized()
+        for _ in range(8):
+            hit, location, _, _, hit_obj, _ = bpy.context.scene.ray_cast(
+                depsgraph, start, direction, distance=(target - start).length + radius
+            )
+            if not hit:
+                break
+            if hit_obj.name == obj.name:
+                reached += 1
+                break
+            if not hit_obj.hide_render:
+                break
+            # Continue past objects which aren't rendered
+            start = location + direction * 1e-4
+
+    return reached / len(targets)
+
+
+# Check a randomised frame against the frame filter's criteria
+# Returns whether the frame should be rendered, the reasons it should not and what was measured
+def check_frame(scene, frame):
+    cfg = scene_config.frame_filter
+    cam = scene["cam_l"]
+    cam_config = frame["config"]["camera"]
+    to_draw = frame["env_info"]["to_draw"]
+    resolution = mask_resolution()
+
+    reasons = []
+    stats = {}
+
+    if cfg["target_in_view"]:
+        stats["target_in_view"] = in_view(
+            frame["tracking_target"].matrix_world.translation,
+            cam,
+            cam_config,
+            resolution,
+        )
+        if not stats["target_in_view"]:
+            reasons.append("tracking target out of view")
+
+    if to_draw["ball"]:
+        ball = scene["ball"].obj
+        stats["ball_pixels"] = round(
+            box_area(image_box([ball], cam, cam_config, resolution)), 1
+        )
+        if stats["ball_pixels"] < cfg["min_ball_pixels"]:
+            reasons.append(
+                "ball covers {} of {} pixels".format(
+                    stats["ball_pixels"], cfg["min_ball_pixels"]
+                )
+            )
+        elif cfg["min_ball_visible"] > 0:
+            stats["ball_visible"] = visible_fraction(ball, cam)
+            if stats["ball_visible"] < cfg["min_ball_visible"]:
+                reasons.append("ball is occluded")
+
+    if cfg["min_objects"] > 0:
+        # Robots other than the camera robot, and goals when they are drawn
+        objs = [[r.obj] for r in scene["robots"][1:] + scene["misc_robots"]]
+        if to_draw["goal"]:
+            objs += [[g.obj, g.rear] for g in scene["goals"]]
+        stats["objects"] = sum(
+            box_area(image_box(o, cam, cam_config, resolution))
+            >= cfg["min_object_pixels"]
+            for o in objs
+        )
+        if stats["objects"] < cfg["min_objects"]:
+            reasons.append(
+                "{} of {} objects in view".format(stats["objects"], cfg["min_objects"])
+            )
+
+    return len(reasons) == 0, reasons, stats
@@ -0,0 +1,99 @@
+#!/usr/local/bin/blender -P
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+# Add our current position to path to include package
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import pbr
+import util
+
+# Long lived Blender worker which constructs the scene once and then renders frame plans on demand
+# Requests and responses are newline delimited JSON objects sent over a unix socket
+#   * {"command": "render", "plan": {...}} renders a frame plan (see pbr.render_plan)
+#   * {"command": "ping"} checks the worker is alive
+#   * {"command": "shutdown"} stops the worker
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="worker.py")
+    parser.add_argument(
+        "--socket", required=True, help="path of the unix socket to serve"
+    )
+    pbr.add_scene_args(parser)
+    return parser.parse_args(argv)
+
+
+def handle(scene, request):
+    command = request.get("command")
+
+    if command == "ping":
+        return {"status": "ok"}
+
+    if command == "render":
+        start = time.time()
+        num_frames = pbr.render_plan(scene, request["plan"])
+        # Frames leave behind images and materials that nothing uses any more
+        util.purge_orphans()
+        return {
+            "status": "done",
+            "frames": num_frames,
+            "seconds": time.time() - start,
+        }
+
+    return {"status": "error", "message": "unknown command '{}'".format(command)}
+
+
+def serve(scene, socket_path):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    print("[INFO] Worker listening on '{}'".format(socket_path))
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("rw") as stream:
+                for line in stream:
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        response = {"status": "error", "message": str(e)}
+                    else:
+                        if request.get("command") == "shutdown":
+                            stream.write(json.dumps({"status": "ok"}) + "\n")
+                            stream.flush()
+                            return
+                        response = handle(scene, request)
+                    stream.write(json.dumps(response) + "\n")
+                    stream.flush()
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def main():
+    args = parse_args()
+
+    pbr.apply_scene_args(args)
+    start = time.time()
+    scene = pbr.build_scene()
+    print("[INFO] Scene constructed in {:.1f}s".format(time.time() - start))
+
+    serve(scene, args.socket)
+
+
+if __name__ == "__main__":
+    main()